@@ -0,0 +1,110 @@
+"""
+Compare the pickled langchain docstore with the columnar docstore of the files API indexes.
+Each format is loaded in a fresh process, reporting the load time, the resident memory it adds,
+and the time of random row lookups as done when resolving FAISS search results.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python benchmarks/docstore_load.py --chunks 100000
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from langchain_core.documents import Document
+
+from cortex.storage.docstore import ColumnarDocstore
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def write_pickle(folder: str, documents, ids):
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    docstore = InMemoryDocstore(dict(zip(ids, documents)))
+    index_to_docstore_id = dict(enumerate(ids))
+    with open(os.path.join(folder, "index.pkl"), "wb") as f:
+        pickle.dump((docstore, index_to_docstore_id), f)
+
+
+def measure(fmt: str, folder: str, rows: int, lookups: int, queue):
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    if fmt == "pickle":
+        with open(os.path.join(folder, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        get = lambda row: docstore.search(index_to_docstore_id[row])
+    else:
+        docstore = ColumnarDocstore(folder)
+        get = docstore.get
+    load_time = time.perf_counter() - start
+    memory = _rss_bytes() - rss_before
+
+    sample = random.Random(0).sample(range(rows), min(lookups, rows))
+    start = time.perf_counter()
+    for row in sample:
+        get(row)
+    lookup_time = (time.perf_counter() - start) / len(sample)
+    queue.put({
+        "format": fmt,
+        "load_ms": load_time * 1000,
+        "memory_mb": memory / 2 ** 20,
+        "lookup_us": lookup_time * 1e6,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    words = ["brain", "smith", "vector", "index", "chunk", "query", "faiss", "essay", "paul", "graham"]
+    documents = [
+        Document(
+            page_content=" ".join(rng.choice(words) for _ in range(args.chunk_size // 6)),
+            metadata={"source": f"uploads/file-{i % 7}.txt"},
+        )
+        for i in range(args.chunks)
+    ]
+    ids = [str(uuid.uuid4()) for _ in documents]
+
+    folder = tempfile.mkdtemp(prefix="bench-docstore-")
+    try:
+        write_pickle(folder, documents, ids)
+        ColumnarDocstore.write(folder, documents, ids=ids)
+        del documents
+        sizes = {
+            "pickle": os.path.getsize(os.path.join(folder, "index.pkl")),
+            "columnar": sum(
+                os.path.getsize(os.path.join(folder, name))
+                for name in os.listdir(folder) if name != "index.pkl"
+            ),
+        }
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        print(f"{'format':>10} | {'disk_mb':>10} | {'load_ms':>10} | {'memory_mb':>10} | {'lookup_us':>10}")
+        for fmt in ("pickle", "columnar"):
+            process = context.Process(target=measure, args=(fmt, folder, args.chunks, args.lookups, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            print(
+                f"{fmt:>10} | {sizes[fmt] / 2 ** 20:>10.2f} | {result['load_ms']:>10.2f} | "
+                f"{result['memory_mb']:>10.2f} | {result['lookup_us']:>10.2f}"
+            )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare the vector store backends on synthetic, clustered embeddings.
+Reports build time, memory, on-disk size, recall@k against an exact search, and query latency.
+Pass `--shards N` to measure the scatter-gather search over N shards.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python benchmarks/vector_backends.py --size 100000 --dim 768
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from cortex.retrieval.backends import VectorBackend
+from cortex.retrieval.backends.sharded import ShardedBackend
+
+
+BACKENDS = {
+    "chroma": ("chroma", {}),
+    "faiss-flat": ("faiss", {"index_type": "flat"}),
+    "faiss-ivfpq": ("faiss", {"index_type": "ivfpq", "index_options": {"nlist": 256, "pq_m": 16, "nprobe": 16}}),
+    "faiss-hnsw": ("faiss", {"index_type": "hnsw", "index_options": {"hnsw_m": 32, "ef_search": 64}}),
+}
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _dir_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def make_dataset(size: int, dim: int, queries: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(size // 1000, 8), dim)).astype(np.float32)
+    data = centers[rng.integers(len(centers), size=size)] + 0.3 * rng.normal(size=(size, dim)).astype(np.float32)
+    query = centers[rng.integers(len(centers), size=queries)] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return data.astype(np.float32), query.astype(np.float32)
+
+
+def exact_neighbors(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    norms = (data ** 2).sum(axis=1)
+    neighbors = []
+    for start in range(0, len(queries), 64):
+        q = queries[start:start + 64]
+        distances = norms[None, :] - 2 * q @ data.T
+        neighbors.append(np.argsort(distances, axis=1)[:, :k])
+    return np.vstack(neighbors)
+
+
+def run(
+    label: str, data: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, batch_size: int, shards: int
+) -> dict:
+    provider, options = BACKENDS[label]
+    directory = tempfile.mkdtemp(prefix=f"bench-{label}-")
+    try:
+        rss_before = _rss_bytes()
+        backend = VectorBackend.of(provider, persist_directory=directory, **options)
+        if shards > 1:
+            backend = ShardedBackend(backend, shards=shards)
+        start = time.perf_counter()
+        for offset in range(0, len(data), batch_size):
+            batch = data[offset:offset + batch_size]
+            ids = [str(i) for i in range(offset, offset + len(batch))]
+            backend.add_texts(
+                "bench",
+                texts=[f"chunk {i}" for i in ids],
+                metadatas=[{"source": f"tag-{int(i) % 10}"} for i in ids],
+                ids=ids,
+                embeddings=batch.tolist(),
+            )
+        backend.flush("bench")
+        build_time = time.perf_counter() - start
+        memory = _rss_bytes() - rss_before
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            results = backend.search_by_vector("bench", query.tolist(), k)
+            latencies.append(time.perf_counter() - start)
+            hits += len({int(doc.id) for doc, _ in results} & set(expected.tolist()))
+        return {
+            "backend": label if shards == 1 else f"{label}x{shards}",
+            "build_s": build_time,
+            "memory_mb": memory / 2 ** 20,
+            "disk_mb": _dir_bytes(directory) / 2 ** 20,
+            f"recall@{k}": hits / (len(queries) * k),
+            "p50_ms": np.percentile(latencies, 50) * 1000,
+            "p99_ms": np.percentile(latencies, 99) * 1000,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--shards", type=int, default=1, help="split every backend into N shards")
+    args = parser.parse_args()
+
+    data, queries = make_dataset(args.size, args.dim, args.queries)
+    truth = exact_neighbors(data, queries, args.top_k)
+    rows = [
+        run(label, data, queries, truth, args.top_k, args.batch_size, args.shards)
+        for label in args.backends.split(",")
+    ]
+    columns = list(rows[0].keys())
+    print(" | ".join(f"{column:>12}" for column in columns))
+    for row in rows:
+        print(" | ".join(
+            f"{value:>12.3f}" if isinstance(value, float) else f"{value:>12}" for value in row.values()
+        ))
+
+
+if __name__ == "__main__":
+    main()
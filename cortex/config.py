@@ -15,8 +15,53 @@ class Settings(BaseSettings):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     ollama_base_url: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     file_collection_folder: str = "tests/corpus"
+    # Search API of a remote cortex node for the agents to retrieve from, in process when empty
+    search_api_url: str = ""
+    search_api_token: str = ""
+    # Compiled agent graphs and chat models kept by the chat, least recently used evicted first
+    agent_cache_size: int = 32
+    # Chat history sent to the agents: token budget of the prompt, and turns always kept verbatim
+    history_token_budget: int = 3000
+    history_keep_turns: int = 4
+    # Answers of the context agent reused for questions at least this similar, and kept per collection version
+    answer_cache_threshold: float = 0.95
+    answer_cache_size: int = 256
+    # Memory budget of the per-file indexes cached by the files API
+    file_index_cache_mb: int = 512
+    vector_backend: str = "chroma"     # chroma | faiss | pgvector
+    faiss_index_type: str = "flat"     # flat | ivfpq | hnsw
+    # Tuning of the FAISS index, e.g. {"nlist": 1024, "pq_m": 16, "pq_nbits": 8, "nprobe": 16, "hnsw_m": 32, "ef_search": 64}
+    faiss_index_options: dict = {}
+    # Number of shards of the collections, and per-collection overrides e.g. {"wiki": 8}
+    vector_shards: int = 1
+    vector_shards_by_collection: dict = {}
+    embedding_batch_size: int = 32
+    embedding_dimensions: int = 768
+    # Optional SQLAlchemy URL of a Postgres read replica, used for the pgvector searches
+    pgvector_read_url: str = ""
+    # Tuning of the pgvector backend, e.g. {"hnsw_m": 16, "ef_construction": 64, "ef_search": 64, "iterative_scan": "relaxed_order"}
+    pgvector_options: dict = {}
+    # Map-reduce summarization: concurrent LLM calls, and token budget of the collapsed summaries
+    summarize_max_concurrency: int = 4
+    summarize_token_max: int = 1000
+    # Expiry of the cached web page summaries
+    summary_cache_ttl_seconds: int = 7 * 86400
+    # Pooled fetching of the web pages to summarize: connections overall and per host
+    fetch_max_connections: int = 100
+    fetch_per_host_limit: int = 4
+    # Worker processes of the Docling converter pool, optionally started along with the API
+    docling_workers: int = 2
+    docling_prewarm: bool = False
+    # Converted documents cached by content, and the size bound of the cache
+    conversion_cache_dir: str = "conversion_cache"
+    conversion_cache_mb: int = 2048
     redis_host: str = "localhost"
     redis_port: int = 6379
+    # Shared state of the API workers: expiry of the sessions and progress, and local read cache
+    state_ttl_seconds: int = 86400
+    state_local_cache_seconds: float = 1.0
+    # A running embedding task not heard from for this long is considered dead
+    task_lease_seconds: int = 300
     postgre_host: str = "localhost"
     postgre_port: int = 5432
     postgres_password: str
@@ -1,13 +1,14 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException, Request
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.staticfiles import StaticFiles
 
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from cortex.routers import embedding, chunk, search, summarize, auth, oauth, files
+from cortex.routers import embedding, chunk, search, summarize, auth, oauth, files, convert, chat
 from cortex.config import settings
-from cortex.middleware import log_requests
+from cortex.middleware import LogRequestsMiddleware
 
 
 class SPAStaticFiles(StaticFiles):
@@ -37,7 +38,19 @@ https://github.com/danielcdai/brainsmith
 """
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the Docling workers with the API instead of on the first conversion
+    if settings.docling_prewarm:
+        from cortex.retrieval.converter_pool import get_converter_pool
+        get_converter_pool().warm()
+    yield
+    from cortex.retrieval.summary_cache import aclose_http_clients
+    await aclose_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(embedding.router)
 app.include_router(chunk.router)
 app.include_router(search.router)
@@ -46,6 +59,8 @@ app.add_middleware(SessionMiddleware, secret_key="brainsmith")
 app.include_router(summarize.router)
 app.include_router(oauth.router)
 app.include_router(files.router)
+app.include_router(convert.router)
+app.include_router(chat.router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -53,7 +68,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
-app.add_middleware(BaseHTTPMiddleware, dispatch=log_requests)
+app.add_middleware(LogRequestsMiddleware)
 
 
 def verify_bearer_token(request: Request):
@@ -1,17 +1,30 @@
-from fastapi import Request
 from cortex.brainsmith_logger import log
 import time
 
 
-async def log_requests(request: Request, call_next):
-    start = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start
-    process_time_formatted = time.strftime("%H:%M:%S", time.gmtime(process_time)) + f":{int((process_time % 1) * 1000):03d}"
-    log_dict = {
-        "url": request.url.path,
-        "method": request.method,
-        "process_time": process_time_formatted,
-    }
-    log.debug(log_dict)
-    return response
\ No newline at end of file
+class LogRequestsMiddleware:
+    """
+    Log the path, method and processing time of the HTTP requests.
+    A pure ASGI middleware: the messages of the streaming responses and the disconnections
+    of their clients go through unchanged, unlike with `BaseHTTPMiddleware`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.time()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            process_time = time.time() - start
+            process_time_formatted = time.strftime("%H:%M:%S", time.gmtime(process_time)) + f":{int((process_time % 1) * 1000):03d}"
+            log_dict = {
+                "url": scope["path"],
+                "method": scope["method"],
+                "process_time": process_time_formatted,
+            }
+            log.debug(log_dict)
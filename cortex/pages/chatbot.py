@@ -82,17 +82,17 @@ if prompt := st.chat_input("What is up?"):
     with st.chat_message("user"):
         st.markdown(prompt)
 
+    # Graphs are compiled once per model and retrieval settings, and reused by the following messages
+    from cortex.tools.agent_cache import get_default_agent, get_context_agent
     graph = None
     if st.session_state["embedding_name"] is None:
-        from cortex.tools.default_agent import get_default_agent_graph
         if st.session_state["chat_provider"] == "OpenAI":
-            graph = get_default_agent_graph(api_key=openai_api_key, model=st.session_state["openai_model"])
+            graph = get_default_agent(api_key=openai_api_key, model=st.session_state["openai_model"])
         elif st.session_state["chat_provider"] == "Ollama":
-            graph = get_default_agent_graph(base_url=ollama_base_url, model=ollama_model)
+            graph = get_default_agent(base_url=ollama_base_url, model=ollama_model)
     else:
-        from cortex.tools.context_agent import get_context_agent_graph
         if st.session_state["chat_provider"] == "OpenAI":
-            graph = get_context_agent_graph(
+            graph = get_context_agent(
                 st.session_state["embedding_name"], 
                 api_key=openai_api_key, 
                 model=st.session_state["openai_model"], 
@@ -100,7 +100,7 @@ if prompt := st.chat_input("What is up?"):
                 search_type=st.session_state["search_type"]
             )
         elif st.session_state["chat_provider"] == "Ollama":
-            graph = get_context_agent_graph(
+            graph = get_context_agent(
                 st.session_state["embedding_name"], 
                 base_url=ollama_base_url, 
                 model=ollama_model, 
@@ -108,13 +108,20 @@ if prompt := st.chat_input("What is up?"):
                 search_type=st.session_state["search_type"]
             )
 
+    # Long conversations are sent as a summary of the older turns followed by the latest ones
+    from cortex.tools.history import get_history_manager
+    if st.session_state["chat_provider"] == "OpenAI":
+        history = get_history_manager(api_key=openai_api_key, model=st.session_state["openai_model"])
+    else:
+        history = get_history_manager(base_url=ollama_base_url, model=ollama_model)
+
     from typing import Literal
     def stream_graph_updates(user_input: str, mode: Literal["values", "messages"] = "values"):
         st.session_state.messages.append({"role": "user", "content": user_input})
         if mode == "messages":
             ai_answer = ""
         for chunk in graph.stream(
-            {"messages": st.session_state.messages}, stream_mode=mode
+            {"messages": history.compact(st.session_state.messages)}, stream_mode=mode
         ):
             match mode:
                 case "values":
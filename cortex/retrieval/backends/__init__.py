@@ -0,0 +1,57 @@
+from functools import lru_cache
+from cortex.retrieval.backends.base import VectorBackend
+
+
+@lru_cache(maxsize=1)
+def get_backend() -> VectorBackend:
+    """
+    Return the process-wide vector backend selected by `settings.vector_backend`,
+    sharded if the settings ask for more than one shard.
+    """
+    from cortex.config import settings
+    backend = _get_storage_backend()
+    if settings.vector_shards > 1 or settings.vector_shards_by_collection:
+        from cortex.retrieval.backends.sharded import ShardedBackend
+        return ShardedBackend(
+            backend,
+            shards=settings.vector_shards,
+            shards_by_collection=settings.vector_shards_by_collection,
+        )
+    return backend
+
+
+def _get_storage_backend() -> VectorBackend:
+    import os
+    from cortex.config import settings
+    from cortex.retrieval.embedding_models import get_embeddings
+    match settings.vector_backend:
+        case "chroma":
+            return VectorBackend.of(
+                "chroma",
+                embeddings=get_embeddings(),
+                persist_directory=settings.embeddings_dir,
+            )
+        case "faiss":
+            return VectorBackend.of(
+                "faiss",
+                embeddings=get_embeddings(),
+                persist_directory=os.path.join(settings.embeddings_dir, "faiss"),
+                index_type=settings.faiss_index_type,
+                index_options=settings.faiss_index_options,
+            )
+        case "pgvector":
+            from sqlalchemy import create_engine
+            from cortex.storage.session import engine
+            return VectorBackend.of(
+                "pgvector",
+                embeddings=get_embeddings(),
+                engine=engine,
+                read_engine=create_engine(settings.pgvector_read_url) if settings.pgvector_read_url else None,
+                dimensions=settings.embedding_dimensions,
+                **settings.pgvector_options,
+            )
+        case _:
+            raise ValueError(f"Invalid vector backend: {settings.vector_backend}")
+
+
+__all__ = ["VectorBackend", "get_backend"]
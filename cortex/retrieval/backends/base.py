@@ -0,0 +1,172 @@
+import os
+import math
+import uuid
+from typing import Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+def relevance_score(distance: float) -> float:
+    """
+    Relevance of a distance between unit vectors, the Euclidean score of the LangChain vector stores.
+    """
+    return 1.0 - distance / math.sqrt(2)
+
+
+def folder_id(path: str) -> str:
+    """
+    Identity of a store folder, a folder wiped and created again gets another inode.
+    """
+    path = os.path.abspath(path)
+    inode = os.stat(path).st_ino if os.path.exists(path) else 0
+    return f"{path}:{inode}"
+
+
+class VectorBackend:
+    """
+    Base class for the vector store backends.
+    Texts are grouped into named collections and tagged through the "source" metadata.
+    Scores returned by the backends are distances, the lower the closer.
+    """
+
+    @staticmethod
+    def of(provider: str, **kwargs) -> "VectorBackend":
+        provider = provider.lower()
+        if provider == "chroma":
+            from cortex.retrieval.backends.chroma_backend import ChromaBackend
+            return ChromaBackend(**kwargs)
+        elif provider == "faiss":
+            from cortex.retrieval.backends.faiss_backend import FaissBackend
+            return FaissBackend(**kwargs)
+        elif provider == "pgvector":
+            from cortex.retrieval.backends.pgvector_backend import PgvectorBackend
+            return PgvectorBackend(**kwargs)
+        else:
+            raise ValueError(f"Invalid vector backend: {provider}")
+
+    def __init__(self, embeddings: Optional[Embeddings] = None, **kwargs):
+        """
+        :param embeddings: the embedding function used for texts and queries,
+                           may be omitted when the vectors are always given explicitly
+        """
+        self.embeddings = embeddings
+
+    def add_texts(
+        self,
+        collection: str,
+        texts: List[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        embeddings: Optional[List[List[float]]] = None,
+    ) -> List[str]:
+        """
+        Embed the texts, unless the vectors are given, and add them to the collection.
+        """
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in range(len(texts))]
+        if metadatas is None:
+            metadatas = [{} for _ in range(len(texts))]
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(texts)
+        self._add(collection, ids, texts, embeddings, metadatas)
+        return ids
+
+    def search(
+        self,
+        collection: str,
+        query: str,
+        top_k: int = 5,
+        tags: Optional[List[str]] = None,
+        search_type: Literal["similarity", "similarity_score_threshold", "mmr"] = "similarity",
+        **kwargs
+    ) -> List[Document]:
+        """
+        Embed the query once and run a similarity, thresholded similarity or MMR search over the collection.
+        The threshold search keeps the documents whose relevance score, in [0, 1] like for the LangChain
+        vector stores, is at least `score_threshold`.
+        """
+        embedding = self.embeddings.embed_query(query)
+        if search_type == "similarity":
+            return [doc for doc, _ in self.search_by_vector(collection, embedding, top_k, tags)]
+        elif search_type == "similarity_score_threshold":
+            score_threshold = kwargs.get("score_threshold")
+            if score_threshold is None:
+                raise ValueError("score_threshold is required for the similarity_score_threshold search.")
+            return [
+                doc for doc, distance in self.search_by_vector(collection, embedding, top_k, tags)
+                if relevance_score(distance) >= score_threshold
+            ]
+        elif search_type == "mmr":
+            from langchain_core.vectorstores.utils import maximal_marginal_relevance
+            fetch_k = kwargs.get("fetch_k", 20)
+            lambda_mult = kwargs.get("lambda_mult", 0.5)
+            candidates = self.search_by_vector(collection, embedding, max(fetch_k, top_k), tags)
+            if not candidates:
+                return []
+            vectors = self.get_vectors(collection, [doc.id for doc, _ in candidates])
+            selected = maximal_marginal_relevance(
+                np.array(embedding, dtype=np.float32),
+                vectors,
+                k=top_k,
+                lambda_mult=lambda_mult,
+            )
+            return [candidates[i][0] for i in selected]
+        else:
+            raise ValueError(f"Invalid search type: {search_type}")
+
+    def flush(self, collection: str):
+        """
+        Persist the pending writes of the collection, backends writing through may skip it.
+        """
+
+    def _add(
+        self,
+        collection: str,
+        ids: List[str],
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[dict],
+    ):
+        raise NotImplementedError
+
+    def search_by_vector(
+        self,
+        collection: str,
+        embedding: List[float],
+        k: int,
+        tags: Optional[List[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Return the k closest documents with their distances, optionally restricted to the tags.
+        """
+        raise NotImplementedError
+
+    def get_vectors(self, collection: str, ids: List[str]) -> List[List[float]]:
+        """
+        Return the stored vectors of the given ids, in the same order.
+        """
+        raise NotImplementedError
+
+    def delete(self, collection: str, ids: Optional[List[str]] = None, tag: Optional[str] = None):
+        """
+        Delete the documents of the collection matching either the ids or the tag.
+        Like the additions, deletions are persisted by `flush`.
+        """
+        raise NotImplementedError
+
+    def list_collections(self) -> List[str]:
+        raise NotImplementedError
+
+    def store_id(self) -> str:
+        """
+        Identity of the underlying store, which changes when the store is dropped and created again.
+        """
+        raise NotImplementedError
+
+    def tag_counts(self, collection: str) -> Dict[str, int]:
+        """
+        Return the number of documents per tag, scanning the whole collection.
+        """
+        raise NotImplementedError
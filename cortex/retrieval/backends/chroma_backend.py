@@ -0,0 +1,87 @@
+from typing import Dict, List, Optional, Tuple
+
+import chromadb
+from langchain_core.documents import Document
+
+from cortex.retrieval.backends.base import VectorBackend, folder_id
+
+
+class ChromaBackend(VectorBackend):
+    """
+    Backend on top of a local persistent Chroma store.
+    The layout is the one written by langchain_chroma, existing collections remain readable.
+    """
+
+    def __init__(self, persist_directory: str, **kwargs):
+        super(ChromaBackend, self).__init__(**kwargs)
+        self.persist_directory = persist_directory
+        self.client = chromadb.PersistentClient(persist_directory)
+
+    def _collection(self, name: str):
+        return self.client.get_or_create_collection(name)
+
+    def _add(self, collection, ids, texts, embeddings, metadatas):
+        store = self._collection(collection)
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            store.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end],
+                documents=texts[start:end],
+            )
+
+    def search_by_vector(
+        self,
+        collection: str,
+        embedding: List[float],
+        k: int,
+        tags: Optional[List[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        try:
+            store = self.client.get_collection(collection)
+        except ValueError:
+            # Searching must not create the collection
+            return []
+        results = store.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where={"source": {"$in": tags}} if tags else None,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            (Document(id=doc_id, page_content=text, metadata=metadata or {}), distance)
+            for doc_id, text, metadata, distance in zip(
+                results["ids"][0],
+                results["documents"][0],
+                results["metadatas"][0],
+                results["distances"][0],
+            )
+        ]
+
+    def get_vectors(self, collection: str, ids: List[str]) -> List[List[float]]:
+        results = self._collection(collection).get(ids=ids, include=["embeddings"])
+        vectors = dict(zip(results["ids"], results["embeddings"]))
+        return [vectors[doc_id] for doc_id in ids]
+
+    def delete(self, collection: str, ids: Optional[List[str]] = None, tag: Optional[str] = None):
+        store = self.client.get_collection(collection)
+        if ids:
+            store.delete(ids=ids)
+        if tag is not None:
+            store.delete(where={"source": tag})
+
+    def list_collections(self) -> List[str]:
+        return [collection.name for collection in self.client.list_collections()]
+
+    def store_id(self) -> str:
+        return folder_id(self.persist_directory)
+
+    def tag_counts(self, collection: str) -> Dict[str, int]:
+        all_docs = self.client.get_collection(collection).get(include=['metadatas'])
+        counts = {}
+        for metadata in all_docs['metadatas']:
+            if metadata and "source" in metadata:
+                counts[metadata["source"]] = counts.get(metadata["source"], 0) + 1
+        return counts
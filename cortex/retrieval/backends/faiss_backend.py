@@ -0,0 +1,345 @@
+import os
+import json
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Literal, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from cortex.retrieval.backends.base import VectorBackend, folder_id
+
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite3"
+LOCK_FILE = "write.lock"
+
+
+def _id_selector(rows) -> faiss.IDSelectorBatch:
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    return faiss.IDSelectorBatch(len(rows), faiss.swig_ptr(rows))
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    # Flushes replace the file, the inode tells them apart within the resolution of the mtime
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FaissCollection:
+    """
+    One collection of the FAISS backend: a FAISS index and a SQLite chunk table in one directory.
+    The FAISS ids are the SQLite row ids, so tag filters translate into id selectors.
+
+    Index types:
+    - flat: exact search, the reference for recall.
+    - ivfpq: inverted lists with product quantization, compact and fast for millions of chunks.
+             Vectors are staged in a flat index until there are enough of them to train the quantizers.
+    - hnsw: graph-based search, fast with a high recall but without native deletion.
+            Deleted rows become tombstones filtered at search time, and the graph is rebuilt
+            once they make up a significant share of the index.
+
+    Several processes may share the directory: a writer holds an exclusive file lock from its first write
+    until it flushes, starting from the latest flushed index, and readers reload the index once it is replaced.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_type: Literal["flat", "ivfpq", "hnsw"] = "flat",
+        nlist: int = 1024,
+        pq_m: int = 16,
+        pq_nbits: int = 8,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        compact_ratio: float = 0.25,
+    ):
+        self.path = path
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        # Serializes taking and releasing the write lock of the directory within the process
+        self._write_guard = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, CHUNKS_FILE), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, tag TEXT, text TEXT, metadata TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_tag ON chunks (tag)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tombstones (row INTEGER PRIMARY KEY)")
+        self.conn.commit()
+        self.lock_file = open(os.path.join(path, LOCK_FILE), "a")
+        self.writing = False
+        self.index = None
+        self.index_stamp = None
+        self.tombstones = set()
+        self._reload()
+
+    def _reload(self):
+        """
+        Load the flushed index when it was replaced since it was last loaded.
+        """
+        index_path = os.path.join(self.path, INDEX_FILE)
+        stamp = _stamp(index_path)
+        if stamp == self.index_stamp:
+            return
+        self.index = faiss.read_index(index_path) if stamp is not None else None
+        if self.index is not None:
+            self._enable_reconstruct()
+        self.index_stamp = stamp
+        self.tombstones = {row for (row,) in self.conn.execute("SELECT row FROM tombstones")}
+
+    @contextmanager
+    def _write(self):
+        """
+        Hold the in-process lock along with the write lock of the directory.
+        Unflushed writes are only visible to this process, no other writer may start from the same index.
+        The write lock is waited for first, so that waiting for another process does not hold back the searches.
+        """
+        while True:
+            with self._write_guard:
+                if not self.writing:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+                    with self.lock:
+                        self.writing = True
+                        self._reload()
+            with self.lock:
+                # Another thread may have flushed in the meantime
+                if self.writing:
+                    yield
+                    return
+
+    @property
+    def _is_staging(self) -> bool:
+        return self.index_type == "ivfpq" and faiss.try_extract_index_ivf(self.index) is None
+
+    def _new_index(self, dimension: int, trained: bool = False):
+        if self.index_type == "flat" or (self.index_type == "ivfpq" and not trained):
+            return faiss.index_factory(dimension, "IDMap2,Flat")
+        elif self.index_type == "ivfpq":
+            return faiss.index_factory(dimension, f"IVF{self.nlist},PQ{self.pq_m}x{self.pq_nbits}")
+        elif self.index_type == "hnsw":
+            return faiss.index_factory(dimension, f"IDMap2,HNSW{self.hnsw_m}")
+        else:
+            raise ValueError(f"Invalid FAISS index type: {self.index_type}")
+
+    def _enable_reconstruct(self):
+        # IVF lists are keyed by arbitrary ids, a hashtable direct map is needed to reconstruct them.
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Hashtable:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    def _live_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the ids and vectors held by an IDMap2 index, without the tombstones.
+        """
+        ids = faiss.vector_to_array(self.index.id_map)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        if self.tombstones:
+            keep = ~np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64))
+            ids, vectors = ids[keep], vectors[keep]
+        return ids, vectors
+
+    def _rebuild(self, trained: bool):
+        ids, vectors = self._live_vectors()
+        index = self._new_index(self.index.d, trained=trained)
+        if trained:
+            index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self._enable_reconstruct()
+        self.tombstones.clear()
+        self.conn.execute("DELETE FROM tombstones")
+
+    def add(self, ids: List[str], texts: List[str], embeddings: List[List[float]], metadatas: List[dict]):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._write():
+            self._delete_rows(self._rows_for_ids(ids))
+            rows = []
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                cursor = self.conn.execute(
+                    "INSERT INTO chunks (id, tag, text, metadata) VALUES (?, ?, ?, ?)",
+                    (doc_id, metadata.get("source"), text, json.dumps(metadata)),
+                )
+                rows.append(cursor.lastrowid)
+            if self.index is None:
+                self.index = self._new_index(vectors.shape[1])
+            self.index.add_with_ids(vectors, np.asarray(rows, dtype=np.int64))
+            # Faiss recommends at least 39 training points per centroid, for both the lists and the sub-quantizers.
+            if self._is_staging and self.index.ntotal >= max(self.nlist, 2 ** self.pq_nbits) * 39:
+                self._rebuild(trained=True)
+
+    def _search_params(self, selector, k: int) -> faiss.SearchParameters:
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        elif self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.ef_search, k))
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, embedding: List[float], k: int, tags: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        with self.lock:
+            if not self.writing:
+                self._reload()
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            selector = None
+            if tags:
+                rows = self._rows_for_tags(tags)
+                if not rows:
+                    return []
+                selector = _id_selector(rows)
+            elif self.tombstones:
+                # IDSelectorNot only references the excluded selector, which must outlive the search.
+                excluded = _id_selector(list(self.tombstones))
+                selector = faiss.IDSelectorNot(excluded)
+            query = np.asarray([embedding], dtype=np.float32)
+            distances, labels = self.index.search(query, k, params=self._search_params(selector, k))
+            hits = [(int(row), float(distance)) for row, distance in zip(labels[0], distances[0]) if row >= 0]
+            chunks = self._chunks_for_rows([row for row, _ in hits])
+        return [
+            (chunks[row], distance) for row, distance in hits if row in chunks
+        ]
+
+    def get_vectors(self, ids: List[str]) -> List[List[float]]:
+        with self.lock:
+            if not self.writing:
+                self._reload()
+            rows = dict(self.conn.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall())
+            return [self.index.reconstruct(rows[doc_id]).tolist() for doc_id in ids]
+
+    def delete(self, ids: Optional[List[str]] = None, tag: Optional[str] = None):
+        with self._write():
+            rows = self._rows_for_ids(ids) if ids else []
+            if tag is not None:
+                rows += self._rows_for_tags([tag])
+            self._delete_rows(rows)
+
+    def _delete_rows(self, rows: List[int]):
+        if not rows:
+            return
+        self.conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in rows])
+        if self.index_type == "hnsw":
+            self.tombstones.update(rows)
+            self.conn.executemany("INSERT OR IGNORE INTO tombstones (row) VALUES (?)", [(row,) for row in rows])
+            if len(self.tombstones) > self.compact_ratio * self.index.ntotal:
+                self._rebuild(trained=False)
+        else:
+            self.index.remove_ids(np.asarray(rows, dtype=np.int64))
+
+    def _rows_for_ids(self, ids: List[str]) -> List[int]:
+        return [row for (row,) in self.conn.execute(
+            f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+        )]
+
+    def _rows_for_tags(self, tags: List[str]) -> List[int]:
+        return [row for (row,) in self.conn.execute(
+            f"SELECT row FROM chunks WHERE tag IN ({','.join('?' * len(tags))})", tags
+        )]
+
+    def _chunks_for_rows(self, rows: List[int]) -> Dict[int, Document]:
+        if not rows:
+            return {}
+        cursor = self.conn.execute(
+            f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows
+        )
+        return {
+            row: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+            for row, doc_id, text, metadata in cursor
+        }
+
+    def tag_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT tag, COUNT(*) FROM chunks WHERE tag IS NOT NULL GROUP BY tag"
+            ).fetchall())
+
+    def flush(self):
+        """
+        Write the index atomically, commit the chunk table along with it and release the write lock.
+        """
+        with self._write_guard, self.lock:
+            if not self.writing:
+                return
+            if self.index is not None:
+                index_path = os.path.join(self.path, INDEX_FILE)
+                faiss.write_index(self.index, index_path + ".tmp")
+                os.replace(index_path + ".tmp", index_path)
+                self.index_stamp = _stamp(index_path)
+            self.conn.commit()
+            self.writing = False
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+
+class FaissBackend(VectorBackend):
+    """
+    Backend persisting each collection as a FAISS index under `persist_directory`.
+    Writes are kept in memory until `flush`, searches of the writing process always see them,
+    those of the other processes once they are flushed.
+    """
+
+    def __init__(self, persist_directory: str, index_type: str = "flat", index_options: dict = None, **kwargs):
+        super(FaissBackend, self).__init__(**kwargs)
+        self.persist_directory = persist_directory
+        self.index_type = index_type
+        self.index_options = index_options or {}
+        self._collections: Dict[str, FaissCollection] = {}
+        self._lock = threading.Lock()
+        os.makedirs(persist_directory, exist_ok=True)
+
+    def _collection(self, name: str, create: bool = True) -> Optional[FaissCollection]:
+        with self._lock:
+            if name not in self._collections:
+                path = os.path.join(self.persist_directory, name)
+                if not create and not os.path.exists(os.path.join(path, CHUNKS_FILE)):
+                    return None
+                self._collections[name] = FaissCollection(path, self.index_type, **self.index_options)
+            return self._collections[name]
+
+    def _add(self, collection, ids, texts, embeddings, metadatas):
+        self._collection(collection).add(ids, texts, embeddings, metadatas)
+
+    def search_by_vector(self, collection, embedding, k, tags=None):
+        store = self._collection(collection, create=False)
+        return store.search(embedding, k, tags) if store else []
+
+    def get_vectors(self, collection, ids):
+        return self._collection(collection).get_vectors(ids)
+
+    def delete(self, collection, ids=None, tag=None):
+        store = self._collection(collection, create=False)
+        if store is None:
+            raise ValueError(f"Collection {collection} does not exist.")
+        store.delete(ids=ids, tag=tag)
+
+    def flush(self, collection):
+        store = self._collection(collection, create=False)
+        if store is not None:
+            store.flush()
+
+    def list_collections(self):
+        return [
+            name for name in os.listdir(self.persist_directory)
+            if os.path.exists(os.path.join(self.persist_directory, name, CHUNKS_FILE))
+        ]
+
+    def tag_counts(self, collection):
+        return self._collection(collection).tag_counts()
+
+    def store_id(self):
+        return folder_id(self.persist_directory)
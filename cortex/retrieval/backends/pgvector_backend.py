@@ -0,0 +1,165 @@
+import io
+import csv
+import json
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from sqlalchemy import Engine, text
+
+from cortex.retrieval.backends.base import VectorBackend
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(repr(float(value)) for value in embedding) + "]"
+
+
+class PgvectorBackend(VectorBackend):
+    """
+    Backend storing every collection in one Postgres table, searched through a pgvector HNSW index.
+    Tags are a plain column covered by a btree index, so tag filters are indexed SQL predicates.
+    Searches may be routed to a read replica, writes and deletes are transactional on the primary.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        read_engine: Optional[Engine] = None,
+        dimensions: int = 768,
+        table: str = "vector_chunks",
+        hnsw_m: int = 16,
+        ef_construction: int = 64,
+        ef_search: int = 64,
+        iterative_scan: Optional[str] = "relaxed_order",
+        **kwargs
+    ):
+        """
+        :param read_engine: engine of a read replica for searches, the primary is used if omitted
+        :param iterative_scan: pgvector >= 0.8 "hnsw.iterative_scan" mode, None on older versions.
+                               The collection and tag filters apply after the index scan, the scan goes on
+                               until k rows pass them instead of returning less than k rows, or none for
+                               a small collection of a large table
+        """
+        super(PgvectorBackend, self).__init__(**kwargs)
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self.table = table
+        self.ef_search = ef_search
+        self.iterative_scan = iterative_scan
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "collection TEXT NOT NULL, "
+                "id TEXT NOT NULL, "
+                "tag TEXT, "
+                "content TEXT NOT NULL, "
+                "metadata JSONB NOT NULL DEFAULT '{}', "
+                f"embedding vector({dimensions}) NOT NULL, "
+                "PRIMARY KEY (collection, id))"
+            ))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table}_tag ON {table} (collection, tag)"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {table}_embedding ON {table} "
+                f"USING hnsw (embedding vector_l2_ops) WITH (m = {hnsw_m}, ef_construction = {ef_construction})"
+            ))
+
+    def _add(self, collection, ids, texts, embeddings, metadatas):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for doc_id, content, embedding, metadata in zip(ids, texts, embeddings, metadatas):
+            writer.writerow([
+                collection, doc_id, metadata.get("source"), content, json.dumps(metadata), _vector_literal(embedding)
+            ])
+        buffer.seek(0)
+        # COPY into a staging table, then upsert, so that re-added ids replace the existing rows.
+        raw = self.engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMP TABLE staging_chunks (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                cursor.copy_expert(
+                    "COPY staging_chunks (collection, id, tag, content, metadata, embedding) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buffer,
+                )
+                cursor.execute(
+                    f"INSERT INTO {self.table} SELECT * FROM staging_chunks "
+                    "ON CONFLICT (collection, id) DO UPDATE SET "
+                    "tag = EXCLUDED.tag, content = EXCLUDED.content, "
+                    "metadata = EXCLUDED.metadata, embedding = EXCLUDED.embedding"
+                )
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+    def search_by_vector(
+        self,
+        collection: str,
+        embedding: List[float],
+        k: int,
+        tags: Optional[List[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        predicate = "collection = :collection"
+        params = {"collection": collection, "query": _vector_literal(embedding), "k": k}
+        if tags:
+            predicate += " AND tag = ANY(:tags)"
+            params["tags"] = list(tags)
+        with self.read_engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {max(self.ef_search, k)}"))
+            if self.iterative_scan:
+                conn.execute(text(f"SET LOCAL hnsw.iterative_scan = {self.iterative_scan}"))
+            # The relaxed order of the iterative scan is sorted again
+            rows = conn.execute(text(
+                "SELECT * FROM ("
+                f"SELECT id, content, metadata, embedding <-> CAST(:query AS vector) AS distance "
+                f"FROM {self.table} WHERE {predicate} "
+                "ORDER BY embedding <-> CAST(:query AS vector) LIMIT :k"
+                ") AS hits ORDER BY distance"
+            ), params).fetchall()
+        return [
+            (Document(id=doc_id, page_content=content, metadata=metadata), float(distance))
+            for doc_id, content, metadata, distance in rows
+        ]
+
+    def get_vectors(self, collection: str, ids: List[str]) -> List[List[float]]:
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT id, embedding::text FROM {self.table} "
+                "WHERE collection = :collection AND id = ANY(:ids)"
+            ), {"collection": collection, "ids": list(ids)}).fetchall()
+        vectors = {doc_id: json.loads(vector) for doc_id, vector in rows}
+        return [vectors[doc_id] for doc_id in ids]
+
+    def delete(self, collection: str, ids: Optional[List[str]] = None, tag: Optional[str] = None):
+        with self.engine.begin() as conn:
+            if ids:
+                conn.execute(text(
+                    f"DELETE FROM {self.table} WHERE collection = :collection AND id = ANY(:ids)"
+                ), {"collection": collection, "ids": list(ids)})
+            if tag is not None:
+                conn.execute(text(
+                    f"DELETE FROM {self.table} WHERE collection = :collection AND tag = :tag"
+                ), {"collection": collection, "tag": tag})
+
+    def list_collections(self) -> List[str]:
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT DISTINCT collection FROM {self.table}")).fetchall()
+        return [collection for (collection,) in rows]
+
+    def tag_counts(self, collection: str) -> Dict[str, int]:
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT tag, COUNT(*) FROM {self.table} "
+                "WHERE collection = :collection AND tag IS NOT NULL GROUP BY tag"
+            ), {"collection": collection}).fetchall()
+        return {tag: count for tag, count in rows}
+
+    def store_id(self) -> str:
+        # The OID of the table changes when it is dropped and created again
+        with self.engine.connect() as conn:
+            oid = conn.execute(text("SELECT to_regclass(:table)::oid"), {"table": self.table}).scalar()
+        return f"{self.engine.url.render_as_string(hide_password=True)}/{self.table}:{oid}"
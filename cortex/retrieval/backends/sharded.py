@@ -0,0 +1,151 @@
+import os
+import re
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from cortex.retrieval.backends.base import VectorBackend
+
+
+SHARD_PATTERN = re.compile(r"^(?P<name>.+)-shard-(?P<shard>\d+)$")
+
+
+def shard_of(doc_id: str, shards: int) -> int:
+    """
+    Stable shard number of a chunk id, `hash` is salted per process and cannot be used.
+    """
+    return zlib.crc32(doc_id.encode("utf-8")) % shards
+
+
+class ShardedBackend(VectorBackend):
+    """
+    Split collections into N shards of an inner backend, routed by the hash of the chunk id.
+    Every shard is a collection of its own, "<name>-shard-<i>", with its own index.
+    Writes are grouped per shard and applied in parallel, searches fan out to all the shards
+    and the top-k are merged with a heap. Native index code releases the GIL, so threads
+    are enough to keep one core busy per shard.
+
+    Collections with a single shard are passed through to the inner backend unchanged.
+    Changing the shard count of a collection requires to embed it again.
+    """
+
+    def __init__(
+        self,
+        backend: VectorBackend,
+        shards: int = 1,
+        shards_by_collection: Dict[str, int] = None,
+        max_workers: int = None,
+        **kwargs
+    ):
+        super(ShardedBackend, self).__init__(embeddings=backend.embeddings, **kwargs)
+        self.backend = backend
+        self.shards = shards
+        self.shards_by_collection = shards_by_collection or {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count(), thread_name_prefix="shard"
+        )
+
+    def _shard_count(self, collection: str) -> int:
+        return self.shards_by_collection.get(collection, self.shards)
+
+    def _shard_names(self, collection: str) -> List[str]:
+        count = self._shard_count(collection)
+        if count <= 1:
+            return [collection]
+        return [f"{collection}-shard-{i}" for i in range(count)]
+
+    def _existing_shard_names(self, collection: str) -> List[str]:
+        existing = set(self.backend.list_collections())
+        return [name for name in self._shard_names(collection) if name in existing]
+
+    def _route(self, collection: str, ids: List[str]) -> Dict[str, List[int]]:
+        """
+        Group the positions of the ids by the name of their shard.
+        """
+        names = self._shard_names(collection)
+        routes = {}
+        for position, doc_id in enumerate(ids):
+            routes.setdefault(names[shard_of(doc_id, len(names))], []).append(position)
+        return routes
+
+    def _map(self, fn, *iterables) -> list:
+        return list(self.executor.map(fn, *iterables))
+
+    def _add(self, collection, ids, texts, embeddings, metadatas):
+        routes = self._route(collection, ids)
+
+        def add_shard(name: str):
+            positions = routes[name]
+            self.backend._add(
+                name,
+                [ids[i] for i in positions],
+                [texts[i] for i in positions],
+                [embeddings[i] for i in positions],
+                [metadatas[i] for i in positions],
+            )
+
+        self._map(add_shard, list(routes))
+
+    def search_by_vector(
+        self,
+        collection: str,
+        embedding: List[float],
+        k: int,
+        tags: Optional[List[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        names = self._shard_names(collection)
+        if len(names) == 1:
+            return self.backend.search_by_vector(collection, embedding, k, tags)
+        results = self._map(lambda name: self.backend.search_by_vector(name, embedding, k, tags), names)
+        return heapq.nsmallest(k, chain.from_iterable(results), key=lambda result: result[1])
+
+    def get_vectors(self, collection: str, ids: List[str]) -> List[List[float]]:
+        routes = self._route(collection, ids)
+        vectors = [None] * len(ids)
+
+        def get_shard(name: str):
+            positions = routes[name]
+            for i, vector in zip(positions, self.backend.get_vectors(name, [ids[i] for i in positions])):
+                vectors[i] = vector
+
+        self._map(get_shard, list(routes))
+        return vectors
+
+    def delete(self, collection: str, ids: Optional[List[str]] = None, tag: Optional[str] = None):
+        # Small collections may not have written to every shard yet
+        names = self._existing_shard_names(collection)
+        if ids:
+            routes = self._route(collection, ids)
+            self._map(
+                lambda name: self.backend.delete(name, ids=[ids[i] for i in routes[name]]),
+                [name for name in routes if name in names],
+            )
+        if tag is not None:
+            self._map(lambda name: self.backend.delete(name, tag=tag), names)
+
+    def flush(self, collection: str):
+        self._map(self.backend.flush, self._shard_names(collection))
+
+    def list_collections(self) -> List[str]:
+        names = set()
+        for name in self.backend.list_collections():
+            match = SHARD_PATTERN.match(name)
+            # Only the shards of the sharded collections, a collection may be named like a shard
+            if match and name in self._shard_names(match.group("name")):
+                name = match.group("name")
+            names.add(name)
+        return sorted(names)
+
+    def store_id(self) -> str:
+        return self.backend.store_id()
+
+    def tag_counts(self, collection: str) -> Dict[str, int]:
+        counts = {}
+        for shard_counts in self._map(self.backend.tag_counts, self._existing_shard_names(collection)):
+            for tag, count in shard_counts.items():
+                counts[tag] = counts.get(tag, 0) + count
+        return counts
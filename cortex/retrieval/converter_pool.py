@@ -0,0 +1,211 @@
+"""
+A long-lived pool of worker processes holding a ready Docling converter each.
+Building a `DocumentConverter` loads the layout and table models, which dominates the conversion
+of small documents: the workers build theirs once at start and then only pay for the parsing.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from importlib.metadata import version, PackageNotFoundError
+from typing import Optional
+
+from cortex.config import settings
+from cortex.storage.state import SharedState
+from cortex.storage.conversion_cache import ConversionCache
+
+
+# Converter of the worker process, built by the pool initializer
+_converter = None
+
+# Options of the converter, part of the key of the cached conversions
+CONVERTER_OPTIONS = {
+    "formats": ["pdf", "docx", "html", "pptx"],
+    "do_ocr": False,
+    "do_table_structure": True,
+    "docx_pipeline": "simple",
+}
+
+
+def _docling_version() -> str:
+    try:
+        return version("docling")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def create_converter():
+    """
+    The converter shared by the document QA and the summarizations, tables on and OCR off.
+    """
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.document_converter import DocumentConverter, PdfFormatOption, WordFormatOption, SimplePipeline
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = CONVERTER_OPTIONS["do_ocr"]
+    pipeline_options.do_table_structure = CONVERTER_OPTIONS["do_table_structure"]
+    converter = DocumentConverter(
+        allowed_formats=[
+            InputFormat.PDF,
+            InputFormat.DOCX,
+            InputFormat.HTML,
+            InputFormat.PPTX,
+        ],
+        format_options={
+            InputFormat.PDF: PdfFormatOption(
+                pipeline_options=pipeline_options,
+            ),
+            InputFormat.DOCX: WordFormatOption(
+                pipeline_cls=SimplePipeline
+            )
+        }
+    )
+    # Load the models of the PDF pipeline now rather than on the first document
+    converter.initialize_pipeline(InputFormat.PDF)
+    return converter
+
+
+def get_document_format(file_path):
+    """Determine the document format based on file extension, None when Docling does not convert it"""
+    from docling.datamodel.base_models import InputFormat
+    extension = os.path.splitext(str(file_path))[1].lower()
+    format_map = {
+        '.pdf': InputFormat.PDF,
+        '.docx': InputFormat.DOCX,
+        '.doc': InputFormat.DOCX,
+        '.pptx': InputFormat.PPTX,
+        '.html': InputFormat.HTML,
+        '.htm': InputFormat.HTML
+    }
+    return format_map.get(extension, None)
+
+
+def _init_worker():
+    global _converter
+    _converter = create_converter()
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def _convert(source: str) -> tuple:
+    result = _converter.convert(source)
+    if not result or not result.document:
+        raise ValueError(f"Failed to convert document: {source}")
+    return result.document.export_to_markdown(), json.dumps(result.document.export_to_dict())
+
+
+class ConverterPool:
+    """
+    Converts documents to markdown in `workers` processes with warm converters.
+    Conversions are either awaited through `convert`, or run as jobs whose state is shared by
+    the API workers: `submit` returns a job id to poll with `job_status`.
+    Conversions of local files are cached by content, a file converted before is not parsed again.
+    """
+
+    def __init__(self, workers: int, cache: Optional[ConversionCache] = None):
+        self.workers = workers
+        self.cache = cache
+        self.options = {**CONVERTER_OPTIONS, "docling": _docling_version()}
+        self.jobs = SharedState("convert:job", ttl=settings.state_ttl_seconds)
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Spawn the workers, forking the threaded API process is not safe
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            try:
+                return self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory on a huge document), start over with a new pool
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._create_executor()
+                return self._executor.submit(fn, *args)
+
+    def warm(self):
+        """
+        Start every worker and wait for its converter to be ready.
+        """
+        pids = set()
+        while len(pids) < self.workers:
+            # Idle workers answer at once, the others once their converter is built
+            pids.update(future.result() for future in [self._submit(_ready) for _ in range(self.workers)])
+            time.sleep(0.1)
+
+    def _cache_key(self, source: str) -> Optional[str]:
+        # Pages behind URLs may change, only local files are cached
+        if self.cache is None or not os.path.isfile(source):
+            return None
+        return ConversionCache.key(source, self.options)
+
+    def convert(self, source: str, timeout: float = None) -> str:
+        """
+        Convert a local path or a URL to markdown, blocking until done.
+        """
+        key = self._cache_key(source)
+        if key is not None:
+            markdown = self.cache.get(key)
+            if markdown is not None:
+                return markdown
+        markdown, document_json = self._submit(_convert, source).result(timeout=timeout)
+        if key is not None:
+            self.cache.put(key, markdown, document_json)
+        return markdown
+
+    def submit(self, source: str, cleanup: bool = False) -> str:
+        """
+        Start converting the source, return the id of the job.
+        With `cleanup`, the source file is deleted once converted.
+        """
+        job_id = str(uuid.uuid4())
+        key = self._cache_key(source)
+        markdown = self.cache.get(key) if key is not None else None
+        if markdown is not None:
+            self.jobs.set(job_id, {"status": "completed", "source": os.path.basename(source), "markdown": markdown})
+            if cleanup:
+                os.remove(source)
+            return job_id
+
+        self.jobs.set(job_id, {"status": "pending", "source": os.path.basename(source)})
+        future = self._submit(_convert, source)
+
+        def done(future: Future):
+            job = {"status": "completed", "source": os.path.basename(source)}
+            try:
+                job["markdown"], document_json = future.result()
+                if key is not None:
+                    self.cache.put(key, job["markdown"], document_json)
+            except Exception as e:
+                job = {"status": "failed", "source": os.path.basename(source), "error": str(e)}
+            self.jobs.set(job_id, job)
+            if cleanup and os.path.exists(source):
+                os.remove(source)
+
+        future.add_done_callback(done)
+        return job_id
+
+    def job_status(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@lru_cache
+def get_converter_pool() -> ConverterPool:
+    cache = ConversionCache(settings.conversion_cache_dir, settings.conversion_cache_mb * 2 ** 20)
+    return ConverterPool(settings.docling_workers, cache=cache)
@@ -1,19 +1,18 @@
 import os
-import tempfile
-import shutil
+import json
+import hashlib
 from pathlib import Path
 from IPython.display import Markdown, display
 
 # Docling imports
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions, TesseractCliOcrOptions
-from docling.document_converter import DocumentConverter, PdfFormatOption, WordFormatOption, SimplePipeline
+from cortex.retrieval.converter_pool import get_converter_pool, get_document_format
+from cortex.retrieval.embedding_models import get_embeddings
+from cortex.retrieval.file_index import FileIndexRetriever, ensure_file_index
 
 # LangChain imports
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
-from langchain_community.vectorstores import FAISS
+from langchain_ollama import OllamaLLM
 from langchain.chains.history_aware_retriever import create_history_aware_retriever
 from langchain.chains.retrieval import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
@@ -21,93 +20,44 @@ from langchain.memory import ConversationBufferMemory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 
-def get_document_format(file_path) -> InputFormat:
-    """Determine the document format based on file extension"""
-    try:
-        file_path = str(file_path)
-        extension = os.path.splitext(file_path)[1].lower()
-        format_map = {
-            '.pdf': InputFormat.PDF,
-            '.docx': InputFormat.DOCX,
-            '.doc': InputFormat.DOCX,
-            '.pptx': InputFormat.PPTX,
-            '.html': InputFormat.HTML,
-            '.htm': InputFormat.HTML
-        }
-        return format_map.get(extension, None)
-    except:
-        return "Unsupported document format: {str(e)}"
-
 def convert_document_to_markdown(doc_path) -> str:
-    """Convert document to markdown using simplified pipeline"""
-    try:
-        # Convert to absolute path string
-        input_path = os.path.abspath(str(doc_path))
-        print(f"Converting document: {doc_path}")
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Copy input file to temp directory
-            temp_input = os.path.join(temp_dir, os.path.basename(input_path))
-            shutil.copy2(input_path, temp_input)
-            # Configure pipeline options
-            pipeline_options = PdfPipelineOptions()
-            pipeline_options.do_ocr = False # Disable OCR temporarily
-            pipeline_options.do_table_structure = True
-            # Create converter with minimal options
-            converter = DocumentConverter(
-                allowed_formats=[
-                    InputFormat.PDF,
-                    InputFormat.DOCX,
-                    InputFormat.HTML,
-                    InputFormat.PPTX,
-                ],
-                format_options={
-                    InputFormat.PDF: PdfFormatOption(
-                        pipeline_options=pipeline_options,
-                    ),
-                    InputFormat.DOCX: WordFormatOption(
-                        pipeline_cls=SimplePipeline
-                    )
-                }
-            )
-
-            # Convert document
-            print("Starting conversion...")
-            conv_result = converter.convert(temp_input)
-            if not conv_result or not conv_result.document:
-                raise ValueError(f"Failed to convert document: {doc_path}")
-            # Export to markdown
-            print("Exporting to markdown...")
-            md = conv_result.document.export_to_markdown()
-
-            # Create output path
-            output_dir = os.path.dirname(input_path)
-            base_name = os.path.splitext(os.path.basename(input_path))[0]
-            md_path = os.path.join(output_dir, f"{base_name}_converted.md")
-
-            # Write markdown file
-            print(f"Writing markdown to: {base_name}_converted.md")
-            with open(md_path, "w", encoding="utf-8") as fp:
-                fp.write(md)
-            return md_path
-    except:
-        return f"Error converting document: {doc_path}"
-
-
-def setup_qa_chain(markdown_path: Path, embeddings_model_name:str = "nomic-embed-text:latest", model_name: str = "deepseek-r1:14b-qwen-distill-q8_0"):
-    """Set up the QA chain for document processing"""
-    # Load and split the document
-    loader = UnstructuredMarkdownLoader(str(markdown_path))
-    documents = loader.load()
+    """Convert document to markdown with the warm converters of the pool"""
+    # Convert to absolute path string
+    input_path = os.path.abspath(str(doc_path))
+    print(f"Converting document: {doc_path}")
+    # The pool workers read the input in place, and the markdown is kept by the conversion cache
+    return get_converter_pool().convert(input_path)
+
+
+# Splitting of the documents, part of the key of their persisted index
+QA_CHUNKING = {"chunk_size": 1000, "chunk_overlap": 200}
+
+
+def qa_index_id(markdown: str, embeddings_model_name: str) -> str:
+    """Id of the persisted index of a document, by content, embedding model and splitting"""
+    digest = hashlib.sha256(json.dumps([embeddings_model_name, QA_CHUNKING]).encode("utf-8"))
+    digest.update(markdown.encode("utf-8"))
+    return f"qa-{digest.hexdigest()[:32]}"
+
+
+def split_markdown(markdown: str):
+    """Extract the text of the markdown as UnstructuredMarkdownLoader does, and split it"""
+    from unstructured.partition.md import partition_md
+    text = "\n\n".join(str(element) for element in partition_md(text=markdown))
+    documents = [Document(page_content=text)]
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
         length_function=len,
+        **QA_CHUNKING,
     )
-    texts = text_splitter.split_documents(documents)
-    # Create embeddings and vector store
-    embeddings = OllamaEmbeddings(model=embeddings_model_name)
-    vectorstore = FAISS.from_documents(texts, embeddings)
+    return text_splitter.split_documents(documents)
+
+
+def setup_qa_chain(markdown: str, embeddings_model_name:str = "nomic-embed-text:latest", model_name: str = "deepseek-r1:14b-qwen-distill-q8_0"):
+    """Set up the QA chain for document processing"""
+    # The document is only split and embedded the first time, later sessions load its index from disk
+    embeddings = get_embeddings("ollama", embeddings_model_name)
+    file_id = qa_index_id(markdown, embeddings_model_name)
+    ensure_file_index(file_id, lambda: split_markdown(markdown), embeddings)
     # Initialize LLM
     llm = OllamaLLM(
         model=model_name,
@@ -119,7 +69,7 @@ def setup_qa_chain(markdown_path: Path, embeddings_model_name:str = "nomic-embed
         output_key="answer",
         return_messages=True
     )
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
+    retriever = FileIndexRetriever(file_id=file_id, embeddings=embeddings, k=10)
     # Build a prompt to rephrase a follow-up question given the chat history.
     rephrase_system_prompt = (
         "Given the chat history and the follow-up question, reformulate the question "
@@ -170,8 +120,8 @@ if __name__ == "__main__":
     # Check format and process
     doc_format = get_document_format(doc_path)
     if doc_format:
-        md_path = convert_document_to_markdown(doc_path)
-        qa_chain, chat_history = setup_qa_chain(md_path)
+        markdown = convert_document_to_markdown(doc_path)
+        qa_chain, chat_history = setup_qa_chain(markdown)
         # Example questions
         questions = [
             "1. Why did the author want to get rich?",
@@ -1,12 +1,12 @@
 from pydantic import BaseModel
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
 from typing import List
 from cortex.config import settings
 from cortex.storage.tasks import update_task, load_task_by_id, load_all_tasks
-import chromadb
+from cortex.storage import catalog
+from cortex.storage.state import SharedState
+from cortex.retrieval.backends import get_backend
 import logging
-import uuid
+import time
 
 
 # Redirect the chroma logs
@@ -16,7 +16,21 @@ logging.basicConfig(
     format='%(levelname)s:%(name)s:%(message)s'
 )
 
-EMBEDDING_TASKS = {}
+# Task states are shared by the API workers through Redis. A running task holds a lease renewed
+# with its progress: a task whose lease expired died with its worker.
+task_leases = SharedState("tasks:lease", ttl=settings.task_lease_seconds)
+ACTIVE_STATUSES = ("initialized", "running")
+
+
+def save_task(task_id: str, task_info: dict):
+    """
+    Persist the task state, renewing or releasing its lease.
+    """
+    update_task(task_id, task_info)
+    if task_info["status"] in ACTIVE_STATUSES:
+        task_leases.set(task_id, True)
+    else:
+        task_leases.delete(task_id)
 
 
 class EmbeddingRequest(BaseModel):
@@ -36,8 +50,9 @@ def start_embedding_task(name: str, tag: str, task_id: str, texts: List[str]) ->
     """
     Starts an embedding task and updates its progress for client polling.
     This function initiates a long-running embedding task, which typically takes 5-10 minutes.
-    It updates the progress of the task in the global EMBEDDING_TASKS dictionary, allowing clients
-    to poll for the current status and progress of the task.
+    It updates the progress of the task in the shared task store, allowing clients
+    to poll for the current status and progress of the task from any worker.
+    Texts are embedded and written to the configured vector backend in batches.
     Args:
         name (str): The name of the embedding task.
         task_id (str): The unique identifier for the task.
@@ -46,73 +61,41 @@ def start_embedding_task(name: str, tag: str, task_id: str, texts: List[str]) ->
         str: The task_id of the started embedding task.
     """
     try:
-        EMBEDDING_TASKS[task_id]["status"] = "running"
-        task_info = EMBEDDING_TASKS[task_id]
-        update_task(task_id, task_info)
-        embeddings = None
-        if settings.provider == "openai":
-            if not settings.openai_api_key:
-                raise ValueError("OpenAI API key not found in environment variables.")
-            from langchain_openai import OpenAIEmbeddings
-            embeddings = OpenAIEmbeddings(
-                api_key=settings.openai_api_key,
-                # TODO: Change vector storage provider to make the dimension configurable
-                dimensions=768,
-                model="text-embedding-3-large",
-            )
-            EMBEDDING_TASKS[task_id]["progress"] = 0.50
-            task_info = EMBEDDING_TASKS[task_id]
-            update_task(task_id, task_info)
-            vector_store = Chroma(
-                collection_name=name,
-                embedding_function=embeddings,
-                persist_directory=settings.embeddings_dir,
-            )
-            uuids = [str(uuid.uuid4()) for _ in range(len(texts))]
-            metadatas = [{"source": tag} for _ in range(len(texts))]
-            vector_store.add_texts(texts=texts, metadatas=metadatas, ids=uuids)
-        elif settings.provider == "ollama":
-            from langchain_ollama import OllamaEmbeddings
-            embeddings = OllamaEmbeddings(
-                base_url=settings.ollama_base_url,
-                # TODO: Make ollama embedding model configurable, hard-coded for now
-                model="nomic-embed-text:latest",
-            )
-            vector_store = Chroma(
-                collection_name=name,
-                embedding_function=embeddings,
-                persist_directory=settings.embeddings_dir,
-            )
-            total_texts = len(texts)
-            import time
-            start_time = time.time()
-            for i, text in enumerate(texts):
-                text_id = str(uuid.uuid4())
-                document = Document(
-                    id=text_id, 
-                    metadata={"source": tag}, 
-                    page_content=text)
-                # Warning: use add_documents instead of update_documents to avoid empty search results
-                vector_store.add_documents(documents=[document])
+        task_info = load_task_by_id(task_id)
+        task_info["status"] = "running"
+        save_task(task_id, task_info)
+        backend = get_backend()
+        total_texts = len(texts)
+        batch_size = settings.embedding_batch_size
+        start_time = time.time()
+        added = 0
+        try:
+            for start in range(0, total_texts, batch_size):
+                batch = texts[start:start + batch_size]
+                backend.add_texts(name, batch, metadatas=[{"source": tag} for _ in batch])
+                added += len(batch)
                 elapsed_time = time.time() - start_time
-                progress = (i + 1) / total_texts
+                progress = (start + len(batch)) / total_texts
                 estimated_total_time = elapsed_time / progress
                 estimated_time_left = estimated_total_time - elapsed_time
-                EMBEDDING_TASKS[task_id]["progress"] = progress
-                EMBEDDING_TASKS[task_id]["estimated_time_left"] = estimated_time_left
-                task_info = EMBEDDING_TASKS[task_id]
-                update_task(task_id, task_info)
-        
+                task_info["progress"] = progress
+                task_info["estimated_time_left"] = estimated_time_left
+                save_task(task_id, task_info)
+        finally:
+            # Persist whatever has been added, the catalog only counts the chunks once persisted
+            backend.flush(name)
+            if added:
+                catalog.add_chunks(name, tag, added)
+
         # Mark as completed
-        EMBEDDING_TASKS[task_id]["progress"] = 1.0
-        EMBEDDING_TASKS[task_id]["status"] = "completed"
-        EMBEDDING_TASKS[task_id]["estimated_time_left"] = 0.0
-        task_info = EMBEDDING_TASKS[task_id]
-        update_task(task_id, task_info)
+        task_info["progress"] = 1.0
+        task_info["status"] = "completed"
+        task_info["estimated_time_left"] = 0.0
+        save_task(task_id, task_info)
     except Exception as e:
-        EMBEDDING_TASKS[task_id]["status"] = "failed"
-        task_info = EMBEDDING_TASKS[task_id]
-        update_task(task_id, task_info)
+        task_info = load_task_by_id(task_id) or {"progress": 0.0, "estimated_time_left": 0.0}
+        task_info["status"] = "failed"
+        save_task(task_id, task_info)
         raise e
 
 
@@ -120,30 +103,25 @@ def initialize_embedding_task(task_id: str):
     """
     Initialize a new embedding task with the given task_id.
     """
-    EMBEDDING_TASKS[task_id] = {
+    task_info = {
         "progress": 0.0,
         "status": "initialized",
         "estimated_time_left": 0.0
     }
-    task_info = EMBEDDING_TASKS[task_id]
-    update_task(task_id, task_info)
-    
+    save_task(task_id, task_info)
 
 
 def get_task_status(task_id: str) -> TaskStatus:
     """
     Retrieve the status of a given task by its task_id.
     """
-    if task_id not in EMBEDDING_TASKS:
-        task_info = load_task_by_id(task_id)
-        if task_info is None:
-            raise ValueError(f"Task with id {task_id} does not exist.")
-        if task_info["status"] == "running" or task_info["status"] == "initialized":
-            task_info["status"] = "failed"
-            task_info["estimated_time_left"] = 0.0
-            update_task(task_id, task_info)
-    else:
-        task_info = EMBEDDING_TASKS[task_id]
+    task_info = load_task_by_id(task_id)
+    if task_info is None:
+        raise ValueError(f"Task with id {task_id} does not exist.")
+    if task_info["status"] in ACTIVE_STATUSES and not task_leases.exists(task_id):
+        task_info["status"] = "failed"
+        task_info["estimated_time_left"] = 0.0
+        update_task(task_id, task_info)
     return TaskStatus(
         task_id=task_id, 
         progress=task_info["progress"], 
@@ -154,21 +132,19 @@ def get_task_status(task_id: str) -> TaskStatus:
 
 def is_task_id_in_tasks(task_id: str) -> bool:
     """
-    Check if a task_id exists in the TASKS dictionary.
+    Check if a task_id exists in the task store.
     """
-    return task_id in EMBEDDING_TASKS or load_task_by_id(task_id) is not None
+    return load_task_by_id(task_id) is not None
 
 
 def get_all_tasks() -> List[TaskStatus]:
     """
-    Retrieve all the tasks from the TASKS dictionary.
+    Retrieve all the tasks from the task store.
     """
     tasks = []
-    t = load_all_tasks()
-    print(t)
-    for task_id, task_info in load_all_tasks():
+    for task_id, task_info in load_all_tasks().items():
         task = TaskStatus(
-            task_id=task_id, 
+            task_id=task_id.decode(), 
             progress=task_info["progress"], 
             status=task_info["status"], 
             estimated_time_left=task_info["estimated_time_left"]
@@ -177,32 +153,60 @@ def get_all_tasks() -> List[TaskStatus]:
     return tasks
 
 
+def catalog_source() -> str:
+    """
+    Identity of the vector store the catalog mirrors: the backend and its store, e.g. a folder or a table,
+    a store dropped and created again is another store.
+    """
+    return f"{settings.vector_backend}:{get_backend().store_id()}"
+
+
+def ensure_catalog(force: bool = False):
+    """
+    Populate the catalog from the vector backend the first time it is read, or when the store changed.
+    This is a full scan, afterwards the catalog is maintained incrementally.
+    """
+    source = catalog_source()
+    if not force and catalog.is_catalog_built(source):
+        return
+    backend = get_backend()
+    catalog.rebuild_catalog({
+        name: backend.tag_counts(name) for name in backend.list_collections()
+    }, source)
+
+
 def get_all_embedded_names() -> set:
     """
     Retrieve the set of all names that have been embedded.
     """
-    client = chromadb.PersistentClient(settings.embeddings_dir)
-    collections = client.list_collections()
-    collection_names = [collection.name for collection in collections]
-    return set(collection_names)
+    ensure_catalog()
+    return catalog.list_collections()
+
+
+def get_tag_counts_by_name(name: str) -> dict[str, int] | None:
+    """
+    Retrieve the chunk count of each tag of a collection by its name.
+    """
+    ensure_catalog()
+    return catalog.get_tag_counts(name)
 
 
-def get_all_tags_by_name(name: str) -> set[str]:
+def get_all_tags_by_name(name: str) -> set[str] | None:
     """
     Retrieve the tags of a collection by its name.
     """
-    client = chromadb.PersistentClient(settings.embeddings_dir)
-    collection = client.get_collection(name)
-    all_docs = collection.get(include=['metadatas'])
-    unique_sources = {metadata.get("source") for metadata in all_docs['metadatas'] if "source" in metadata}
-    return set(unique_sources)
+    counts = get_tag_counts_by_name(name)
+    if counts is None:
+        return None
+    return set(counts.keys())
 
 
 def delete_tag(name: str, tag: str):
     """
     Delete the tags of a collection by its name.
     """
-    client = chromadb.PersistentClient(settings.embeddings_dir)
-    collection = client.get_collection(name)
-    collection.delete(where={"source": tag})
-    logging.info(f"Deleted tag {tag} from collection {name}. ")
\ No newline at end of file
+    backend = get_backend()
+    backend.delete(name, tag=tag)
+    backend.flush(name)
+    catalog.remove_tag(name, tag)
+    logging.info(f"Deleted tag {tag} from collection {name}. ")
@@ -0,0 +1,30 @@
+from functools import lru_cache
+from langchain_core.embeddings import Embeddings
+from cortex.config import settings
+
+
+@lru_cache(maxsize=8)
+def get_embeddings(provider: str = None, model: str = None) -> Embeddings:
+    """
+    Return the embedding function of the given provider, shared across the process.
+    Falls back to the configured provider and its default model.
+    """
+    provider = provider or settings.provider
+    if provider == "openai":
+        if not settings.openai_api_key:
+            raise ValueError("OpenAI API key not found in environment variables.")
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            api_key=settings.openai_api_key,
+            dimensions=settings.embedding_dimensions,
+            model=model or "text-embedding-3-large",
+        )
+    elif provider == "ollama":
+        from langchain_ollama import OllamaEmbeddings
+        return OllamaEmbeddings(
+            base_url=settings.ollama_base_url,
+            # TODO: Make ollama embedding model configurable, hard-coded for now
+            model=model or "nomic-embed-text:latest",
+        )
+    else:
+        raise ValueError(f"Invalid embedding provider: {provider}")
@@ -0,0 +1,357 @@
+import os
+import fcntl
+import heapq
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from cortex.config import settings
+from cortex.retrieval.embedding_models import get_embeddings
+from cortex.storage.docstore import ColumnarDocstore
+
+
+INDEX_FILE = "index.faiss"
+# Docstore pickled by langchain's FAISS.save_local, only read to migrate older indexes
+LEGACY_DOCSTORE_FILE = "index.pkl"
+# Serializes the updates of an index across the workers
+LOCK_FILE = "update.lock"
+
+# Map the vectors instead of reading them, older faiss releases only map IVF lists.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+# Updates of an index are serialized, and their writes are published atomically with regard to the loads
+_folder_locks: Dict[str, list] = {}
+_folder_locks_guard = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def get_index_folder(file_id: str) -> str:
+    return os.path.join(settings.temp_index_folder, file_id)
+
+
+def index_exists(file_id: str) -> bool:
+    index_folder = get_index_folder(file_id)
+    return os.path.exists(os.path.join(index_folder, INDEX_FILE)) and (
+        ColumnarDocstore.exists(index_folder)
+        or os.path.exists(os.path.join(index_folder, LEGACY_DOCSTORE_FILE))
+    )
+
+
+def get_file_embeddings():
+    """
+    The embedding function of the files API, shared by the indexing and the searches.
+    """
+    return get_embeddings("ollama", "nomic-embed-text:latest")
+
+
+class FileIndex:
+    """
+    The FAISS index of an uploaded file along with its columnar docstore.
+    FAISS ids are the rows of the docstore, and the chunk ids are the hashes of their content.
+    """
+
+    def __init__(self, index: faiss.Index, docstore: ColumnarDocstore):
+        self.index = index
+        self.docstore = docstore
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        distances, rows = self.index.search(np.asarray([embedding], dtype=np.float32), k)
+        return [
+            (self.docstore.get(int(row)), float(distance))
+            for row, distance in zip(rows[0], distances[0]) if row >= 0
+        ]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        embedding = get_file_embeddings().embed_query(query)
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+
+def _write_index(index: faiss.Index, index_folder: str):
+    index_path = os.path.join(index_folder, INDEX_FILE)
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+
+def content_hash(chunk: Document) -> str:
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _locked_folder(index_folder: str):
+    """
+    Serialize the updates of an index folder, with a lock per folder between the threads
+    and a lock file in the folder between the workers.
+    """
+    with _folder_locks_guard:
+        entry = _folder_locks.setdefault(index_folder, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            os.makedirs(index_folder, exist_ok=True)
+            # Closing the file releases the lock
+            with open(os.path.join(index_folder, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+    finally:
+        with _folder_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _folder_locks[index_folder]
+
+
+def _embed(chunks: List[Document], embeddings: Optional[Embeddings] = None) -> np.ndarray:
+    embeddings = embeddings or get_file_embeddings()
+    return np.asarray(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+
+
+def build_file_index(index_folder: str, chunks: List[Document], embeddings: Optional[Embeddings] = None):
+    """
+    Embed the chunks and persist them as a FAISS index plus a columnar docstore.
+    """
+    vectors = _embed(chunks, embeddings)
+    with _locked_folder(index_folder):
+        _write_new_index(index_folder, chunks, vectors)
+
+
+def ensure_file_index(file_id: str, load_chunks: Callable[[], List[Document]], embeddings: Optional[Embeddings] = None) -> bool:
+    """
+    Build the index of `file_id` from `load_chunks()` unless it exists already.
+    Returns whether it was built.
+    """
+    if index_exists(file_id):
+        return False
+    # Concurrent first calls may embed the file twice, only one of them writes the index
+    chunks = load_chunks()
+    vectors = _embed(chunks, embeddings)
+    with _locked_folder(get_index_folder(file_id)):
+        if index_exists(file_id):
+            return False
+        _write_new_index(get_index_folder(file_id), chunks, vectors)
+        return True
+
+
+def _write_new_index(index_folder: str, chunks: List[Document], vectors: np.ndarray):
+    index = faiss.index_factory(vectors.shape[1], "IDMap2,Flat")
+    index.add_with_ids(vectors, np.arange(len(chunks), dtype=np.int64))
+    os.makedirs(index_folder, exist_ok=True)
+    ColumnarDocstore.write(index_folder, chunks, ids=[content_hash(chunk) for chunk in chunks])
+    # The index goes last, readers key their cache on it
+    _write_index(index, index_folder)
+
+
+def _diff(index_folder: str, index: faiss.Index, chunks: List[Document]) -> Tuple[int, List[Document], Optional[List[int]]]:
+    """
+    Match the chunks with the live rows of the index by content hash.
+    Returns the number of kept chunks, the chunks to add and the stale rows, which are None
+    for the migrated langchain indexes: they have no id map to remove vectors from.
+    """
+    if not isinstance(index, faiss.IndexIDMap2):
+        return 0, chunks, None
+    docstore = ColumnarDocstore(index_folder)
+    live_rows = {}
+    for row in faiss.vector_to_array(index.id_map):
+        live_rows.setdefault(docstore.ids[row].decode("utf-8"), []).append(int(row))
+    kept, added = 0, []
+    for chunk in chunks:
+        rows = live_rows.get(content_hash(chunk))
+        if rows:
+            rows.pop()
+            kept += 1
+        else:
+            added.append(chunk)
+    return kept, added, [row for rows in live_rows.values() for row in rows]
+
+
+def update_file_index(index_folder: str, chunks: List[Document], compact_ratio: float = 0.5) -> dict:
+    """
+    Bring an existing index in line with the new chunks of its file, in place.
+    Chunks are matched by content hash: only new or changed chunks are embedded and appended,
+    vectors of the chunks that are gone are removed. Dead docstore rows are compacted away
+    once they exceed `compact_ratio` of the docstore.
+    Returns the number of kept, added and removed chunks.
+    """
+    index_path = os.path.join(index_folder, INDEX_FILE)
+    vectors = {}
+
+    def embed_new(new_chunks: List[Document]):
+        missing = [chunk for chunk in new_chunks if content_hash(chunk) not in vectors]
+        if missing:
+            vectors.update(zip(map(content_hash, missing), _embed(missing)))
+
+    # Embedding is the slow part, it runs before taking the lock and searches keep loading the previous version
+    embed_new(_diff(index_folder, faiss.read_index(index_path), chunks)[1])
+    with _locked_folder(index_folder):
+        # Another update may have been written meanwhile, only the chunks it did not have are embedded under the lock
+        index = faiss.read_index(index_path)
+        kept, added, stale = _diff(index_folder, index, chunks)
+        embed_new(added)
+        added_vectors = np.asarray([vectors[content_hash(chunk)] for chunk in added], dtype=np.float32)
+        if stale is None:
+            with _write_lock:
+                _write_new_index(index_folder, chunks, added_vectors)
+            return {"kept": 0, "added": len(chunks), "removed": 0}
+
+        docstore = ColumnarDocstore(index_folder)
+        with _write_lock:
+            if stale:
+                index.remove_ids(np.asarray(stale, dtype=np.int64))
+            if added:
+                new_rows = ColumnarDocstore.append(index_folder, added, [content_hash(chunk) for chunk in added])
+                index.add_with_ids(added_vectors, np.asarray(new_rows, dtype=np.int64))
+            dead_rows = len(docstore) + len(added) - index.ntotal
+            if dead_rows > compact_ratio * (len(docstore) + len(added)):
+                index = _compact(index_folder, index)
+            _write_index(index, index_folder)
+        return {"kept": kept, "added": len(added), "removed": len(stale)}
+
+
+def _compact(index_folder: str, index: faiss.IndexIDMap2) -> faiss.IndexIDMap2:
+    """
+    Rewrite the docstore with the live rows only, renumbered along with the index.
+    """
+    docstore = ColumnarDocstore(index_folder)
+    rows = faiss.vector_to_array(index.id_map)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    ColumnarDocstore.write(
+        index_folder,
+        [docstore.get(int(row)) for row in rows],
+        ids=[docstore.ids[row].decode("utf-8") for row in rows],
+    )
+    compacted = faiss.index_factory(index.d, "IDMap2,Flat")
+    compacted.add_with_ids(vectors, np.arange(len(rows), dtype=np.int64))
+    return compacted
+
+
+def _migrate_legacy_docstore(index_folder: str):
+    """
+    Rewrite the pickled docstore of an index saved by langchain as a columnar docstore.
+    Its flat index has no id map, the FAISS labels already are the docstore rows.
+    """
+    legacy_path = os.path.join(index_folder, LEGACY_DOCSTORE_FILE)
+    # The pickle is written by the files API itself, never by the clients.
+    with open(legacy_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    ids = [index_to_docstore_id[row] for row in range(len(index_to_docstore_id))]
+    ColumnarDocstore.write(index_folder, [docstore.search(doc_id) for doc_id in ids], ids=ids)
+    os.remove(legacy_path)
+
+
+def load_file_index(index_folder: str) -> FileIndex:
+    with _write_lock:
+        if not ColumnarDocstore.exists(index_folder):
+            _migrate_legacy_docstore(index_folder)
+        index = faiss.read_index(os.path.join(index_folder, INDEX_FILE), MMAP_FLAGS)
+        return FileIndex(index, ColumnarDocstore(index_folder))
+
+
+class FileIndexCache:
+    """
+    LRU cache of the loaded per-file indexes, bounded by a memory budget.
+    Both the vectors and the docstore are memory-mapped: the budget bounds the bytes mapped
+    by the cached indexes, and the page cache decides which parts of them stay resident.
+    An entry is reloaded when its index changes on disk.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(index_folder: str) -> tuple:
+        stat = os.stat(os.path.join(index_folder, INDEX_FILE))
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _mapped_bytes(index_folder: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(index_folder, name)) for name in os.listdir(index_folder)
+        )
+
+    def get(self, file_id: str) -> Optional[FileIndex]:
+        index_folder = get_index_folder(file_id)
+        if not index_exists(file_id):
+            return None
+        signature = self._signature(index_folder)
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and entry[1] == signature:
+                self._entries.move_to_end(file_id)
+                return entry[0]
+        # Load outside of the lock, concurrent misses on the same file only cost a duplicate load
+        file_index = load_file_index(index_folder)
+        size = self._mapped_bytes(index_folder)
+        with self._lock:
+            self._evict(file_id)
+            self._entries[file_id] = (file_index, signature, size)
+            self.used_bytes += size
+            while self.used_bytes > self.budget_bytes and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)))
+        return file_index
+
+    def invalidate(self, file_id: str):
+        with self._lock:
+            self._evict(file_id)
+
+    def _evict(self, file_id: str):
+        entry = self._entries.pop(file_id, None)
+        if entry is not None:
+            self.used_bytes -= entry[2]
+
+
+file_index_cache = FileIndexCache(settings.file_index_cache_mb * 2 ** 20)
+
+
+class FileIndexRetriever(BaseRetriever):
+    """
+    Retriever over the persisted index of a file, loaded lazily through the index cache.
+    The query is embedded with `embeddings`, the function the index was built with.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    file_id: str
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        file_index = file_index_cache.get(self.file_id)
+        if file_index is None:
+            raise ValueError(f"No index for the file {self.file_id}")
+        embedding = self.embeddings.embed_query(query)
+        return [doc for doc, _ in file_index.similarity_search_by_vector_with_score(embedding, self.k)]
+
+
+# FAISS releases the GIL while searching, the per-file searches of a session run side by side
+_search_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="file-search")
+
+
+def search_files(file_ids: List[str], query: str, k: int = 4) -> List[Tuple[str, Document, float]]:
+    """
+    Search the indexes of several files with a single query embedding.
+    Returns the global top k as (file_id, chunk, distance), files without an index are skipped.
+    """
+    embedding = get_file_embeddings().embed_query(query)
+
+    def search_file(file_id: str) -> List[Tuple[str, Document, float]]:
+        file_index = file_index_cache.get(file_id)
+        if file_index is None:
+            return []
+        return [
+            (file_id, doc, distance)
+            for doc, distance in file_index.similarity_search_by_vector_with_score(embedding, k)
+        ]
+
+    results = _search_executor.map(search_file, file_ids)
+    return heapq.nsmallest(k, (result for file_results in results for result in file_results), key=lambda r: r[2])
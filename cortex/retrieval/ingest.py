@@ -0,0 +1,390 @@
+"""
+Bulk ingestion of a directory into a collection of the vector backend.
+Files are routed by format: documents Docling converts go through the converter pool first,
+text and code files are chunked directly. Each stage runs on its own workers, fed by a queue:
+
+    walk -> convert (converter pool) -> chunk (process pool) -> embed (vector backend)
+
+Every chunk is tagged with the path of its file relative to the directory.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python -m cortex.retrieval.ingest tests/corpus --name corpus
+"""
+import os
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from cortex.config import settings
+from cortex.storage import catalog
+from cortex.storage.tasks import load_task_by_id
+from cortex.retrieval.embedding import ensure_catalog, save_task
+from cortex.retrieval.backends import get_backend
+from cortex.retrieval.chunking import Chunker, known_ext_dict
+from cortex.retrieval.converter_pool import get_converter_pool, get_document_format
+
+
+TEXT_EXTENSIONS = {"txt", "csv", *known_ext_dict.keys()}
+# Marks the end of the items of a queue
+_DONE = object()
+
+
+def chunk_id(tag: str, index: int, text: str) -> str:
+    """
+    Stable id of the index-th chunk of a file, so that ingesting a file again overwrites its chunks.
+    """
+    return hashlib.sha256(f"{tag}\0{index}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _chunk_file(path: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    extension = os.path.splitext(path)[1].lstrip(".")
+    chunker = Chunker.of(extension, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [doc.page_content for doc in chunker.split(path)]
+
+
+def _chunk_markdown(markdown: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    from langchain_text_splitters import MarkdownHeaderTextSplitter
+    chunker = Chunker.of("txt", chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    sections = MarkdownHeaderTextSplitter(
+        headers_to_split_on=[("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")],
+        strip_headers=False,
+    ).split_text(markdown)
+    return [doc.page_content for doc in chunker.splitter.split_documents(sections)]
+
+
+def _timed(fn: Callable, *args) -> tuple:
+    # Times the call in the worker, the wait for a free process is not part of the stage
+    started = time.time()
+    return fn(*args), time.time() - started
+
+
+def classify(path: str) -> Optional[str]:
+    """
+    The first stage of the file: "convert", "chunk", or None when it is not supported.
+    """
+    if get_document_format(path):
+        return "convert"
+    if os.path.splitext(path)[1].lstrip(".").lower() in TEXT_EXTENSIONS:
+        return "chunk"
+    return None
+
+
+def walk(directory: str) -> Tuple[List[str], List[str], List[str]]:
+    """
+    List the files of the directory: the ones to convert, the ones to chunk as text, and the skipped ones.
+    """
+    to_convert, to_chunk, skipped = [], [], []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            stage = classify(path)
+            if stage == "convert":
+                to_convert.append(path)
+            elif stage == "chunk":
+                to_chunk.append(path)
+            else:
+                skipped.append(path)
+    return to_convert, to_chunk, skipped
+
+
+class StageStats:
+    """
+    Items and busy time of a pipeline stage, summed over its workers.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.chunks = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, files: int = 0, chunks: int = 0, errors: int = 0):
+        with self._lock:
+            self.busy_seconds += seconds
+            self.files += files
+            self.chunks += chunks
+            self.errors += errors
+
+    def report(self, wall_seconds: float) -> dict:
+        return {
+            "files": self.files,
+            "chunks": self.chunks,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "files_per_second": round(self.files / wall_seconds, 3) if wall_seconds else 0.0,
+            "chunks_per_second": round(self.chunks / wall_seconds, 3) if wall_seconds else 0.0,
+        }
+
+
+def ingest_directory(
+    directory: str,
+    name: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 50,
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[float, dict], None]] = None,
+    paths: Optional[List[str]] = None,
+    on_embedded: Optional[Callable[[str, List[str]], None]] = None,
+) -> dict:
+    """
+    Convert, chunk and embed all the supported files of the directory into the `name` collection,
+    or only the given `paths` of the directory.
+    `on_progress(progress, stats)` is called as files get embedded, `on_embedded(path, ids)` with the
+    chunk ids of each embedded file.
+    Returns the throughput of each stage, and the files that failed with their error.
+    """
+    directory = os.path.abspath(directory)
+    if paths is None:
+        to_convert, to_chunk, skipped = walk(directory)
+    else:
+        stages = {path: classify(path) for path in paths}
+        to_convert = [path for path, stage in stages.items() if stage == "convert"]
+        to_chunk = [path for path, stage in stages.items() if stage == "chunk"]
+        skipped = [path for path, stage in stages.items() if stage is None]
+    total = len(to_convert) + len(to_chunk)
+    stats = {stage: StageStats() for stage in ("convert", "chunk", "embed")}
+    failures: Dict[str, str] = {}
+    start_time = time.time()
+
+    def report() -> dict:
+        wall = time.time() - start_time
+        return {
+            "directory": directory,
+            "files": total,
+            "skipped": len(skipped),
+            "wall_seconds": round(wall, 3),
+            "stages": {stage: stage_stats.report(wall) for stage, stage_stats in stats.items()},
+            "failures": failures,
+        }
+
+    # Queues between the stages, bounded so that a slow stage holds back the ones before it
+    convert_queue: queue.Queue = queue.Queue()
+    chunk_queue: queue.Queue = queue.Queue(maxsize=256)
+    embed_queue: queue.Queue = queue.Queue(maxsize=256)
+    for path in to_convert:
+        convert_queue.put(path)
+    convert_workers = settings.docling_workers
+    for _ in range(convert_workers):
+        convert_queue.put(_DONE)
+
+    def chunk_feeder():
+        # Text files skip the conversion, fed from a thread since the chunk queue is bounded
+        for path in to_chunk:
+            chunk_queue.put((path, None))
+        chunk_queue.put(_DONE)
+
+    def convert_worker():
+        while (path := convert_queue.get()) is not _DONE:
+            started = time.time()
+            try:
+                chunk_queue.put((path, get_converter_pool().convert(path)))
+                stats["convert"].record(time.time() - started, files=1)
+            except Exception as e:
+                failures[os.path.relpath(path, directory)] = f"convert: {e}"
+                stats["convert"].record(time.time() - started, errors=1)
+                embed_queue.put((path, None))
+        chunk_queue.put(_DONE)
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+    )
+    # Chunking futures not handed to the embedding yet
+    in_flight = set()
+
+    def chunk_dispatcher():
+        # Keeps the chunking processes busy, results are handed to the embedding in completion order
+        pending = threading.Semaphore((workers or os.cpu_count()) * 2)
+        # The converters and the feeder each mark the end of their items
+        remaining_producers = convert_workers + 1
+
+        def done(path: str, future):
+            try:
+                texts, seconds = future.result()
+                stats["chunk"].record(seconds, files=1, chunks=len(texts))
+                embed_queue.put((path, texts))
+            except Exception as e:
+                # Including the files of a pool broken by a dying process
+                failures[os.path.relpath(path, directory)] = f"chunk: {e}"
+                stats["chunk"].record(0.0, errors=1)
+                embed_queue.put((path, None))
+            in_flight.discard(future)
+            pending.release()
+
+        while True:
+            item = chunk_queue.get()
+            if item is _DONE:
+                remaining_producers -= 1
+                if remaining_producers == 0:
+                    break
+                continue
+            path, markdown = item
+            pending.acquire()
+            try:
+                if markdown is None:
+                    future = executor.submit(_timed, _chunk_file, path, chunk_size, chunk_overlap)
+                else:
+                    future = executor.submit(_timed, _chunk_markdown, markdown, chunk_size, chunk_overlap)
+            except Exception as e:
+                failures[os.path.relpath(path, directory)] = f"chunk: {e}"
+                stats["chunk"].record(0.0, errors=1)
+                embed_queue.put((path, None))
+                pending.release()
+                continue
+            in_flight.add(future)
+            future.add_done_callback(lambda f, path=path: done(path, f))
+
+    def run_stage(target: Callable):
+        # A stage dying unexpectedly would leave the embedding waiting for its files, it fails the ingestion
+        try:
+            target()
+        except BaseException as e:
+            embed_queue.put(e)
+            raise
+
+    stages = [convert_worker] * convert_workers + [chunk_feeder, chunk_dispatcher]
+    threads = [threading.Thread(target=run_stage, args=(stage,), daemon=True) for stage in stages]
+    for thread in threads:
+        thread.start()
+
+    def next_file() -> tuple:
+        while True:
+            try:
+                item = embed_queue.get(timeout=1)
+            except queue.Empty:
+                if any(thread.is_alive() for thread in threads) or in_flight:
+                    continue
+                # Every file is handed over before its stage ends, the queue has them all by now
+                try:
+                    item = embed_queue.get_nowait()
+                except queue.Empty:
+                    raise RuntimeError("The ingestion stages ended before handing over all the files")
+            if isinstance(item, BaseException):
+                raise RuntimeError("An ingestion stage failed") from item
+            return item
+
+    # The embedding stage runs here, batching the chunks of consecutive files
+    backend = get_backend()
+    batch_size = settings.embedding_batch_size
+    # Files ingested before are replaced, their chunk counts would add up otherwise
+    ensure_catalog()
+    ingested = catalog.get_tag_counts(name) or {}
+    finished = 0
+    try:
+        while finished < total:
+            path, texts = next_file()
+            finished += 1
+            if texts:
+                tag = os.path.relpath(path, directory)
+                started = time.time()
+                try:
+                    if tag in ingested:
+                        backend.delete(name, tag=tag)
+                        catalog.remove_tag(name, tag)
+                    ids = [chunk_id(tag, i, text) for i, text in enumerate(texts)]
+                    for offset in range(0, len(texts), batch_size):
+                        backend.add_texts(
+                            name,
+                            texts[offset:offset + batch_size],
+                            metadatas=[{"source": tag} for _ in texts[offset:offset + batch_size]],
+                            ids=ids[offset:offset + batch_size],
+                        )
+                    catalog.add_chunks(name, tag, len(texts))
+                    if on_embedded is not None:
+                        on_embedded(path, ids)
+                    stats["embed"].record(time.time() - started, files=1, chunks=len(texts))
+                except Exception as e:
+                    failures[tag] = f"embed: {e}"
+                    stats["embed"].record(time.time() - started, errors=1)
+            elif texts is not None and on_embedded is not None:
+                # Nothing to embed in the file, it is ingested all the same
+                on_embedded(path, [])
+            if on_progress is not None:
+                on_progress(finished / total, report())
+    finally:
+        backend.flush(name)
+        for thread in threads:
+            thread.join(timeout=1)
+        executor.shutdown(wait=False, cancel_futures=True)
+    return report()
+
+
+class IngestRequest(BaseModel):
+    name: str
+    # Relative to the file collection folder
+    directory: str = ""
+    chunk_size: int = 1000
+    chunk_overlap: int = 50
+    workers: Optional[int] = None
+
+
+def start_ingest_task(request: IngestRequest, directory: str, task_id: str, run: Callable = None):
+    """
+    Ingest the directory as an embedding task, its state holds the report of the stages.
+    `run` replaces the ingestion of the whole directory, e.g. by its incremental sync.
+    """
+    run = run or ingest_directory
+    task_info = load_task_by_id(task_id)
+    task_info["status"] = "running"
+    save_task(task_id, task_info)
+    start_time = time.time()
+
+    def on_progress(progress: float, report: dict):
+        elapsed_time = time.time() - start_time
+        task_info["progress"] = progress
+        task_info["estimated_time_left"] = elapsed_time / progress - elapsed_time
+        task_info["report"] = report
+        save_task(task_id, task_info)
+
+    try:
+        task_info["report"] = run(
+            directory, request.name, request.chunk_size, request.chunk_overlap, request.workers, on_progress
+        )
+        task_info["progress"] = 1.0
+        task_info["status"] = "completed"
+    except Exception:
+        task_info["status"] = "failed"
+        raise
+    finally:
+        task_info["estimated_time_left"] = 0.0
+        save_task(task_id, task_info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", default=settings.file_collection_folder)
+    parser.add_argument("--name", required=True, help="collection to embed the files into")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="chunking processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    def on_progress(progress: float, report: dict):
+        print(f"\r{progress:6.1%} of {report['files']} files", end="", flush=True)
+
+    report = ingest_directory(
+        args.directory, args.name, args.chunk_size, args.chunk_overlap, args.workers, on_progress
+    )
+    print()
+    print(f"{'stage':>8} | {'files':>8} | {'chunks':>8} | {'errors':>8} | {'busy_s':>10} | {'files/s':>10} | {'chunks/s':>10}")
+    for stage, row in report["stages"].items():
+        print(
+            f"{stage:>8} | {row['files']:>8} | {row['chunks']:>8} | {row['errors']:>8} | "
+            f"{row['busy_seconds']:>10.2f} | {row['files_per_second']:>10.2f} | {row['chunks_per_second']:>10.2f}"
+        )
+    print(f"{report['files']} files in {report['wall_seconds']:.1f} s, {report['skipped']} skipped")
+    for path, error in report["failures"].items():
+        print(f"failed: {path}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
+from functools import lru_cache
 from typing import List, Literal
+import httpx
 from pydantic import BaseModel
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from cortex.config import settings
+from cortex.retrieval.backends import get_backend
 
 
 class SearchRequest(BaseModel):
@@ -20,30 +22,78 @@ def search_by_collection(
     tags: List[str],
     query: str, 
     top_k: int = 5, 
-    search_type: Literal["similarity", "mmr"] = "similarity",
+    search_type: Literal["similarity", "similarity_score_threshold", "mmr"] = "similarity",
     **kwargs
 ) -> List[Document]:
     """
-    Perform a similarity search by collection name via the Chroma.
-    2 search types are supported: "similarity" and "mmr".
+    Perform a similarity search by collection name via the configured vector backend.
+    3 search types are supported: "similarity", "similarity_score_threshold" (with a `score_threshold`) and "mmr".
     """
-    from langchain_ollama import OllamaEmbeddings
-    embeddings = OllamaEmbeddings(
-        # TODO: Make both url and model configurable
-        base_url=settings.ollama_base_url,
-        model="nomic-embed-text:latest",
+    return get_backend().search(
+        collection_name,
+        query,
+        top_k=top_k,
+        tags=tags,
+        search_type=search_type,
+        **kwargs
     )
-    vector_store = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory=settings.embeddings_dir,
-    )
-    retriever = vector_store.as_retriever(
-        search_type=search_type, 
-        search_kwargs={
-            "k": top_k, 
-            "filter": {"source": {"$in": tags}} if tags else None, 
-            **kwargs
-        }
-    )
-    return retriever.invoke(query)
\ No newline at end of file
+
+
+class ContextRetriever:
+    """
+    Retrieves the contents of the chunks of a collection relevant to a query, for the agents.
+    """
+
+    def retrieve(
+        self,
+        collection_name: str,
+        query: str,
+        top_k: int = 5,
+        search_type: Literal["similarity", "mmr"] = "similarity",
+        tags: List[str] = None,
+        **kwargs
+    ) -> List[str]:
+        raise NotImplementedError
+
+
+class LocalContextRetriever(ContextRetriever):
+    """
+    Searches the vector backend in process.
+    """
+
+    def retrieve(self, collection_name, query, top_k=5, search_type="similarity", tags=None, **kwargs):
+        docs = search_by_collection(collection_name, tags or [], query, top_k, search_type, **kwargs)
+        return [doc.page_content for doc in docs]
+
+
+class RemoteContextRetriever(ContextRetriever):
+    """
+    Calls the search API of another cortex node, over a pooled keep-alive client.
+    """
+
+    def __init__(self, base_url: str, token: str = None, timeout: float = 30):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.client = httpx.Client(base_url=base_url, headers=headers, timeout=timeout)
+
+    def retrieve(self, collection_name, query, top_k=5, search_type="similarity", tags=None, **kwargs):
+        response = self.client.post("/api/v1/search/", json={
+            "name": collection_name,
+            "tags": tags or [],
+            "query": query,
+            "top_k": top_k,
+            "search_type": search_type,
+            "content_only": True,
+            "opts": kwargs,
+        })
+        response.raise_for_status()
+        return response.json()
+
+
+@lru_cache
+def get_context_retriever() -> ContextRetriever:
+    """
+    The retriever of the agents: the remote search API when `search_api_url` is set, the local backend otherwise.
+    """
+    if settings.search_api_url:
+        return RemoteContextRetriever(settings.search_api_url, settings.search_api_token)
+    return LocalContextRetriever()
@@ -2,8 +2,16 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_community.document_loaders import WebBaseLoader, TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from validators import url as validate_url
+from bs4 import BeautifulSoup
+from cortex.retrieval.summary_cache import summarize_with_cache, asummarize_with_cache
+from cortex.retrieval.converter_pool import get_converter_pool
+from langchain_core.documents import Document
 from pydantic import BaseModel
+from typing import List, Optional
+from contextlib import nullcontext
+import asyncio
 import os
 
 
@@ -19,45 +27,43 @@ class SummarizeRequest(BaseModel):
     provider_options: dict = {}
 
 
-# TODO: support other loaders
-def web_stuff_summarization( 
-        url: str,
-        openai_key: str,
-        **kwargs
-    ):
-    """
-    Summarize a web page using the Stuff Documents chain
+class BatchSummarizeRequest(BaseModel):
+    urls: List[str]
+    openai_key: str
+    provider_options: dict = {}
 
-    :param url: The URL of the web page to summarize
-    :param openai_key: The OpenAI API key
-    :return: The summary of the web page
+
+STUFF_SUMMARY_PROMPT = "Write a concise summary of the following docs:\\n\\n{context}"
+
+
+class MapReduceSummarizeRequest(SummarizeRequest):
+    # Defaults to the summarize_max_concurrency and summarize_token_max settings
+    max_concurrency: Optional[int] = None
+    token_max: Optional[int] = None
+
+
+def create_chat_llm(openai_key: str, **kwargs) -> ChatOpenAI:
+    """
+    Create the chat model of the summarization requests from their provider options.
     """
-    if not validate_url(url):
-        raise ValueError("Invalid URL")
-    prompt = ChatPromptTemplate.from_messages(
-        [("system", "Write a concise summary of the following docs:\\n\\n{context}")]
-    )
     # Supported various providers url here
     model = kwargs["model"] if "model" in kwargs else "gpt-4o-mini"
-    llm = (
+    return (
         ChatOpenAI(model=model, api_key=openai_key)
         if "openai_base" not in kwargs
         else ChatOpenAI(model=model, base_url=kwargs["openai_base"], api_key=openai_key)
     )
-    chain = create_stuff_documents_chain(llm, prompt)
-    docs = []
+
+
+# TODO: support other loaders
+def load_web_splits(url: str, html: Optional[str] = None, **kwargs) -> List[Document]:
+    """
+    Load a web page, or any document docling converts when `enable_docling` is set, and split it.
+    The HTML of the page can be given when it has already been fetched.
+    """
+    if not validate_url(url):
+        raise ValueError("Invalid URL")
     if "enable_docling" in kwargs and kwargs["enable_docling"]:
-        from langchain_docling import DoclingLoader
-        from docling.chunking import HybridChunker
-        from docling.document_converter import DocumentConverter
-        from langchain_docling.loader import ExportType
-        EXPORT_TYPE = ExportType.MARKDOWN
-        EMBED_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
-        loader = DoclingLoader(
-            file_path=url,
-            export_type=EXPORT_TYPE,
-            chunker=HybridChunker(tokenizer=EMBED_MODEL_ID),
-        )
         from langchain_text_splitters import MarkdownHeaderTextSplitter
 
         splitter = MarkdownHeaderTextSplitter(
@@ -67,11 +73,83 @@ def web_stuff_summarization(
                 ("###", "Header_3"),
             ],
         )
-        docs = loader.load()
-        splits = [split for doc in docs for split in splitter.split_text(doc.page_content)]
+        # Converted by the warm converters of the pool, the page is exported as a single markdown
+        markdown = get_converter_pool().convert(url)
+        splits = splitter.split_text(markdown)
+    elif html is not None:
+        # Same text extraction and splitting as WebBaseLoader, without fetching the page again
+        soup = BeautifulSoup(html, "html.parser")
+        metadata = {"source": url}
+        if soup.title is not None:
+            metadata["title"] = soup.title.get_text()
+        splits = RecursiveCharacterTextSplitter().split_documents(
+            [Document(page_content=soup.get_text(), metadata=metadata)]
+        )
     else:
         loader = WebBaseLoader(url)
         splits = loader.load_and_split()
     print(f"Loaded {len(splits)} documents")
-    result = chain.invoke({"context": splits})
-    return result
\ No newline at end of file
+    return splits
+
+
+def web_stuff_summarization( 
+        url: str,
+        openai_key: str,
+        **kwargs
+    ):
+    """
+    Summarize a web page using the Stuff Documents chain
+
+    :param url: The URL of the web page to summarize
+    :param openai_key: The OpenAI API key
+    :return: The summary of the web page
+    """
+    if not validate_url(url):
+        raise ValueError("Invalid URL")
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", STUFF_SUMMARY_PROMPT)]
+    )
+    llm = create_chat_llm(openai_key, **kwargs)
+    chain = create_stuff_documents_chain(llm, prompt)
+
+    def summarize(response) -> str:
+        html = None if kwargs.get("enable_docling") else response.text
+        splits = load_web_splits(url, html=html, **kwargs)
+        return chain.invoke({"context": splits})
+
+    # The page is summarized again only when its content changed
+    model = f"{kwargs.get('openai_base', 'openai')}/{llm.model_name}"
+    return summarize_with_cache(
+        url, model, STUFF_SUMMARY_PROMPT, summarize, enable_docling=bool(kwargs.get("enable_docling"))
+    )
+
+
+async def aweb_stuff_summarization(
+        url: str,
+        openai_key: str,
+        llm_limit: Optional[asyncio.Semaphore] = None,
+        **kwargs
+    ):
+    """
+    Async version of `web_stuff_summarization`, which never blocks the event loop:
+    the page is fetched over the pooled async client, parsed in a worker thread,
+    and summarized while holding `llm_limit` when given.
+    """
+    if not validate_url(url):
+        raise ValueError("Invalid URL")
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", STUFF_SUMMARY_PROMPT)]
+    )
+    llm = create_chat_llm(openai_key, **kwargs)
+    chain = create_stuff_documents_chain(llm, prompt)
+
+    async def summarize(response) -> str:
+        html = None if kwargs.get("enable_docling") else response.text
+        splits = await asyncio.to_thread(load_web_splits, url, html=html, **kwargs)
+        async with llm_limit or nullcontext():
+            return await chain.ainvoke({"context": splits})
+
+    model = f"{kwargs.get('openai_base', 'openai')}/{llm.model_name}"
+    return await asummarize_with_cache(
+        url, model, STUFF_SUMMARY_PROMPT, summarize, enable_docling=bool(kwargs.get("enable_docling"))
+    )
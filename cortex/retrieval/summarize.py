@@ -1,15 +1,16 @@
 """
-This script demonstrates how to use the `langchain` library to create a
-summarization pipeline for a set of documents. The pipeline will generate
-individual summaries for each document, collapse them into a single summary,
-and then generate a final summary. The pipeline will be executed
-asynchronously using the `langgraph` library.
+Map-reduce summarization of long documents with `langgraph`.
+Each document is summarized on its own (map), the summaries are collapsed
+until they fit in the token budget, and then reduced to a final summary.
+Nothing is loaded at import: the graph is built for a given model by
+`build_summarize_graph` and run with `summarize` or `astream_summarize`.
 """
+import asyncio
 import operator
-from typing import Annotated, List, Literal, TypedDict
-from langchain_openai import ChatOpenAI
+from collections import OrderedDict
+from typing import Annotated, AsyncIterator, Callable, List, Literal, TypedDict
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
-from langchain import hub
 from langchain.chains.combine_documents.reduce import (
     acollapse_docs,
     split_list_of_docs,
@@ -17,15 +18,12 @@ from langchain.chains.combine_documents.reduce import (
 from langchain_core.documents import Document
 from langgraph.constants import Send
 from langgraph.graph import END, START, StateGraph
-from cortex.retrieval.chunking import Chunker
 
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# Kept local instead of `hub.pull("rlm/map-prompt")`, which needs a network call
 map_prompt = ChatPromptTemplate.from_messages(
-    [("system", "Write a concise summary of the following:\\n\\n{context}")]
+    [("system", "Write a concise summary of the following:\n\n{context}")]
 )
-
-map_prompt = hub.pull("rlm/map-prompt")
 # Also available via the hub: `hub.pull("rlm/reduce-prompt")`
 reduce_template = """
 The following is a set of summaries:
@@ -33,33 +31,64 @@ The following is a set of summaries:
 Take these and distill it into a final, consolidated summary
 of the main themes.
 """
-
 reduce_prompt = ChatPromptTemplate([("human", reduce_template)])
-chunker = Chunker.of(
-    file_type="txt",
-    splitter="text",
-    chunk_size=1000,
-    chunk_overlap=0
-)
-split_docs = chunker.split("tests/corpus/paul_graham_essay.txt")
-print(f"Generated {len(split_docs)} documents.")
-
-token_max = 1000
 
-
-def length_function(documents: List[Document]) -> int:
-    """Get number of tokens for input contents."""
-    return sum(llm.get_num_tokens(doc.page_content) for doc in documents)
+DEFAULT_TOKEN_MAX = 1000
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def _get_encoding(llm: BaseChatModel):
+    """
+    The tiktoken encoding of the model if it exposes one, as ChatOpenAI does.
+    """
+    if getattr(llm, "custom_get_token_ids", None) is not None:
+        return None
+    try:
+        _, encoding = llm._get_encoding_model()
+        return encoding if hasattr(encoding, "encode_batch") else None
+    except Exception:
+        return None
+
+
+class TokenCounter:
+    """
+    Token counts of the texts for a model, memoized by content in an LRU of `maxsize` texts.
+    Texts not counted yet are tokenized in one batch when the model exposes its encoding.
+    """
+
+    def __init__(self, llm: BaseChatModel, maxsize: int = 4096):
+        self.llm = llm
+        self.maxsize = maxsize
+        self._encoding = _get_encoding(llm)
+        self._counts: OrderedDict[str, int] = OrderedDict()
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        missing = list(dict.fromkeys(text for text in texts if text not in self._counts))
+        if missing:
+            if self._encoding is not None:
+                tokens = self._encoding.encode_batch(missing, disallowed_special=())
+                counts = [len(ids) for ids in tokens]
+            else:
+                counts = [self.llm.get_num_tokens(text) for text in missing]
+            self._counts.update(zip(missing, counts))
+        result = []
+        for text in texts:
+            self._counts.move_to_end(text)
+            result.append(self._counts[text])
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+        return result
+
+    def __call__(self, documents: List[Document]) -> int:
+        """Get number of tokens for input contents."""
+        return sum(self.count_many([doc.page_content for doc in documents]))
 
 
 # This will be the overall state of the main graph.
 # It will contain the input document contents, corresponding
 # summaries, and a final summary.
 class OverallState(TypedDict):
-    # Notice here we use the operator.add
-    # This is because we want combine all the summaries we generate
-    # from individual nodes back into one list - this is essentially
-    # the "reduce" part
+    # The summaries of the map nodes are combined back into one list
     contents: List[str]
     summaries: Annotated[list, operator.add]
     collapsed_summaries: List[Document]
@@ -72,96 +101,142 @@ class SummaryState(TypedDict):
     content: str
 
 
-# Here we generate a summary, given a document
-async def generate_summary(state: SummaryState):
-    prompt = map_prompt.invoke(state["content"])
-    response = await llm.ainvoke(prompt)
-    return {"summaries": [response.content]}
-
-
-# Here we define the logic to map out over the documents
-# We will use this an edge in the graph
-def map_summaries(state: OverallState):
-    # We will return a list of `Send` objects
-    # Each `Send` object consists of the name of a node in the graph
-    # as well as the state to send to that node
-    return [
-        Send("generate_summary", {"content": content}) for content in state["contents"]
-    ]
-
-
-def collect_summaries(state: OverallState):
-    return {
-        "collapsed_summaries": [Document(summary) for summary in state["summaries"]]
-    }
-
-
-async def _reduce(input: dict) -> str:
-    prompt = reduce_prompt.invoke(input)
-    response = await llm.ainvoke(prompt)
-    return response.content
-
-
-# Add node to collapse summaries
-async def collapse_summaries(state: OverallState):
-    doc_lists = split_list_of_docs(
-        state["collapsed_summaries"], length_function, token_max
-    )
-    results = []
-    for doc_list in doc_lists:
-        results.append(await acollapse_docs(doc_list, _reduce))
-
-    return {"collapsed_summaries": results}
-
-
-# This represents a conditional edge in the graph that determines
-# if we should collapse the summaries or not
-def should_collapse(
-    state: OverallState,
-) -> Literal["collapse_summaries", "generate_final_summary"]:
-    num_tokens = length_function(state["collapsed_summaries"])
-    if num_tokens > token_max:
-        return "collapse_summaries"
-    else:
-        return "generate_final_summary"
-
-
-# Here we will generate the final summary
-async def generate_final_summary(state: OverallState):
-    response = await _reduce(state["collapsed_summaries"])
-    return {"final_summary": response}
-
-
-# Construct the graph
-# Nodes:
-graph = StateGraph(OverallState)
-graph.add_node("generate_summary", generate_summary)  # same as before
-graph.add_node("collect_summaries", collect_summaries)
-graph.add_node("collapse_summaries", collapse_summaries)
-graph.add_node("generate_final_summary", generate_final_summary)
-
-# Edges:
-graph.add_conditional_edges(START, map_summaries, ["generate_summary"])
-graph.add_edge("generate_summary", "collect_summaries")
-graph.add_conditional_edges("collect_summaries", should_collapse)
-graph.add_conditional_edges("collapse_summaries", should_collapse)
-graph.add_edge("generate_final_summary", END)
+def build_summarize_graph(
+    llm: BaseChatModel,
+    token_max: int = DEFAULT_TOKEN_MAX,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    length_function: Callable[[List[Document]], int] = None,
+):
+    """
+    Compile the map-reduce summarization graph for the given model.
+    Summaries are collapsed until they total at most `token_max` tokens, at most `max_concurrency`
+    collapse calls run at once. Map calls are bounded by the `max_concurrency` of the run config.
+    Token counts are memoized across the collapse rounds, unless a `length_function` is given.
+    """
+    length_function = length_function or TokenCounter(llm)
+
+    # Here we generate a summary, given a document
+    async def generate_summary(state: SummaryState):
+        prompt = map_prompt.invoke(state["content"])
+        response = await llm.ainvoke(prompt)
+        return {"summaries": [response.content]}
+
+    # Each `Send` maps a document to its own summary node
+    def map_summaries(state: OverallState):
+        return [
+            Send("generate_summary", {"content": content}) for content in state["contents"]
+        ]
+
+    def collect_summaries(state: OverallState):
+        return {
+            "collapsed_summaries": [Document(summary) for summary in state["summaries"]]
+        }
+
+    async def _reduce(input: dict) -> str:
+        prompt = reduce_prompt.invoke(input)
+        response = await llm.ainvoke(prompt)
+        return response.content
+
+    # The groups of summaries that fit in the budget are collapsed concurrently
+    async def collapse_summaries(state: OverallState):
+        doc_lists = split_list_of_docs(
+            state["collapsed_summaries"], length_function, token_max
+        )
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def collapse(doc_list: List[Document]) -> Document:
+            async with semaphore:
+                return await acollapse_docs(doc_list, _reduce)
+
+        results = await asyncio.gather(*(collapse(doc_list) for doc_list in doc_lists))
+        return {"collapsed_summaries": list(results)}
+
+    # Collapse again as long as the summaries exceed the budget
+    def should_collapse(
+        state: OverallState,
+    ) -> Literal["collapse_summaries", "generate_final_summary"]:
+        num_tokens = length_function(state["collapsed_summaries"])
+        if num_tokens > token_max:
+            return "collapse_summaries"
+        else:
+            return "generate_final_summary"
+
+    # Here we will generate the final summary
+    async def generate_final_summary(state: OverallState):
+        response = await _reduce(state["collapsed_summaries"])
+        return {"final_summary": response}
+
+    graph = StateGraph(OverallState)
+    graph.add_node("generate_summary", generate_summary)
+    graph.add_node("collect_summaries", collect_summaries)
+    graph.add_node("collapse_summaries", collapse_summaries)
+    graph.add_node("generate_final_summary", generate_final_summary)
+
+    graph.add_conditional_edges(START, map_summaries, ["generate_summary"])
+    graph.add_edge("generate_summary", "collect_summaries")
+    graph.add_conditional_edges("collect_summaries", should_collapse)
+    graph.add_conditional_edges("collapse_summaries", should_collapse)
+    graph.add_edge("generate_final_summary", END)
+    return graph.compile()
+
+
+async def astream_summarize(
+    llm: BaseChatModel,
+    docs: List[Document],
+    token_max: int = DEFAULT_TOKEN_MAX,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    recursion_limit: int = 10,
+) -> AsyncIterator[dict]:
+    """
+    Summarize the documents, yielding a progress event per finished step:
+    `{"step": "map", "done": i, "total": n}`, `{"step": "collapse", "summaries": n}`,
+    and lastly `{"step": "final", "summary": "..."}`.
+    """
+    app = build_summarize_graph(llm, token_max=token_max, max_concurrency=max_concurrency)
+    total, done = len(docs), 0
+    async for step in app.astream(
+        {"contents": [doc.page_content for doc in docs]},
+        {"recursion_limit": recursion_limit, "max_concurrency": max_concurrency},
+    ):
+        for node, update in step.items():
+            if node == "generate_summary":
+                done += 1
+                yield {"step": "map", "done": done, "total": total}
+            elif node == "collapse_summaries":
+                yield {"step": "collapse", "summaries": len(update["collapsed_summaries"])}
+            elif node == "generate_final_summary":
+                yield {"step": "final", "summary": update["final_summary"]}
+
+
+async def summarize(llm: BaseChatModel, docs: List[Document], **kwargs) -> str:
+    """
+    Summarize the documents and return the final summary, see `astream_summarize` for the options.
+    """
+    summary = ""
+    async for event in astream_summarize(llm, docs, **kwargs):
+        if event["step"] == "final":
+            summary = event["summary"]
+    return summary
 
-app = graph.compile()
 
 async def main():
-    async for step in app.astream(
-        {"contents": [doc.page_content for doc in split_docs]},
-        {"recursion_limit": 10},
-    ):
-        print(list(step.keys()))
-        print(step)
+    from langchain_openai import ChatOpenAI
+    from cortex.retrieval.chunking import Chunker
+    chunker = Chunker.of(
+        file_type="txt",
+        splitter="text",
+        chunk_size=1000,
+        chunk_overlap=0
+    )
+    split_docs = chunker.split("tests/corpus/paul_graham_essay.txt")
+    print(f"Generated {len(split_docs)} documents.")
+    async for event in astream_summarize(ChatOpenAI(model="gpt-4o-mini"), split_docs):
+        print(event)
 
 if __name__ == "__main__":
     # Run the main function along with your openai key
     # For example `python summarize.py YOUR_OPENAI_KEY`
-    import asyncio
     import sys
     import os
     os.environ["OPENAI_API_KEY"] = sys.argv[1]
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
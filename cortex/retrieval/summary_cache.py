@@ -0,0 +1,170 @@
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from cortex.config import settings
+from cortex.storage.state import SharedState
+
+
+# Validators and content hash of the last fetch of each page
+pages = SharedState("summary:page", ttl=settings.summary_cache_ttl_seconds)
+# Summaries by page content, model, prompt and loader
+summaries = SharedState("summary:text", ttl=settings.summary_cache_ttl_seconds)
+
+http_client = httpx.Client(timeout=30, follow_redirects=True)
+# Pooled client of the async summarizations, the connections to each host are further limited
+async_http_client = httpx.AsyncClient(
+    timeout=30,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=settings.fetch_max_connections),
+)
+# Concurrency limits of the recently fetched hosts, with their number of requests in flight or waiting.
+# The least recently fetched idle hosts are dropped beyond the bound.
+# The event loop of the API is the only one using them.
+HOST_LIMITS_SIZE = 1024
+_host_limits: "OrderedDict[str, list]" = OrderedDict()
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Lowercase the scheme and host, drop the default port and the fragment, and sort the query.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def summary_key(url: str, content_hash: str, model: str, prompt: str, enable_docling: bool = False) -> str:
+    key = json.dumps([url, content_hash, model, prompt, enable_docling])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _conditional_headers(page: Optional[dict]) -> dict:
+    headers = {}
+    if page is not None:
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+    return headers
+
+
+def _record_page(page_url: str, response: httpx.Response) -> str:
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    pages.set(page_url, {
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "content_hash": content_hash,
+    })
+    return content_hash
+
+
+def summarize_with_cache(
+    url: str, model: str, prompt: str, summarize: Callable[[httpx.Response], str], enable_docling: bool = False
+) -> str:
+    """
+    Return the summary of the page for the model, prompt and loader, calling `summarize` on the fetched page
+    only when no summary of its current content is cached.
+    The page is revalidated with its ETag / Last-Modified, an unchanged page is not downloaded again.
+    """
+    page_url = normalize_url(url)
+    page = pages.get(page_url, cached=False)
+    response = http_client.get(url, headers=_conditional_headers(page))
+    if response.status_code == 304 and page is not None:
+        summary = summaries.get(summary_key(page_url, page["content_hash"], model, prompt, enable_docling))
+        if summary is not None:
+            return summary
+        # The summary expired before the page did
+        response = http_client.get(url)
+    response.raise_for_status()
+
+    key = summary_key(page_url, _record_page(page_url, response), model, prompt, enable_docling)
+    summary = summaries.get(key)
+    if summary is None:
+        summary = summarize(response)
+        summaries.set(key, summary)
+    return summary
+
+
+@asynccontextmanager
+async def _host_slot(host: str):
+    """
+    Hold one of the `fetch_per_host_limit` slots of the host.
+    A host with requests is never evicted, its new requests would get a fresh semaphore past the limit.
+    """
+    entry = _host_limits.get(host)
+    if entry is None:
+        entry = _host_limits[host] = [asyncio.Semaphore(settings.fetch_per_host_limit), 0]
+    else:
+        _host_limits.move_to_end(host)
+    entry[1] += 1
+    try:
+        excess = len(_host_limits) - HOST_LIMITS_SIZE
+        if excess > 0:
+            for idle in [h for h, (_, requests) in _host_limits.items() if not requests][:excess]:
+                del _host_limits[idle]
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+
+
+async def aclose_http_clients():
+    """
+    Close the pooled connections, on shutdown of the API.
+    """
+    await async_http_client.aclose()
+    http_client.close()
+    _host_limits.clear()
+
+
+async def _afetch(url: str, headers: dict = None) -> httpx.Response:
+    async with _host_slot(httpx.URL(url).host):
+        return await async_http_client.get(url, headers=headers)
+
+
+async def asummarize_with_cache(
+    url: str,
+    model: str,
+    prompt: str,
+    summarize: Callable[[httpx.Response], Awaitable[str]],
+    enable_docling: bool = False,
+) -> str:
+    """
+    Async version of `summarize_with_cache`, fetching over the pooled client
+    with at most `fetch_per_host_limit` concurrent requests per host.
+    The Redis calls of the cache run in worker threads, off the event loop.
+    """
+    page_url = normalize_url(url)
+    page = await asyncio.to_thread(pages.get, page_url, cached=False)
+    response = await _afetch(url, headers=_conditional_headers(page))
+    if response.status_code == 304 and page is not None:
+        summary = await asyncio.to_thread(
+            summaries.get, summary_key(page_url, page["content_hash"], model, prompt, enable_docling)
+        )
+        if summary is not None:
+            return summary
+        response = await _afetch(url)
+    response.raise_for_status()
+
+    def lookup() -> tuple:
+        key = summary_key(page_url, _record_page(page_url, response), model, prompt, enable_docling)
+        return key, summaries.get(key)
+
+    key, summary = await asyncio.to_thread(lookup)
+    if summary is None:
+        summary = await summarize(response)
+        await asyncio.to_thread(summaries.set, key, summary)
+    return summary
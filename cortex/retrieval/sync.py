@@ -0,0 +1,164 @@
+"""
+Incremental sync of a folder into a collection.
+A manifest of the synced files, their size, modification time, content hash and chunk ids, is kept
+per collection: a run only ingests the added and modified files, and deletes the chunks of the removed ones.
+With `--watch`, the folder is synced again every few seconds.
+
+Usage:
+    PYTHONPATH=$(pwd) poetry run python -m cortex.retrieval.sync tests/corpus --name corpus [--watch 10]
+"""
+import os
+import time
+import hashlib
+import argparse
+from typing import Callable, Dict, Optional
+
+from cortex.config import settings
+from cortex.storage import catalog
+from cortex.storage.state import SharedState
+from cortex.retrieval.backends import get_backend
+from cortex.retrieval.ingest import ingest_directory, walk
+
+
+# Synced files of each collection, a hash field per path relative to the folder
+manifests = SharedState("sync:files")
+# Held by the running sync of a collection, two syncs would both ingest the same changes
+sync_locks = SharedState("sync:lock", ttl=settings.task_lease_seconds)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def diff_folder(directory: str, manifest: Dict[str, dict], on_hashed: Optional[Callable[[], None]] = None) -> tuple:
+    """
+    Compare the folder with its manifest, return the added or modified files with their entry,
+    the files only touched, and the removed ones.
+    A file whose size and modification time are unchanged is not read again,
+    `on_hashed()` is called after reading each of the others.
+    """
+    to_convert, to_chunk, _ = walk(directory)
+    changed, touched = {}, {}
+    for path in to_convert + to_chunk:
+        tag = os.path.relpath(path, directory)
+        stat = os.stat(path)
+        entry = manifest.get(tag)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        content_hash = file_hash(path)
+        if on_hashed is not None:
+            on_hashed()
+        if entry is not None and entry["hash"] == content_hash:
+            touched[tag] = {**entry, "mtime": stat.st_mtime}
+        else:
+            changed[tag] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": content_hash}
+    present = {os.path.relpath(path, directory) for path in to_convert + to_chunk}
+    removed = [tag for tag in manifest if tag not in present]
+    return changed, touched, removed
+
+
+def sync_folder(
+    directory: str,
+    name: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 50,
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[float, dict], None]] = None,
+) -> dict:
+    """
+    Bring the collection up to date with the folder.
+    Returns the added, updated, removed and unchanged file counts, with the report of the ingestion.
+    """
+    directory = os.path.abspath(directory)
+    if not sync_locks.set(name, directory, only_if_absent=True):
+        raise RuntimeError(f"The collection {name} is already being synced")
+    lease_renewed = time.monotonic()
+
+    def renew_lease():
+        # Hashing a large folder may outlast the lease, which is renewed well before it expires
+        nonlocal lease_renewed
+        if time.monotonic() - lease_renewed > settings.task_lease_seconds / 3:
+            sync_locks.set(name, directory)
+            lease_renewed = time.monotonic()
+
+    try:
+        manifest = manifests.get_fields(name, cached=False)
+        changed, touched, removed = diff_folder(directory, manifest, on_hashed=renew_lease)
+
+        # The chunks of the modified and removed files go first, the manifest forgets them
+        # so that a file failing to ingest is retried by the next run
+        backend = get_backend()
+        stale = [tag for tag in changed if tag in manifest] + removed
+        for tag in stale:
+            backend.delete(name, ids=manifest.pop(tag)["ids"])
+            catalog.remove_tag(name, tag)
+        if stale:
+            backend.flush(name)
+            manifests.delete_fields(name, *stale)
+        manifests.set_fields(name, touched)
+        unchanged = len(manifest)
+        embedded = {}
+
+        def on_embedded(path: str, ids: list):
+            tag = os.path.relpath(path, directory)
+            embedded[tag] = {**changed[tag], "ids": ids}
+
+        def on_ingest_progress(progress: float, report: dict):
+            sync_locks.set(name, directory)
+            if on_progress is not None:
+                on_progress(progress, report)
+
+        report = ingest_directory(
+            directory,
+            name,
+            chunk_size,
+            chunk_overlap,
+            workers,
+            on_ingest_progress,
+            paths=[os.path.join(directory, tag) for tag in changed],
+            on_embedded=on_embedded,
+        )
+        # Only the entries of the ingested files are written, once their chunks are flushed
+        manifests.set_fields(name, embedded)
+    finally:
+        sync_locks.delete(name)
+
+    return {
+        "added": sum(tag not in stale for tag in changed),
+        "updated": sum(tag in stale for tag in changed),
+        "removed": len(removed),
+        "unchanged": unchanged,
+        "report": report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", default=settings.file_collection_folder)
+    parser.add_argument("--name", required=True, help="collection to sync the folder into")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="chunking processes, defaults to the CPU count")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS", help="sync again every SECONDS")
+    args = parser.parse_args()
+
+    while True:
+        result = sync_folder(args.directory, args.name, args.chunk_size, args.chunk_overlap, args.workers)
+        report = result["report"]
+        print(
+            f"{result['added']} added, {result['updated']} updated, {result['removed']} removed, "
+            f"{result['unchanged']} unchanged in {report['wall_seconds']:.1f} s"
+        )
+        for path, error in report["failures"].items():
+            print(f"failed: {path}: {error}")
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
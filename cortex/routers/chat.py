@@ -0,0 +1,54 @@
+import json
+from contextlib import aclosing
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from cortex.tools.chat import ChatRequest, astream_chat
+from cortex.tools.answer_cache import get_answer_cache
+from cortex.admin.authenticate import verify_bearer_token
+
+
+router = APIRouter(prefix="/api/v1/chat", tags=["Chat"], dependencies=[Depends(verify_bearer_token)])
+
+
+def _event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@router.post("")
+async def chat(request: ChatRequest, http_request: Request):
+    """
+    POST endpoint to chat with the default or the context agent, streaming the answer as server-sent events.
+    Each token is a `data: {"token": ...}` event, the full answer comes last in a `done` event.
+    Tokens are generated as the client reads them, and the agent stops when the client disconnects.
+    """
+
+    async def events():
+        answer = ""
+        try:
+            async with aclosing(astream_chat(request)) as tokens:
+                async for token in tokens:
+                    if await http_request.is_disconnected():
+                        return
+                    answer += token
+                    yield _event({"token": token})
+        except Exception as e:
+            yield _event({"error": str(e)}, event="error")
+            return
+        yield _event({"answer": answer}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache/stats")
+def get_cache_stats(name: str):
+    """
+    GET endpoint to retrieve the hits and misses of the answer cache over a collection.
+    """
+    return get_answer_cache().get_stats(name)
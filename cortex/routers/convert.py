@@ -0,0 +1,57 @@
+import os
+import uuid
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from validators import url as validate_url
+from cortex.config import settings
+from cortex.retrieval.converter_pool import get_converter_pool
+from cortex.admin.authenticate import verify_bearer_token
+
+
+router = APIRouter(prefix="/api/v1/convert", tags=["Document conversion"], dependencies=[Depends(verify_bearer_token)])
+
+CONVERT_FOLDER = os.path.join(settings.upload_folder, "convert")
+
+
+@router.post("", status_code=202)
+async def start_conversion(file: UploadFile = File(None), url: str = Form(None)):
+    """
+    POST endpoint to convert an uploaded document, or the document at a URL, to markdown.
+    The conversion runs in the Docling converter pool, returns the job_id to poll.
+    """
+    if file is not None:
+        # The upload is converted in place and deleted afterwards
+        os.makedirs(CONVERT_FOLDER, exist_ok=True)
+        source = os.path.join(CONVERT_FOLDER, f"{uuid.uuid4()}-{os.path.basename(file.filename)}")
+        with open(source, "wb") as f:
+            while chunk := await file.read(1024 * 1024):
+                f.write(chunk)
+        # Looking the file up in the conversion cache hashes it, off the event loop
+        job_id = await run_in_threadpool(get_converter_pool().submit, source, cleanup=True)
+    elif url is not None and validate_url(url):
+        # Submitting records the job in Redis, off the event loop as well
+        job_id = await run_in_threadpool(get_converter_pool().submit, url)
+    else:
+        raise HTTPException(status_code=400, detail="Either a file or a valid URL is required.")
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Conversion started successfully.",
+            "job_id": job_id,
+            "check_status_url": f"/api/v1/convert/{job_id}",
+        }
+    )
+
+
+@router.get("/{job_id}")
+def get_conversion(job_id: str):
+    """
+    GET endpoint to retrieve the status of a conversion, with its markdown once completed.
+    """
+    job = get_converter_pool().job_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, **job}
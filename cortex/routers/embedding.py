@@ -1,9 +1,12 @@
+import os
 import uuid
 import threading
 
 from fastapi import APIRouter, Body, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from cortex.retrieval.embedding import *
+from cortex.retrieval.ingest import IngestRequest, start_ingest_task
+from cortex.retrieval.sync import sync_folder
 from cortex.admin.authenticate import verify_bearer_token
 
 
@@ -38,6 +41,60 @@ def start_embedding(request: EmbeddingRequest = Body(...)):
     )
 
 
+def _collection_directory(directory: str) -> str:
+    root = os.path.realpath(settings.file_collection_folder)
+    directory = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, directory]) != root or not os.path.isdir(directory):
+        raise HTTPException(status_code=400, detail="Invalid directory")
+    return directory
+
+
+def _start_ingest(request: IngestRequest, run=None) -> JSONResponse:
+    directory = _collection_directory(request.directory)
+    task_id = str(uuid.uuid4())
+    initialize_embedding_task(task_id)
+    thread = threading.Thread(target=start_ingest_task, args=(request, directory, task_id, run), daemon=True)
+    thread.start()
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Ingestion task started successfully.",
+            "task_id": task_id,
+            "check_status_url": f"/embedding/ingest/{task_id}"
+        }
+    )
+
+
+@router.post("/ingest", status_code=202)
+def start_ingest(request: IngestRequest = Body(...)):
+    """
+    POST endpoint to convert, chunk and embed all the files of a directory of the file collection.
+    Runs as an embedding task, its report of the stages is returned by `/ingest/{task_id}`.
+    """
+    return _start_ingest(request)
+
+
+@router.post("/sync", status_code=202)
+def start_sync(request: IngestRequest = Body(...)):
+    """
+    POST endpoint to sync a directory of the file collection into a collection,
+    only the files added or modified since the last sync are ingested, the removed ones are deleted.
+    """
+    return _start_ingest(request, run=sync_folder)
+
+
+@router.get("/ingest/{task_id}")
+def get_ingest_report(task_id: str):
+    """
+    GET endpoint to retrieve the progress of an ingestion task, with the throughput of each stage.
+    """
+    if not is_task_id_in_tasks(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    status = get_task_status(task_id)
+    return {**status.model_dump(), "report": load_task_by_id(task_id).get("report")}
+
+
 @router.get("/task/{task_id}", response_model=TaskStatus)
 def get_progress(task_id: str):
     """
@@ -74,6 +131,16 @@ def get_embedded_names():
     return names
 
 
+@router.post("/catalog/rebuild", response_model=set)
+def rebuild_catalog():
+    """
+    POST endpoint to rebuild the catalog from a full scan of the vector backend,
+    after its storage was changed outside of the API. Returns the names found.
+    """
+    ensure_catalog(force=True)
+    return get_all_embedded_names()
+
+
 @router.get("/tags", response_model=set)
 def get_tags_by_name(name: str):
     """
@@ -85,6 +152,17 @@ def get_tags_by_name(name: str):
     return tags
 
 
+@router.get("/tags/counts", response_model=dict)
+def get_tag_counts(name: str):
+    """
+    GET endpoint to retrieve the chunk count of each tag of a collection by its name.
+    """
+    counts = get_tag_counts_by_name(name)
+    if counts is None:
+        raise HTTPException(status_code=404, detail="Name not found")
+    return counts
+
+
 @router.delete("/tags")
 def delete_tags_by_name(name: str, tags: str):
     """
@@ -1,34 +1,63 @@
 import os
+import re
 import json
 import time
+import uuid
+import shutil
+import logging
 import hashlib
+from contextlib import ExitStack, contextmanager
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
 import numpy as np
 import faiss
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
 from cortex.config import settings
+from cortex.storage.state import SharedState
 
 from langchain_community.document_loaders import TextLoader
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pydantic import BaseModel
+from cortex.retrieval.file_index import (
+    file_index_cache, build_file_index, update_file_index, get_index_folder, index_exists, search_files
+)
 
 
+log = logging.getLogger(__name__)
+
 # Ensure directories exist
 os.makedirs(settings.upload_folder, exist_ok=True)
 os.makedirs(settings.temp_index_folder, exist_ok=True)
 
 # ---------------------
-# Global in-memory session storage
+# Session storage shared by the API workers
 # ---------------------
-# Mapping from session_id to a list of file_ids
-session_files = {}
+# Mapping from session_id to the list of its file_ids, sessions expire once neither read nor written
+session_files = SharedState("files:session", ttl=settings.state_ttl_seconds)
+
+# Mapping from file_id to the sessions referencing it, file ids are hashes of the file content.
+# The references expire along with the sessions, which refresh them, and the files left without
+# references are swept.
+file_sessions = SharedState("files:refs", ttl=settings.state_ttl_seconds)
+
+# File ids being indexed, sessions uploading them meanwhile are attached once they are done.
+# A worker dying while indexing only holds the file for the task lease.
+pending_files = SharedState("files:pending", ttl=settings.task_lease_seconds)
+
+# Leases of the file ids whose index is being moved, see `locked_file`
+file_locks = SharedState("files:lock", ttl=settings.task_lease_seconds)
 
 
 # Mapping from file_id to progress status (e.g., "Received", "Saving file", "Building FAISS index", "Done", or error)
-progress_status = {}
+progress_status = SharedState("files:progress", ttl=settings.state_ttl_seconds)
+
+# Marks the latest sweep of the unreferenced files, a single worker sweeps them per period
+SWEEP_INTERVAL_SECONDS = 3600
+file_sweeps = SharedState("files:sweep", ttl=SWEEP_INTERVAL_SECONDS)
 
 
 # ---------------------
@@ -50,62 +79,197 @@ def get_embedding(text: str, dim: int = 128) -> np.ndarray:
 router = APIRouter(prefix="/files",  tags=["Files API"])
 
 
+FILE_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+
+def content_file_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def locked_file(file_id: str):
+    """
+    Hold the lease of the file id across the workers, while the sessions referencing the file
+    are decided on and its index is moved. A dying worker holds it for the task lease at most.
+    """
+    token = uuid.uuid4().hex
+    while not file_locks.set(file_id, token, only_if_absent=True):
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if file_locks.get(file_id, cached=False) == token:
+            file_locks.delete(file_id)
+
+
+# ---------------------
+# Session References to the Content-Addressed Files
+# ---------------------
+def register_upload(session_id: str, file_id: str) -> bool:
+    """
+    Reference the file from the session, return whether its content still has to be indexed.
+    Identical content is indexed once, and attached right away once its index exists.
+    Waits while the index of the file is replaced by a new version, see `update_file`.
+    """
+    # The reference goes first: the worker indexing the file attaches it once the pending mark is gone
+    file_sessions.add(file_id, session_id)
+    if pending_files.exists(file_id):
+        return False
+    with locked_file(file_id):
+        if index_exists(file_id):
+            attach_file(session_id, file_id)
+            progress_status.set(file_id, {"status": "Done", "progress": 1.0})
+            return False
+    # Another worker may have started on the same content in the meantime
+    return pending_files.set(file_id, True, only_if_absent=True)
+
+
+def finish_indexing(file_id: str, session_id: str):
+    pending_files.delete(file_id)
+    for attached_session in file_sessions.members(file_id, cached=False) or [session_id]:
+        attach_file(attached_session, file_id)
+
+
+def attach_file(session_id: str, file_id: str):
+    session_files.add(session_id, file_id)
+    touch_session(session_id)
+
+
+def touch_session(session_id: str):
+    """
+    Keep the session and the references to its files alive for another `state_ttl_seconds`.
+    """
+    session_files.touch(session_id)
+    file_sessions.touch(*session_files.members(session_id, cached=False))
+
+
+def delete_file(file_id: str):
+    progress_status.delete(file_id)
+    file_index_cache.invalidate(file_id)
+    shutil.rmtree(get_index_folder(file_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(settings.upload_folder, file_id), ignore_errors=True)
+
+
+def detach_file(session_id: str, file_id: str):
+    """
+    Drop the reference of the session to the file, the file is deleted with its last reference.
+    """
+    session_files.remove(session_id, file_id)
+    if file_sessions.remove(file_id, session_id) == 0:
+        delete_file(file_id)
+
+
+def abandon_indexing(file_id: str):
+    """
+    Drop a file whose indexing failed along with the references of the sessions waiting for it.
+    The caller records the error for them to see.
+    """
+    file_sessions.delete(file_id)
+    pending_files.delete(file_id)
+    delete_file(file_id)
+
+
+def sweep_files():
+    """
+    Delete the uploaded files no session references anymore, e.g. those of the expired sessions.
+    """
+    for file_id in os.listdir(settings.upload_folder):
+        # The upload folder also holds the uploads of the other APIs, which have no file index
+        if not FILE_ID_PATTERN.match(file_id) or not index_exists(file_id):
+            continue
+        if not file_sessions.exists(file_id) and not pending_files.exists(file_id):
+            delete_file(file_id)
+
+
 # ---------------------
 # Background Task for Processing the Uploaded File
 # ---------------------
+def save_and_split(file_id: str, text: str, original_filename: str) -> list:
+    upload_path = os.path.join(settings.upload_folder, file_id)
+    os.makedirs(upload_path, exist_ok=True)
+    # Only the latest version of the file is kept
+    for name in os.listdir(upload_path):
+        if name != original_filename:
+            os.remove(os.path.join(upload_path, name))
+    file_path = os.path.join(upload_path, original_filename)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+    # Split the file content into chunks (fixed-size chunks of 1000 characters)
+    chunk_size = 1000
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+    )
+    loader = TextLoader(
+        file_path=file_path,
+        autodetect_encoding=True,
+    )
+    chunks = loader.load_and_split(text_splitter=splitter)
+    if not chunks:
+        raise Exception("File is empty after processing.")
+    return chunks
+
+
 def process_file(file_id: str, text: str, original_filename: str, session_id: str):
     try:
         # Update progress: Saving file (0.3)
-        progress_status[file_id] = {"status": "Saving file", "progress": 0.3}
-        upload_path = os.path.join(settings.upload_folder, file_id)
-        os.makedirs(upload_path, exist_ok=True)
-        file_path = os.path.join(upload_path, original_filename)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(text)
+        progress_status.set(file_id, {"status": "Saving file", "progress": 0.3})
+        chunks = save_and_split(file_id, text, original_filename)
 
         # Update progress: Building FAISS index (0.7)
-        index_folder = os.path.join(settings.temp_index_folder, file_id)
+        progress_status.set(file_id, {"status": "Building FAISS index", "progress": 0.7})
+        index_folder = get_index_folder(file_id)
         os.makedirs(index_folder, exist_ok=True)
 
-        # Split the file content into chunks (fixed-size chunks of 1000 characters)
-        chunk_size = 1000
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-        )
-        loader = TextLoader(
-            file_path=file_path,
-            autodetect_encoding=True,
-        )
-        chunks = loader.load_and_split(text_splitter=splitter)
-        progress_status[file_id] = {"status": "Building FAISS index", "progress": 0.7}
+        # Compute embeddings for each chunk and persist them along with a columnar docstore
+        build_file_index(index_folder, chunks)
+        file_index_cache.invalidate(file_id)
+        # Identical uploads received meanwhile are attached as well
+        finish_indexing(file_id, session_id)
 
-        if not chunks:
-            raise Exception("File is empty after processing.")
+        # Mark progress as complete (1.0)
+        progress_status.set(file_id, {"status": "Done", "progress": 1.0})
+    except Exception as e:
+        abandon_indexing(file_id)
+        progress_status.set(file_id, {"status": f"Error: {str(e)}", "progress": 0.0})
 
-        # Compute embeddings for each chunk
-        embeddings = OllamaEmbeddings(
-            base_url=settings.ollama_base_url,
-            model="nomic-embed-text:latest",
-        )
-        vector_store = FAISS.from_documents(documents=chunks, embedding=embeddings)
-
-        # vector_store = FAISS(
-        #     embedding_function=embeddings,
-        #     index=index,
-        #     docstore=InMemoryDocstore(),
-        #     index_to_docstore_id={},
-        # )
-        # for i, chunk in enumerate(chunks):
-        #     vector_store.aadd_documents([chunk])
-        #     # Update progress based on the number of chunks processed
-        #     progress_status[file_id] = {"status": "Adding documents to vector store", "progress": 0.7 + 0.2 * (i / len(chunks))}
-        vector_store.save_local(folder_path=index_folder)
-        session_files.setdefault(session_id, []).append(file_id)
 
-        # Mark progress as complete (1.0)
-        progress_status[file_id] = {"status": "Done", "progress": 1.0}
+def update_file(file_id: str, new_file_id: str, text: str, original_filename: str, session_id: str):
+    try:
+        progress_status.set(new_file_id, {"status": "Saving file", "progress": 0.3})
+        # Leftovers of a failed attempt at indexing the new version
+        shutil.rmtree(get_index_folder(new_file_id), ignore_errors=True)
+        shutil.rmtree(os.path.join(settings.upload_folder, new_file_id), ignore_errors=True)
+        chunks = save_and_split(new_file_id, text, original_filename)
+        # Sessions uploading the previous version meanwhile wait for it to be either copied or moved,
+        # they are then attached to the previous version or index it again.
+        with ExitStack() as lock:
+            lock.enter_context(locked_file(file_id))
+            shared = set(file_sessions.members(file_id, cached=False)) - {session_id}
+            if shared:
+                # Other sessions keep the previous version, the new one starts as a copy of it
+                shutil.copytree(get_index_folder(file_id), get_index_folder(new_file_id))
+                index_folder = get_index_folder(new_file_id)
+                lock.close()
+            else:
+                index_folder = get_index_folder(file_id)
+
+            # Only the new or changed chunks are embedded, the index is updated in place.
+            # The embedding comes before any write, a failure leaves the session on the previous version.
+            progress_status.set(new_file_id, {"status": "Updating FAISS index", "progress": 0.7})
+            stats = update_file_index(index_folder, chunks)
+            if not shared:
+                os.rename(index_folder, get_index_folder(new_file_id))
+        file_index_cache.invalidate(file_id)
+        file_index_cache.invalidate(new_file_id)
+        log.debug(f"Updated index of file {file_id} to {new_file_id}: {stats}")
+
+        detach_file(session_id, file_id)
+        finish_indexing(new_file_id, session_id)
+        progress_status.set(new_file_id, {"status": "Done", "progress": 1.0})
     except Exception as e:
-        progress_status[file_id] = {"status": f"Error: {str(e)}", "progress": 0.0}
+        abandon_indexing(new_file_id)
+        progress_status.set(new_file_id, {"status": f"Error: {str(e)}", "progress": 0.0})
 
 
 # ---------------------
@@ -124,21 +288,63 @@ async def upload_file(
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="File must be UTF-8 encoded text.")
 
-    # Generate a unique file_id (hash of content + current time)
-    hash_input = text + str(time.time())
-    file_id = hashlib.sha256(hash_input.encode("utf-8")).hexdigest()[:16]
+    # The file_id is the hash of the content, identical uploads share the same index
+    file_id = content_file_id(text)
+    if await run_in_threadpool(register_upload, session_id, file_id):
+        # Initialize progress: "Received" with 0 progress
+        progress_status.set(file_id, {"status": "Received", "progress": 0.0})
 
-    # Initialize progress: "Received" with 0 progress
-    progress_status[file_id] = {"status": "Received", "progress": 0.0}
-
-    # Trigger background processing
-    background_tasks.add_task(process_file, file_id, text, file.filename, session_id)
+        # Trigger background processing
+        background_tasks.add_task(process_file, file_id, text, file.filename, session_id)
+    if file_sweeps.set("latest", True, only_if_absent=True):
+        background_tasks.add_task(sweep_files)
 
     # Build progress URL (assuming client can reach the same server address)
     progress_url = f"/files/progress?file_id={file_id}"
     return {"file_id": file_id, "progress_url": progress_url}
 
 
+# ---------------------
+# API: Re-upload a File, Re-indexing Only Its Changed Chunks
+# ---------------------
+@router.put("/file/{file_id}")
+async def replace_file(
+    file_id: str,
+    background_tasks: BackgroundTasks,
+    session_id: str = Form(...),
+    file: UploadFile = File(...)
+):
+    if not index_exists(file_id) or session_id not in file_sessions.members(file_id, cached=False):
+        raise HTTPException(status_code=404, detail="File not found in the session.")
+    contents = await file.read()
+    try:
+        text = contents.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded text.")
+
+    # The new version gets the file_id of its content, the session moves over to it
+    new_file_id = content_file_id(text)
+    if new_file_id != file_id:
+        if await run_in_threadpool(register_upload, session_id, new_file_id):
+            progress_status.set(new_file_id, {"status": "Received", "progress": 0.0})
+            background_tasks.add_task(update_file, file_id, new_file_id, text, file.filename, session_id)
+        else:
+            detach_file(session_id, file_id)
+    progress_url = f"/files/progress?file_id={new_file_id}"
+    return {"file_id": new_file_id, "progress_url": progress_url}
+
+
+# ---------------------
+# API: Detach a File from a Session
+# ---------------------
+@router.delete("/file/{file_id}")
+def remove_file(file_id: str, session_id: str = Query(..., description="Session ID the file is attached to")):
+    if session_id not in file_sessions.members(file_id, cached=False):
+        raise HTTPException(status_code=404, detail="File not found in the session.")
+    detach_file(session_id, file_id)
+    return {"file_id": file_id, "session_id": session_id}
+
+
 # ---------------------
 # API: Get Upload & Embedding Progress by File ID
 # ---------------------
@@ -155,14 +361,15 @@ def get_progress(file_id: str = Query(..., description="File ID to check progres
 # ---------------------
 @router.get("/current")
 def list_files(session_id: str = Query(..., description="Session ID to fetch file list")):
-    files = session_files.get(session_id, [])
+    files = session_files.members(session_id)
+    # Reading the session keeps it alive as writing to it does
+    touch_session(session_id)
     return {"session_id": session_id, "files": files}
 
 # ---------------------
 # API 3: Get File Content by File ID
 # ---------------------
-@router.get("/file/{file_id}")
-def get_file_content(file_id: str):
+def get_upload_file_path(file_id: str) -> str:
     upload_path = os.path.join(settings.upload_folder, file_id)
     if not os.path.exists(upload_path):
         raise HTTPException(status_code=404, detail="File not found.")
@@ -171,15 +378,107 @@ def get_file_content(file_id: str):
     file_names = os.listdir(upload_path)
     if not file_names:
         raise HTTPException(status_code=404, detail="No file found in the folder.")
+    return os.path.join(upload_path, file_names[0])
+
+
+def _is_utf8_continuation(byte: int) -> bool:
+    return byte & 0xC0 == 0x80
+
+
+def read_text_window(file_path: str, offset: int, length: int) -> tuple:
+    """
+    Read about `length` bytes of the file from `offset`, without splitting a UTF-8 character.
+    Returns the text and the byte offsets it actually spans.
+    """
+    with open(file_path, "rb") as f:
+        # A few bytes around the window are enough to find the character boundaries
+        start = max(offset - 3, 0)
+        f.seek(start)
+        data = f.read(offset - start + length + 3)
+    begin = offset - start
+    while begin < len(data) and _is_utf8_continuation(data[begin]):
+        begin += 1
+    end = min(offset - start + length, len(data))
+    while end < len(data) and _is_utf8_continuation(data[end]):
+        end -= 1
+    end = max(end, begin)
+    return data[begin:end].decode("utf-8"), start + begin, start + end
 
-    file_path = os.path.join(upload_path, file_names[0])
+
+@router.get("/file/{file_id}")
+def get_file_content(
+    file_id: str,
+    offset: Optional[int] = Query(None, ge=0, description="Byte offset of a window of the content"),
+    length: Optional[int] = Query(None, ge=4, description="Byte length of the window, defaults to 64 KiB"),
+):
+    file_path = get_upload_file_path(file_id)
+    if offset is None and length is None:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+        return {"file_id": file_id, "content": content}
+
+    # Page through big files: only the requested window is read
+    size = os.path.getsize(file_path)
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        content, start, end = read_text_window(file_path, offset or 0, length or 64 * 1024)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+    return {
+        "file_id": file_id,
+        "content": content,
+        "offset": start,
+        "next_offset": end if end < size else None,
+        "size": size,
+    }
+
+
+def _parse_http_date(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    # HTTP dates are in GMT, a date without a zone must not be read as local time
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
 
-    return {"file_id": file_id, "content": content}
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    # If-None-Match uses the weak comparison, W/ prefixes are ignored
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+
+# ---------------------
+# API 3b: Stream the Raw File, with HTTP Range and Conditional Requests
+# ---------------------
+@router.get("/file/{file_id}/raw")
+def stream_file_content(file_id: str, request: Request):
+    file_path = get_upload_file_path(file_id)
+    stat = os.stat(file_path)
+    etag = f'"{file_id}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {"etag": etag, "last-modified": last_modified, "cache-control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_matches(etag, if_none_match)
+    else:
+        if_modified_since = _parse_http_date(request.headers.get("if-modified-since"))
+        not_modified = if_modified_since is not None and int(stat.st_mtime) <= if_modified_since.timestamp()
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    # FileResponse streams the file in chunks and answers the Range and If-Range requests
+    return FileResponse(
+        file_path,
+        media_type="text/plain; charset=utf-8",
+        headers=headers,
+        stat_result=stat,
+    )
 
 # ---------------------
 # API 4: Get Relevant Chunks by Query
@@ -198,29 +497,43 @@ async def search_chunks(
     query = request.query
     top_k = request.top_k
 
-    index_folder = os.path.join(settings.temp_index_folder, file_id)
-    index_file = os.path.join(index_folder, "index.faiss")
-    pkl_file = os.path.join(index_folder, "index.pkl")
-
-    if not os.path.exists(index_file) or not os.path.exists(pkl_file):
+    # Indexes are memory-mapped and kept in an LRU cache across the requests
+    file_index = file_index_cache.get(file_id)
+    if file_index is None:
         raise HTTPException(
             status_code=404,
             detail="FAISS index or chunk mapping not found for the given file ID."
         )
-
-    embeddings = OllamaEmbeddings(
-        base_url=settings.ollama_base_url,
-        model="nomic-embed-text:latest",
-    )
-    vector_store = FAISS.load_local(
-        index_folder, embeddings, allow_dangerous_deserialization=True
-    )
-    print(f"Loaded FAISS index for file ID: {index_folder}")
-    results = vector_store.similarity_search(
-        query=query,
-        k=top_k,
-        search_type="mmr"
-    )
+    results = file_index.similarity_search(query=query, k=top_k)
     print(results)
 
     return {"file_id": file_id, "query": query, "results": results}
+
+
+
+# ---------------------
+# API 5: Get Relevant Chunks Across All the Files of a Session
+# ---------------------
+class SessionSearchRequest(BaseModel):
+    session_id: str
+    query: str
+    top_k: int = 5
+
+@router.post("/session/search")
+async def search_session_chunks(
+    request: SessionSearchRequest
+):
+    file_ids = session_files.members(request.session_id)
+    if not file_ids:
+        raise HTTPException(status_code=404, detail="No files found for the given session ID.")
+    await run_in_threadpool(touch_session, request.session_id)
+    # The query is embedded once and the files are searched in parallel, off the event loop
+    results = await run_in_threadpool(search_files, file_ids, request.query, request.top_k)
+    return {
+        "session_id": request.session_id,
+        "query": request.query,
+        "results": [
+            {"file_id": file_id, "chunk": doc, "score": distance}
+            for file_id, doc, distance in results
+        ],
+    }
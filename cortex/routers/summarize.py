@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import JSONResponse
-from cortex.retrieval.stuff import web_stuff_summarization
-from cortex.retrieval.stuff import SummarizeRequest, CategorizeRequest
+import json
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from cortex.config import settings
+from cortex.retrieval.stuff import aweb_stuff_summarization, load_web_splits, create_chat_llm
+from cortex.retrieval.stuff import (
+    SummarizeRequest, CategorizeRequest, MapReduceSummarizeRequest, BatchSummarizeRequest
+)
+from cortex.retrieval.summarize import astream_summarize
 from cortex.tools.categorize import categorize_summary
 from cortex.admin.authenticate import verify_bearer_token
 
@@ -11,10 +18,67 @@ router = APIRouter(prefix="/api/v1/summarize", tags=["Search related functions"]
 
 @router.post("/web")
 async def summarize(request: SummarizeRequest):
-    result = web_stuff_summarization(request.url, request.openai_key, **request.provider_options)
+    result = await aweb_stuff_summarization(request.url, request.openai_key, **request.provider_options)
     return JSONResponse(content={"web": request.url, "summary": result, "provider_options": request.provider_options})
 
 
+@router.post("/web/batch")
+async def summarize_batch(request: BatchSummarizeRequest):
+    """
+    Summarize many web pages at once, streaming an NDJSON line per page as soon as it is done.
+    Pages are fetched concurrently, and at most `summarize_max_concurrency` LLM calls run at a time.
+    """
+    llm_limit = asyncio.Semaphore(settings.summarize_max_concurrency)
+
+    async def summarize_url(url: str) -> dict:
+        try:
+            summary = await aweb_stuff_summarization(
+                url, request.openai_key, llm_limit=llm_limit, **request.provider_options
+            )
+            return {"web": url, "summary": summary}
+        except Exception as e:
+            return {"web": url, "error": str(e)}
+
+    async def results():
+        tasks = [asyncio.create_task(summarize_url(url)) for url in dict.fromkeys(request.urls)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # The client went away, stop the summarizations left
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@router.post("/web/mapreduce")
+async def summarize_map_reduce(request: MapReduceSummarizeRequest):
+    """
+    Summarize a long web page chunk by chunk, streaming the progress as NDJSON events.
+    The last event holds the summary, or the error that stopped the summarization.
+    """
+    try:
+        splits = await run_in_threadpool(load_web_splits, request.url, **request.provider_options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    llm = create_chat_llm(request.openai_key, **request.provider_options)
+
+    async def events():
+        try:
+            async for event in astream_summarize(
+                llm,
+                splits,
+                token_max=request.token_max or settings.summarize_token_max,
+                max_concurrency=request.max_concurrency or settings.summarize_max_concurrency,
+            ):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"step": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @router.post("/categorize")
 async def categorize(request: CategorizeRequest):
     result = categorize_summary(request.summary, request.openai_key, **request.provider_options)
@@ -0,0 +1,92 @@
+import redis
+from typing import Dict, Optional, Set
+from cortex.config import settings
+
+
+# The catalog lives in its own Redis db, db 0 is scanned as a whole by `load_all_tasks`.
+redis_client = redis.StrictRedis(host=settings.redis_host, port=settings.redis_port, db=3)
+
+COLLECTIONS_KEY = "catalog:collections"
+BUILT_KEY = "catalog:built"
+
+
+def _tags_key(name: str) -> str:
+    return f"catalog:tags:{name}"
+
+
+def _version_key(name: str) -> str:
+    return f"catalog:version:{name}"
+
+
+def is_catalog_built(source: str = "") -> bool:
+    """
+    Check whether the catalog has been populated from the given source, see `rebuild_catalog`.
+    """
+    built = redis_client.get(BUILT_KEY)
+    return built is not None and built.decode() == source
+
+
+def rebuild_catalog(collections: Dict[str, Dict[str, int]], source: str = ""):
+    """
+    Replace the whole catalog with the given {collection: {tag: count}} mapping.
+    `source` identifies the vector store scanned, a catalog built from another store is stale.
+    The versions of the collections are bumped, their content may have changed behind the catalog.
+    """
+    pipe = redis_client.pipeline()
+    previous = {name.decode() for name in redis_client.smembers(COLLECTIONS_KEY)}
+    for name in previous:
+        pipe.delete(_tags_key(name))
+    pipe.delete(COLLECTIONS_KEY)
+    for name, tags in collections.items():
+        pipe.sadd(COLLECTIONS_KEY, name)
+        if tags:
+            pipe.hset(_tags_key(name), mapping=tags)
+    for name in previous | set(collections):
+        pipe.incr(_version_key(name))
+    pipe.set(BUILT_KEY, source)
+    pipe.execute()
+
+
+def add_chunks(name: str, tag: str, count: int = 1):
+    """
+    Record `count` new chunks embedded under the given collection and tag.
+    """
+    pipe = redis_client.pipeline()
+    pipe.sadd(COLLECTIONS_KEY, name)
+    pipe.hincrby(_tags_key(name), tag, count)
+    pipe.incr(_version_key(name))
+    pipe.execute()
+
+
+def remove_tag(name: str, tag: str):
+    """
+    Drop a tag and its chunk count from the collection.
+    """
+    pipe = redis_client.pipeline()
+    pipe.hdel(_tags_key(name), tag)
+    pipe.incr(_version_key(name))
+    pipe.execute()
+
+
+def get_version(name: str) -> int:
+    """
+    Write version of the collection, bumped whenever chunks are added to or removed from it.
+    """
+    return int(redis_client.get(_version_key(name)) or 0)
+
+
+def list_collections() -> Set[str]:
+    """
+    Return the names of all the cataloged collections.
+    """
+    return {name.decode() for name in redis_client.smembers(COLLECTIONS_KEY)}
+
+
+def get_tag_counts(name: str) -> Optional[Dict[str, int]]:
+    """
+    Return the {tag: chunk count} mapping of a collection, or None if it is unknown.
+    """
+    if not redis_client.sismember(COLLECTIONS_KEY, name):
+        return None
+    counts = redis_client.hgetall(_tags_key(name))
+    return {tag.decode(): int(count) for tag, count in counts.items()}
@@ -0,0 +1,94 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+from typing import Optional
+
+
+MARKDOWN_FILE = "document.md"
+JSON_FILE = "document.json"
+
+
+class ConversionCache:
+    """
+    Content-addressed cache of the converted documents, their markdown and Docling JSON.
+    Entries are folders named after the hash of the source file and of the conversion options,
+    the least recently used are evicted once the folder exceeds `budget_bytes`.
+    """
+
+    def __init__(self, folder: str, budget_bytes: int):
+        self.folder = folder
+        self.budget_bytes = budget_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(path: str, options: dict) -> str:
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+        with open(path, "rb") as f:
+            while block := f.read(1024 * 1024):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        The markdown of the cached conversion, None on a miss.
+        """
+        try:
+            with open(os.path.join(self._entry(key), MARKDOWN_FILE), encoding="utf-8") as f:
+                markdown = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time of an entry is its last use, unless it was evicted meanwhile
+        try:
+            os.utime(self._entry(key))
+        except FileNotFoundError:
+            pass
+        return markdown
+
+    def get_json(self, key: str) -> Optional[dict]:
+        """
+        The Docling document of the cached conversion, None on a miss.
+        """
+        try:
+            with open(os.path.join(self._entry(key), JSON_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, markdown: str, document_json: str):
+        # Written aside and renamed, concurrent readers never see a partial entry
+        tmp = os.path.join(self.folder, f".tmp-{uuid.uuid4()}")
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, MARKDOWN_FILE), "w", encoding="utf-8") as f:
+            f.write(markdown)
+        with open(os.path.join(tmp, JSON_FILE), "w", encoding="utf-8") as f:
+            f.write(document_json)
+        try:
+            os.rename(tmp, self._entry(key))
+        except OSError:
+            # Converted concurrently by another worker
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.startswith(".tmp-"):
+                continue
+            entry = self._entry(name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, name))
+            except FileNotFoundError:
+                continue
+        used = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if used <= self.budget_bytes:
+                break
+            if name != keep:
+                shutil.rmtree(self._entry(name), ignore_errors=True)
+                used -= size
@@ -0,0 +1,114 @@
+import os
+import json
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+TEXTS_FILE = "texts.bin"
+METADATA_FILE = "metadata.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.npy"
+
+
+def _memmap(path: str) -> np.ndarray:
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class ColumnarDocstore:
+    """
+    Compact on-disk docstore of the chunks of a file, addressed by row in O(1).
+    The rows are the FAISS ids of the chunks, nothing is deserialized until a row is read.
+
+    Layout:
+    - texts.bin / metadata.bin: the UTF-8 page contents and JSON metadata, back to back
+    - offsets.npy: (rows, 4) int64 start and end offsets of the text and the metadata of each row
+    - ids.npy: the chunk id of each row
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.texts = _memmap(os.path.join(folder, TEXTS_FILE))
+        self.metadata = _memmap(os.path.join(folder, METADATA_FILE))
+        self.offsets = np.load(os.path.join(folder, OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(folder, IDS_FILE), mmap_mode="r")
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(folder, name))
+            for name in (TEXTS_FILE, METADATA_FILE, OFFSETS_FILE, IDS_FILE)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, row: int) -> Document:
+        text_start, text_end, metadata_start, metadata_end = self.offsets[row]
+        return Document(
+            id=self.ids[row].decode("utf-8"),
+            page_content=self.texts[text_start:text_end].tobytes().decode("utf-8"),
+            metadata=json.loads(self.metadata[metadata_start:metadata_end].tobytes()),
+        )
+
+    @staticmethod
+    def write(folder: str, documents: List[Document], ids: Optional[List[str]] = None):
+        """
+        Write the documents as rows 0..n-1, replacing any existing docstore in the folder.
+        Files are replaced atomically, readers of the previous docstore keep their mappings.
+        """
+        ids = ids or [doc.id or str(row) for row, doc in enumerate(documents)]
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, TEXTS_FILE + ".tmp"), "wb") as texts, \
+                open(os.path.join(folder, METADATA_FILE + ".tmp"), "wb") as metadata:
+            offsets = _write_rows(texts, metadata, documents, 0, 0)
+        for name in (TEXTS_FILE, METADATA_FILE):
+            os.replace(os.path.join(folder, name + ".tmp"), os.path.join(folder, name))
+        _save_array(os.path.join(folder, OFFSETS_FILE), offsets)
+        _save_array(os.path.join(folder, IDS_FILE), _encode_ids(ids))
+
+    @staticmethod
+    def append(folder: str, documents: List[Document], ids: List[str]) -> range:
+        """
+        Append the documents as new rows and return their row numbers.
+        The data files only grow, so existing readers are unaffected.
+        """
+        offsets = np.load(os.path.join(folder, OFFSETS_FILE))
+        existing_ids = np.load(os.path.join(folder, IDS_FILE))
+        text_offset = os.path.getsize(os.path.join(folder, TEXTS_FILE))
+        metadata_offset = os.path.getsize(os.path.join(folder, METADATA_FILE))
+        with open(os.path.join(folder, TEXTS_FILE), "ab") as texts, \
+                open(os.path.join(folder, METADATA_FILE), "ab") as metadata:
+            new_offsets = _write_rows(texts, metadata, documents, text_offset, metadata_offset)
+        _save_array(os.path.join(folder, OFFSETS_FILE), np.concatenate([offsets, new_offsets]))
+        _save_array(os.path.join(folder, IDS_FILE), np.concatenate([existing_ids, _encode_ids(ids)]))
+        return range(len(offsets), len(offsets) + len(documents))
+
+
+def _write_rows(texts, metadata, documents: List[Document], text_offset: int, metadata_offset: int) -> np.ndarray:
+    offsets = np.zeros((len(documents), 4), dtype=np.int64)
+    for row, doc in enumerate(documents):
+        text = doc.page_content.encode("utf-8")
+        meta = json.dumps(doc.metadata, ensure_ascii=False).encode("utf-8")
+        texts.write(text)
+        metadata.write(meta)
+        offsets[row] = (
+            text_offset, text_offset + len(text), metadata_offset, metadata_offset + len(meta)
+        )
+        text_offset += len(text)
+        metadata_offset += len(meta)
+    return offsets
+
+
+def _encode_ids(ids: List[str]) -> np.ndarray:
+    return np.array([i.encode("utf-8") for i in ids], dtype=np.bytes_)
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
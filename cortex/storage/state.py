@@ -0,0 +1,167 @@
+import json
+import time
+import threading
+import redis
+from typing import Any, Dict, List, Optional
+from cortex.config import settings
+
+
+# Request-scoped state shared by the API workers, db 0 is scanned as a whole by `load_all_tasks`.
+redis_client = redis.StrictRedis(host=settings.redis_host, port=settings.redis_port, db=4)
+
+
+class SharedState:
+    """
+    A namespace of JSON values, sets and hashes of JSON values kept in Redis, so that every worker
+    and replica sees the same state. Sets keep their members in insertion order.
+    Keys expire `ttl` seconds after their last write or `touch` (never when `ttl` is None).
+    Reads go through a small per-process cache for `local_ttl` seconds, writes of the process refresh it.
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[int] = None, local_ttl: float = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local_ttl = settings.state_local_cache_seconds if local_ttl is None else local_ttl
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _cached(self, key: str, load, cached: bool):
+        if not cached:
+            return load()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        value = load()
+        self._remember({key: value}, now)
+        return value
+
+    def _remember(self, values: dict, now: float):
+        with self._lock:
+            for key, value in values.items():
+                self._local[key] = (now + self.local_ttl, value)
+            # Expired entries are dropped in bulk, the cache only holds the recently read keys
+            if len(self._local) > 1024:
+                self._local = {k: v for k, v in self._local.items() if v[0] > now}
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._local.pop(key, None)
+
+    def get(self, key: str, cached: bool = True) -> Optional[Any]:
+        def load():
+            value = redis_client.get(self._key(key))
+            return None if value is None else json.loads(value)
+        return self._cached(key, load, cached)
+
+    def get_many(self, keys: List[str], cached: bool = True) -> List[Optional[Any]]:
+        """
+        The values of the keys, read in a single round trip for those not in the local cache.
+        """
+        now = time.monotonic()
+        values = {}
+        if cached:
+            with self._lock:
+                for key in keys:
+                    entry = self._local.get(key)
+                    if entry is not None and entry[0] > now:
+                        values[key] = entry[1]
+        missing = [key for key in dict.fromkeys(keys) if key not in values]
+        if missing:
+            loaded = {
+                key: None if value is None else json.loads(value)
+                for key, value in zip(missing, redis_client.mget([self._key(key) for key in missing]))
+            }
+            values.update(loaded)
+            if cached:
+                self._remember(loaded, now)
+        return [values[key] for key in keys]
+
+    def set(self, key: str, value: Any, only_if_absent: bool = False) -> bool:
+        """
+        Store the value, return False when `only_if_absent` and the key already exists.
+        """
+        stored = redis_client.set(self._key(key), json.dumps(value), ex=self.ttl, nx=only_if_absent)
+        self._forget(key)
+        return bool(stored)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """
+        Add to the integer value of the key, missing keys count from 0.
+        """
+        pipe = redis_client.pipeline()
+        pipe.incrby(self._key(key), amount)
+        if self.ttl is not None:
+            pipe.expire(self._key(key), self.ttl)
+        value, *_ = pipe.execute()
+        self._forget(key)
+        return value
+
+    def delete(self, key: str):
+        redis_client.delete(self._key(key))
+        self._forget(key)
+
+    def touch(self, *keys: str):
+        """
+        Restart the expiry of the keys, as a write would.
+        """
+        if self.ttl is None or not keys:
+            return
+        pipe = redis_client.pipeline()
+        for key in keys:
+            pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+
+    def exists(self, key: str) -> bool:
+        return bool(redis_client.exists(self._key(key)))
+
+    def members(self, key: str, cached: bool = True) -> List[str]:
+        return self._cached(key, lambda: [m.decode() for m in redis_client.zrange(self._key(key), 0, -1)], cached)
+
+    def add(self, key: str, *members: str):
+        now = time.time()
+        pipe = redis_client.pipeline()
+        pipe.zadd(self._key(key), {member: now for member in members}, nx=True)
+        if self.ttl is not None:
+            pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+        self._forget(key)
+
+    def remove(self, key: str, *members: str) -> int:
+        """
+        Remove the members from the set, return the number of members left.
+        """
+        pipe = redis_client.pipeline()
+        pipe.zrem(self._key(key), *members)
+        pipe.zcard(self._key(key))
+        _, left = pipe.execute()
+        self._forget(key)
+        return left
+
+    def get_fields(self, key: str, cached: bool = True) -> Dict[str, Any]:
+        def load():
+            fields = redis_client.hgetall(self._key(key))
+            return {field.decode(): json.loads(value) for field, value in fields.items()}
+        return self._cached(key, load, cached)
+
+    def set_fields(self, key: str, fields: Dict[str, Any]):
+        """
+        Store the fields of the hash, leaving its other fields as they are.
+        """
+        if not fields:
+            return
+        pipe = redis_client.pipeline()
+        pipe.hset(self._key(key), mapping={field: json.dumps(value) for field, value in fields.items()})
+        if self.ttl is not None:
+            pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+        self._forget(key)
+
+    def delete_fields(self, key: str, *fields: str):
+        if fields:
+            redis_client.hdel(self._key(key), *fields)
+            self._forget(key)
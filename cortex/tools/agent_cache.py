@@ -0,0 +1,86 @@
+"""
+Process-wide caches of the chat models and compiled agent graphs.
+Compiled graphs hold no conversation state, a graph is shared by every chat with the same settings,
+and the chat models keep their connection pools across messages.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+from cortex.config import settings
+from cortex.tools.default_agent import create_chat_llm, get_default_agent_graph
+from cortex.tools.context_agent import get_context_agent_graph
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache of at most `maxsize` values built on demand.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        # Build outside of the lock, concurrent misses on the same key only cost a duplicate build
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+llm_cache = LRUCache(settings.agent_cache_size)
+graph_cache = LRUCache(settings.agent_cache_size)
+
+
+def model_key(api_key: Optional[str], model: str, base_url: Optional[str]) -> tuple:
+    """
+    Cache key of a chat model, the keys never hold the API key itself.
+    """
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else None
+    return base_url or "openai", model, digest
+
+
+def get_chat_llm(api_key: str = None, model: str = "gpt-4o", base_url: str = None):
+    return llm_cache.get(model_key(api_key, model, base_url), lambda: create_chat_llm(api_key, model, base_url))
+
+
+def get_default_agent(api_key: str = None, model: str = "gpt-4o", base_url: str = None):
+    """
+    The compiled default agent graph of the model.
+    """
+    key = ("default", *model_key(api_key, model, base_url))
+    return graph_cache.get(key, lambda: get_default_agent_graph(llm=get_chat_llm(api_key, model, base_url)))
+
+
+def get_context_agent(
+    embedding_name: str,
+    api_key: str = None,
+    model: str = "gpt-4o",
+    base_url: str = None,
+    top_k: int = 3,
+    search_type: str = "similarity",
+):
+    """
+    The compiled context agent graph of the model, retrieving from the `embedding_name` collection.
+    """
+    key = ("context", *model_key(api_key, model, base_url), embedding_name, top_k, search_type)
+    return graph_cache.get(key, lambda: get_context_agent_graph(
+        embedding_name,
+        llm=get_chat_llm(api_key, model, base_url),
+        top_k=top_k,
+        search_type=search_type,
+    ))
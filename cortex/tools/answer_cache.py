@@ -0,0 +1,89 @@
+"""
+Semantic cache of the answers of the context agent.
+Answers are scoped by collection, write version of the collection, model and retrieval settings,
+and matched by the cosine similarity of the question embeddings. Writing to a collection bumps its
+version: the answers over its previous content are no longer found, and expire with the shared state.
+"""
+import json
+import base64
+import hashlib
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cortex.config import settings
+from cortex.storage import catalog
+from cortex.storage.state import SharedState
+from cortex.retrieval.embedding_models import get_embeddings
+
+
+def _encode(embedding: np.ndarray) -> str:
+    return base64.b64encode(embedding.astype(np.float32).tobytes()).decode("ascii")
+
+
+def _decode(embedding: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class AnswerCache:
+    """
+    Answers of each scope are kept in insertion order, the oldest go beyond `size` answers.
+    A question is answered from the cache when its embedding is at least `threshold` similar to a cached one.
+    """
+
+    def __init__(self, embeddings: Embeddings, threshold: float, size: int):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.size = size
+        self.answers = SharedState("chat:answer", ttl=settings.state_ttl_seconds)
+        self.stats = SharedState("chat:answer:stats")
+
+    def scope(self, collection: str, *settings_key) -> str:
+        """
+        Scope of the answers over the current content of the collection, for the model and retrieval settings.
+        """
+        digest = hashlib.sha256(json.dumps(settings_key).encode("utf-8")).hexdigest()[:16]
+        return f"{collection}:{catalog.get_version(collection)}:{digest}"
+
+    def embed(self, question: str) -> np.ndarray:
+        return _normalize(self.embeddings.embed_query(question))
+
+    def lookup(self, collection: str, scope: str, embedding: np.ndarray) -> Optional[str]:
+        """
+        The cached answer of the most similar question, recording the hit or the miss of the collection.
+        """
+        entries = [json.loads(member) for member in self.answers.members(scope)]
+        if entries:
+            similarities = np.stack([_decode(entry["embedding"]) for entry in entries]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.stats.incr(f"{collection}:hits")
+                return entries[best]["answer"]
+        self.stats.incr(f"{collection}:misses")
+        return None
+
+    def store(self, scope: str, question: str, embedding: np.ndarray, answer: str):
+        member = json.dumps({"question": question, "embedding": _encode(embedding), "answer": answer})
+        self.answers.add(scope, member)
+        members = self.answers.members(scope, cached=False)
+        if len(members) > self.size:
+            self.answers.remove(scope, *members[:len(members) - self.size])
+
+    def get_stats(self, collection: str) -> dict:
+        return {
+            "hits": self.stats.get(f"{collection}:hits", cached=False) or 0,
+            "misses": self.stats.get(f"{collection}:misses", cached=False) or 0,
+        }
+
+
+@lru_cache
+def get_answer_cache() -> AnswerCache:
+    # Questions are embedded like the collections are
+    return AnswerCache(get_embeddings(), settings.answer_cache_threshold, settings.answer_cache_size)
@@ -0,0 +1,77 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, List, Literal, Optional
+
+from langchain_core.messages import AIMessageChunk
+from pydantic import BaseModel
+
+from cortex.tools.agent_cache import get_context_agent, get_default_agent, model_key
+from cortex.tools.answer_cache import get_answer_cache
+from cortex.tools.history import get_history_manager
+
+
+class ChatMessage(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: str
+
+
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage]
+    model: str = "gpt-4o"
+    # Key of the OpenAI models, the Ollama models are served at `base_url` instead
+    api_key: Optional[str] = None
+    base_url: Optional[str] = None
+    # Collection the context agent retrieves from, the default agent answers without context
+    embedding_name: Optional[str] = None
+    top_k: int = 3
+    search_type: Literal["similarity", "mmr"] = "similarity"
+    # Answer an opening question of the context agent from the answers to similar ones
+    use_cache: bool = True
+
+
+def get_chat_graph(request: ChatRequest):
+    if request.embedding_name is None:
+        return get_default_agent(api_key=request.api_key, model=request.model, base_url=request.base_url)
+    return get_context_agent(
+        request.embedding_name,
+        api_key=request.api_key,
+        model=request.model,
+        base_url=request.base_url,
+        top_k=request.top_k,
+        search_type=request.search_type,
+    )
+
+
+async def astream_chat(request: ChatRequest) -> AsyncIterator[str]:
+    """
+    Run the agent on the conversation and yield the tokens of its answer as they are generated.
+    The tool calls of the context agent are not part of the answer.
+    The older turns of a long conversation are sent as a summary, see `HistoryManager`.
+    Closing the iterator stops the agent.
+    """
+    # Only the opening question of a conversation is cached, later ones depend on the previous turns
+    conversation = [message for message in request.messages if message.role != "system"]
+    cached = request.use_cache and request.embedding_name is not None and len(conversation) == 1
+    if cached:
+        answer_cache = get_answer_cache()
+        scope = answer_cache.scope(
+            request.embedding_name, model_key(None, request.model, request.base_url), request.top_k, request.search_type
+        )
+        question = conversation[0].content
+        embedding = await asyncio.to_thread(answer_cache.embed, question)
+        answer = await asyncio.to_thread(answer_cache.lookup, request.embedding_name, scope, embedding)
+        if answer is not None:
+            yield answer
+            return
+
+    graph = get_chat_graph(request)
+    history = get_history_manager(request.api_key, request.model, request.base_url)
+    messages = await asyncio.to_thread(history.compact, [message.model_dump() for message in request.messages])
+    answer = ""
+    async with aclosing(graph.astream({"messages": messages}, stream_mode="messages")) as stream:
+        async for chunk, _ in stream:
+            if isinstance(chunk, AIMessageChunk) and chunk.content and not chunk.tool_call_chunks:
+                answer += chunk.content
+                yield chunk.content
+    if cached and answer:
+        await asyncio.to_thread(answer_cache.store, scope, question, embedding, answer)
@@ -1,7 +1,8 @@
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, MessagesState, START, END
 from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode
+from cortex.retrieval.search import ContextRetriever, get_context_retriever
+from cortex.tools.default_agent import create_chat_llm
 
 
 def get_context_agent_graph(
@@ -9,29 +10,21 @@ def get_context_agent_graph(
         api_key: str = None, 
         model: str = "gpt-4o", 
         base_url: str = None,
+        retriever: ContextRetriever = None,
+        llm=None,
         **kwargs
     ):
+    # The collection is searched in process unless a remote search API is configured
+    retriever = retriever or get_context_retriever()
+
     def _contextual_user_input(original_user_input):
-        # TODO: Get rid of this hard-coded URL or make it invoke the search API from the cortex
-        import requests
-        import json
-
-        url = "http://localhost:8000/api/v1/search"
-
-        payload = json.dumps({
-            "name": embedding_name,
-            "query": original_user_input,
-            "top_k": kwargs.get("top_k", 3),
-            "search_type": kwargs.get("search_type", "similarity"),
-            "content_only": True
-        })
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("POST", url, headers=headers, data=payload)
         try:
-            response.raise_for_status()
-            content_list = response.json()
+            content_list = retriever.retrieve(
+                embedding_name,
+                original_user_input,
+                top_k=kwargs.get("top_k", 3),
+                search_type=kwargs.get("search_type", "similarity"),
+            )
             combined_context = ", ".join([f"context {i+1}: {item}" for i, item in enumerate(content_list)])
             return combined_context
         except Exception as err:
@@ -47,14 +40,7 @@ def get_context_agent_graph(
     tools = [get_similar_context]
     context_node = ToolNode(tools)
 
-    if base_url:
-        from langchain_ollama import ChatOllama
-        llm = ChatOllama(
-            base_url=base_url,
-            model=model
-        ).bind_tools(tools)
-    else:
-        llm = ChatOpenAI(api_key=api_key, model=model).bind_tools(tools)
+    llm = (llm or create_chat_llm(api_key, model, base_url)).bind_tools(tools)
 
     def should_continue(state: MessagesState):
         messages = state["messages"]
@@ -13,19 +13,24 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 
-def get_default_agent_graph(api_key: str = None, model: str = "gpt-4o", base_url: str = None):
-    graph_builder = StateGraph(State)
-
-    from langchain_openai import ChatOpenAI
-
+def create_chat_llm(api_key: str = None, model: str = "gpt-4o", base_url: str = None):
+    """
+    The chat model of the agents, served by Ollama at `base_url` when given, by OpenAI otherwise.
+    """
     if base_url:
         from langchain_ollama import ChatOllama
-        llm = ChatOllama(
+        return ChatOllama(
             base_url=base_url,
             model=model
         )
-    else:
-        llm = ChatOpenAI(api_key=api_key, model=model)
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(api_key=api_key, model=model)
+
+
+def get_default_agent_graph(api_key: str = None, model: str = "gpt-4o", base_url: str = None, llm=None):
+    graph_builder = StateGraph(State)
+
+    llm = llm or create_chat_llm(api_key, model, base_url)
 
 
     def chatbot(state: State):
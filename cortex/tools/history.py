@@ -0,0 +1,157 @@
+"""
+Token-budgeted conversation history of the chat agents.
+The last turns are sent verbatim, the older ones are folded into a rolling summary computed in the background:
+a turn never waits for a summary, it uses the latest one available and the messages after it.
+Summaries are keyed by the hash of the messages they fold, and shared by the API workers.
+"""
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+
+from cortex.config import settings
+from cortex.storage.state import SharedState
+from cortex.retrieval.summarize import TokenCounter
+from cortex.tools.agent_cache import LRUCache, get_chat_llm, model_key
+
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation below, adding onto the previous summary. "
+    "Keep the facts, names, decisions and open questions the conversation may come back to.\n\n"
+    "Previous summary:\n{summary}\n\nNew lines of the conversation:\n{transcript}\n\nNew summary:"
+)
+# Approximate tokens added by the chat format around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Characters per token of the estimate used when the model cannot count its tokens
+CHARS_PER_TOKEN = 4
+
+summaries = SharedState("chat:summary", ttl=settings.state_ttl_seconds)
+# Summaries being computed, so that a single worker folds a given history
+pending_summaries = SharedState("chat:summary:pending", ttl=settings.task_lease_seconds)
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+
+def _prefix_hashes(messages: List[dict]) -> List[str]:
+    # Hash chain over the messages, the i-th hash keys the first i + 1 messages
+    hashes, digest = [], ""
+    for message in messages:
+        digest = hashlib.sha256(
+            (digest + json.dumps([message["role"], message["content"]])).encode("utf-8")
+        ).hexdigest()
+        hashes.append(digest)
+    return hashes
+
+
+def _transcript(messages: List[dict]) -> str:
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+
+class HistoryManager:
+    """
+    Compacts the messages sent to an agent: the system messages, a summary of the older turns,
+    the older messages not summarized yet as long as they fit in `token_budget`, then the last
+    `keep_turns` turns verbatim, whatever their length.
+    """
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        token_budget: int,
+        keep_turns: int,
+        length_function: Optional[Callable[[List[str]], List[int]]] = None,
+    ):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self._count_many = length_function or TokenCounter(llm).count_many
+        self._lock = threading.Lock()
+
+    def _tokens(self, messages: List[dict]) -> List[int]:
+        texts = [message["content"] for message in messages]
+        with self._lock:
+            try:
+                counts = self._count_many(texts)
+            except Exception:
+                # e.g. the Ollama models, whose fallback tokenizer needs transformers
+                self._count_many = lambda texts: [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+                counts = self._count_many(texts)
+        return [count + MESSAGE_OVERHEAD_TOKENS for count in counts]
+
+    def _split(self, conversation: List[dict]) -> int:
+        # Start of the last `keep_turns` turns, each opened by a user message
+        turns = 0
+        for i in range(len(conversation) - 1, -1, -1):
+            if conversation[i]["role"] == "user":
+                turns += 1
+                if turns == self.keep_turns:
+                    return i
+        return 0
+
+    def _fold(self, older: List[dict], hashes: List[str], start: int, summary: str):
+        key = hashes[-1]
+        try:
+            response = self.llm.invoke(SUMMARY_PROMPT.format(
+                summary=summary or "(none)", transcript=_transcript(older[start:])
+            ))
+            summaries.set(key, response.content)
+        finally:
+            pending_summaries.delete(key)
+
+    def _latest_summary(self, older: List[dict]) -> tuple:
+        """
+        The summary of the longest folded prefix of the older messages, and the length of the prefix.
+        Folds the whole of them in the background when they are not summarized yet.
+        """
+        hashes = _prefix_hashes(older)
+        # The summaries of every prefix are read at once, the longest summarized prefix wins
+        found = summaries.get_many(hashes)
+        if found[-1] is not None:
+            return found[-1], len(older)
+        start, summary = 0, None
+        for i in range(len(older) - 1, 0, -1):
+            if found[i - 1] is not None:
+                start, summary = i, found[i - 1]
+                break
+        if pending_summaries.set(hashes[-1], True, only_if_absent=True):
+            _summary_executor.submit(self._fold, older, hashes, start, summary)
+        return summary, start
+
+    def compact(self, messages: List[dict]) -> List[dict]:
+        """
+        The messages to send to the agent for this conversation, within the token budget.
+        """
+        head = 0
+        while head < len(messages) and messages[head]["role"] == "system":
+            head += 1
+        system, conversation = messages[:head], messages[head:]
+        split = self._split(conversation)
+        older, recent = conversation[:split], conversation[split:]
+
+        summary, start = self._latest_summary(older) if older else (None, 0)
+        if summary is not None:
+            system = system + [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}]
+        # Older messages not folded yet are kept as long as they fit, the newest first
+        candidates = older[start:]
+        budget = self.token_budget - sum(self._tokens(system + recent))
+        kept = len(candidates)
+        for tokens in reversed(self._tokens(candidates)):
+            if budget - tokens < 0:
+                break
+            budget -= tokens
+            kept -= 1
+        return system + candidates[kept:] + recent
+
+
+_history_managers = LRUCache(settings.agent_cache_size)
+
+
+def get_history_manager(api_key: str = None, model: str = "gpt-4o", base_url: str = None) -> HistoryManager:
+    """
+    The history manager of the model, summarizing with the chat model itself.
+    """
+    return _history_managers.get(model_key(api_key, model, base_url), lambda: HistoryManager(
+        get_chat_llm(api_key, model, base_url), settings.history_token_budget, settings.history_keep_turns
+    ))
@@ -2,6 +2,8 @@ import sys
 import os
 from pathlib import Path
 
+import pytest
+
 
 # Add the project root to sys.path, solve the import error
 sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
@@ -9,4 +11,19 @@ test_env_path = str(Path(__file__).parent / ".env")
 if not os.path.exists(test_env_path):
     print("Environment file not found. Please run 'cp .env.example .env' to create it.")
     sys.exit(1)
-os.environ["ENV_FILE_PATH"] = "tests/.env"
\ No newline at end of file
+os.environ["ENV_FILE_PATH"] = "tests/.env"
+# The embedding module logs to the log_dir of the test settings
+os.makedirs(Path(__file__).parent / "logs", exist_ok=True)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Point the Redis clients of the storage modules at an in-memory server, each on its own db.
+    """
+    import fakeredis
+    from cortex.storage import catalog, state, tasks
+    server = fakeredis.FakeServer()
+    for module, db in ((tasks, 0), (catalog, 3), (state, 4)):
+        monkeypatch.setattr(module, "redis_client", fakeredis.FakeStrictRedis(server=server, db=db))
+    return server
@@ -0,0 +1,28 @@
+from cortex.tools.agent_cache import LRUCache, model_key
+
+
+def test_lru_cache_builds_on_misses_only():
+    cache = LRUCache(maxsize=2)
+    built = []
+
+    def build(key):
+        return lambda: built.append(key) or f"value of {key}"
+
+    assert cache.get("a", build("a")) == "value of a"
+    assert cache.get("a", build("a")) == "value of a"
+    cache.get("b", build("b"))
+    # "a" was used last, "b" is evicted for "c"
+    cache.get("a", build("a"))
+    cache.get("c", build("c"))
+    cache.get("a", build("a"))
+    cache.get("b", build("b"))
+    assert built == ["a", "b", "c", "b"]
+
+
+def test_model_key():
+    key = model_key("sk-secret", "gpt-4o", None)
+    assert key == model_key("sk-secret", "gpt-4o", None)
+    assert "sk-secret" not in str(key)
+    assert key != model_key("sk-other", "gpt-4o", None)
+    assert key != model_key("sk-secret", "gpt-4o-mini", None)
+    assert model_key(None, "llama3", "http://ollama:11434") == ("http://ollama:11434", "llama3", None)
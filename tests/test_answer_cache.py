@@ -0,0 +1,63 @@
+from langchain_core.embeddings import Embeddings
+
+from cortex.storage import catalog
+from cortex.tools.answer_cache import AnswerCache
+
+
+class TopicEmbeddings(Embeddings):
+    """
+    Questions about the same topic embed close to each other.
+    """
+    TOPICS = {"fox": [1.0, 0.0, 0.0], "dog": [0.0, 1.0, 0.0], "cat": [0.0, 0.0, 1.0]}
+
+    def embed_query(self, text):
+        vector = [0.0, 0.0, 0.0]
+        for topic, direction in self.TOPICS.items():
+            if topic in text:
+                vector = [v + d for v, d in zip(vector, direction)]
+        # A little noise, rephrasings are similar but not identical
+        vector[0] += 0.01 * len(text)
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _ask(cache: AnswerCache, question: str):
+    scope = cache.scope("docs", "gpt-4o", 3, "similarity")
+    return scope, cache.embed(question)
+
+
+def test_similar_question_hits(fake_redis):
+    cache = AnswerCache(TopicEmbeddings(), threshold=0.95, size=8)
+    scope, embedding = _ask(cache, "what does the dog eat?")
+    assert cache.lookup("docs", scope, embedding) is None
+    cache.store(scope, "what does the dog eat?", embedding, "Kibble.")
+
+    scope, embedding = _ask(cache, "what does the dog eat")
+    assert cache.lookup("docs", scope, embedding) == "Kibble."
+    scope, embedding = _ask(cache, "what does the cat eat?")
+    assert cache.lookup("docs", scope, embedding) is None
+    assert cache.get_stats("docs") == {"hits": 1, "misses": 2}
+
+
+def test_writing_to_the_collection_misses(fake_redis):
+    cache = AnswerCache(TopicEmbeddings(), threshold=0.95, size=8)
+    scope, embedding = _ask(cache, "what does the dog eat?")
+    cache.store(scope, "what does the dog eat?", embedding, "Kibble.")
+    assert cache.lookup("docs", *_ask(cache, "what does the dog eat?")) == "Kibble."
+
+    catalog.add_chunks("docs", "dogs.txt")
+    assert cache.lookup("docs", *_ask(cache, "what does the dog eat?")) is None
+    # Other settings have their own answers
+    other_scope = cache.scope("docs", "gpt-4o-mini", 3, "similarity")
+    assert cache.lookup("docs", other_scope, cache.embed("what does the dog eat?")) is None
+
+
+def test_oldest_answers_are_evicted(fake_redis):
+    cache = AnswerCache(TopicEmbeddings(), threshold=0.95, size=2)
+    for question in ("the fox?", "the dog?", "the cat?"):
+        scope, embedding = _ask(cache, question)
+        cache.store(scope, question, embedding, f"About {question}")
+    assert cache.lookup("docs", *_ask(cache, "the fox?")) is None
+    assert cache.lookup("docs", *_ask(cache, "the cat?")) == "About the cat?"
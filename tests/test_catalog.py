@@ -0,0 +1,55 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from cortex.storage import catalog
+from cortex.retrieval import embedding
+from cortex.retrieval.backends import VectorBackend
+
+
+def test_add_chunks_and_remove_tag(fake_redis):
+    catalog.add_chunks("docs", "a.txt", 3)
+    catalog.add_chunks("docs", "a.txt", 2)
+    catalog.add_chunks("docs", "b.txt")
+    assert catalog.list_collections() == {"docs"}
+    assert catalog.get_tag_counts("docs") == {"a.txt": 5, "b.txt": 1}
+
+    version = catalog.get_version("docs")
+    catalog.remove_tag("docs", "a.txt")
+    assert catalog.get_tag_counts("docs") == {"b.txt": 1}
+    assert catalog.get_version("docs") > version
+
+
+def test_rebuild_catalog_replaces_it(fake_redis):
+    catalog.add_chunks("stale", "a.txt", 3)
+    assert not catalog.is_catalog_built("chroma:/data:1")
+
+    catalog.rebuild_catalog({"docs": {"b.txt": 4}, "empty": {}}, source="chroma:/data:1")
+    assert catalog.is_catalog_built("chroma:/data:1")
+    assert catalog.list_collections() == {"docs", "empty"}
+    assert catalog.get_tag_counts("docs") == {"b.txt": 4}
+    assert catalog.get_tag_counts("stale") is None
+    # A catalog scanned from another store, e.g. a folder created again, is stale
+    assert not catalog.is_catalog_built("chroma:/data:2")
+
+
+def test_rebuild_catalog_bumps_versions(fake_redis):
+    catalog.add_chunks("docs", "a.txt")
+    version = catalog.get_version("docs")
+    catalog.rebuild_catalog({"docs": {"a.txt": 1}})
+    assert catalog.get_version("docs") > version
+
+
+def test_embedding_task_counts_persisted_chunks_only(fake_redis, monkeypatch):
+    class UnflushableBackend(VectorBackend):
+        def _add(self, collection, ids, texts, embeddings, metadatas):
+            pass
+
+        def flush(self, collection):
+            raise OSError("disk full")
+
+    backend = UnflushableBackend(embeddings=DeterministicFakeEmbedding(size=4))
+    monkeypatch.setattr(embedding, "get_backend", lambda: backend)
+    embedding.initialize_embedding_task("task")
+    with pytest.raises(OSError):
+        embedding.start_embedding_task("docs", "a.txt", "task", ["one", "two"])
+    assert catalog.get_tag_counts("docs") is None
@@ -0,0 +1,70 @@
+import json
+import asyncio
+
+from fastapi import FastAPI
+
+from cortex.admin.authenticate import verify_bearer_token
+from cortex.middleware import LogRequestsMiddleware
+from cortex.routers import chat
+
+
+def test_stream_stops_when_the_client_disconnects(monkeypatch):
+    closed = []
+
+    async def endless_answer(request):
+        try:
+            while True:
+                await asyncio.sleep(0)
+                yield "token "
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(chat, "astream_chat", endless_answer)
+    app = FastAPI()
+    app.include_router(chat.router)
+    app.dependency_overrides[verify_bearer_token] = lambda: None
+    # Disconnections are seen through the logging middleware
+    app.add_middleware(LogRequestsMiddleware)
+
+    async def run() -> list:
+        sent = []
+        read_enough = asyncio.Event()
+        body = json.dumps({"messages": [{"role": "user", "content": "Hello"}]}).encode()
+        received = []
+
+        async def receive():
+            if not received:
+                received.append(body)
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The client goes away after reading a few tokens
+            await read_enough.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if sum(message["type"] == "http.response.body" for message in sent) >= 5:
+                read_enough.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/v1/chat",
+            "raw_path": b"/api/v1/chat",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        await asyncio.wait_for(app(scope, receive, send), timeout=10)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]["status"] == 200
+    assert closed == [True]
+    tokens = [message for message in sent if message["type"] == "http.response.body" and message.get("body")]
+    assert tokens[0]["body"] == b'data: {"token": "token "}\n\n'
+    assert not any(b"event: done" in message["body"] for message in tokens)
@@ -0,0 +1,40 @@
+import os
+import time
+from cortex.storage.conversion_cache import ConversionCache
+
+
+def test_conversion_cache_by_content(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"), budget_bytes=2 ** 20)
+    (tmp_path / "a.pdf").write_bytes(b"same content")
+    (tmp_path / "b.pdf").write_bytes(b"same content")
+    options = {"do_ocr": False}
+    key = ConversionCache.key(str(tmp_path / "a.pdf"), options)
+
+    assert cache.get(key) is None
+    cache.put(key, "# Title", '{"name": "a"}')
+    assert ConversionCache.key(str(tmp_path / "b.pdf"), options) == key
+    assert ConversionCache.key(str(tmp_path / "b.pdf"), {"do_ocr": True}) != key
+    assert cache.get(key) == "# Title"
+    assert cache.get_json(key) == {"name": "a"}
+
+
+def test_conversion_cache_evicts_least_recently_used(tmp_path):
+    cache = ConversionCache(str(tmp_path), budget_bytes=250)
+    for name in ("first", "second", "third"):
+        cache.put(name, "x" * 100, "{}")
+        time.sleep(0.01)
+    assert cache.get("first") is None
+    assert cache.get("third") == "x" * 100
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_entry_evicted_while_read(tmp_path, monkeypatch):
+    cache = ConversionCache(str(tmp_path), budget_bytes=2 ** 20)
+    cache.put("key", "# Title", "{}")
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    # Another worker evicts the entry between the read of its markdown and the update of its time
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get("key") == "# Title"
@@ -0,0 +1,24 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from cortex.retrieval.converter_pool import ConverterPool, _ready
+
+
+def test_pool_restarts_once_a_worker_died(monkeypatch):
+    # Workers without a converter, only the pool management is under test
+    monkeypatch.setattr(
+        ConverterPool, "_create_executor",
+        lambda self: ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")),
+    )
+    pool = ConverterPool(1)
+    try:
+        pid = pool._submit(_ready).result()
+        with pytest.raises(BrokenProcessPool):
+            pool._submit(os._exit, 1).result()
+        assert pool._submit(_ready).result() != pid
+    finally:
+        pool.shutdown()
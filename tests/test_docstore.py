@@ -0,0 +1,34 @@
+from langchain_core.documents import Document
+from cortex.storage.docstore import ColumnarDocstore
+
+
+def test_columnar_docstore_round_trip(tmp_path):
+    documents = [
+        Document(page_content=f"chunk {i} – ünïcode", metadata={"source": "essay.txt", "row": i})
+        for i in range(100)
+    ]
+    ColumnarDocstore.write(str(tmp_path), documents, ids=[f"id-{i}" for i in range(100)])
+
+    docstore = ColumnarDocstore(str(tmp_path))
+    assert ColumnarDocstore.exists(str(tmp_path))
+    assert len(docstore) == 100
+    doc = docstore.get(42)
+    assert doc.id == "id-42"
+    assert doc.page_content == "chunk 42 – ünïcode"
+    assert doc.metadata == {"source": "essay.txt", "row": 42}
+
+
+def test_columnar_docstore_empty_metadata(tmp_path):
+    ColumnarDocstore.write(str(tmp_path), [Document(page_content="only text")])
+    doc = ColumnarDocstore(str(tmp_path)).get(0)
+    assert doc.page_content == "only text"
+    assert doc.metadata == {}
+
+
+def test_columnar_docstore_append(tmp_path):
+    ColumnarDocstore.write(str(tmp_path), [Document(page_content="first")], ids=["a"])
+    rows = ColumnarDocstore.append(str(tmp_path), [Document(page_content="second", metadata={"v": 2})], ids=["b"])
+    docstore = ColumnarDocstore(str(tmp_path))
+    assert list(rows) == [1]
+    assert docstore.get(0).page_content == "first"
+    assert docstore.get(1) == Document(id="b", page_content="second", metadata={"v": 2})
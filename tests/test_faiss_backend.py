@@ -0,0 +1,166 @@
+import pytest
+import numpy as np
+from cortex.retrieval.backends import VectorBackend
+
+
+def _vectors(count, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(count, dim)).astype("float32")
+
+
+@pytest.fixture(params=["flat", "ivfpq", "hnsw"])
+def backend(request, tmp_path):
+    options = {"nlist": 4, "pq_m": 8, "pq_nbits": 4, "nprobe": 4} if request.param == "ivfpq" else {}
+    return VectorBackend.of("faiss", persist_directory=str(tmp_path), index_type=request.param, index_options=options)
+
+
+def _fill(backend, count=800):
+    vectors = _vectors(count)
+    backend.add_texts(
+        "test",
+        texts=[f"text {i}" for i in range(count)],
+        metadatas=[{"source": "even" if i % 2 == 0 else "odd"} for i in range(count)],
+        ids=[str(i) for i in range(count)],
+        embeddings=vectors.tolist(),
+    )
+    backend.flush("test")
+    return vectors
+
+
+def test_search_returns_nearest(backend):
+    vectors = _fill(backend)
+    results = backend.search_by_vector("test", vectors[7].tolist(), k=3)
+    assert results[0][0].id == "7"
+    assert results[0][0].page_content == "text 7"
+
+
+def test_search_filters_by_tag(backend):
+    vectors = _fill(backend)
+    results = backend.search_by_vector("test", vectors[7].tolist(), k=5, tags=["even"])
+    assert len(results) == 5
+    assert all(doc.metadata["source"] == "even" for doc, _ in results)
+
+
+def test_delete_and_reload(backend, tmp_path):
+    vectors = _fill(backend)
+    backend.delete("test", tag="odd")
+    assert backend.tag_counts("test") == {"even": 400}
+    backend.flush("test")
+    reloaded = VectorBackend.of(
+        "faiss", persist_directory=str(tmp_path), index_type=backend.index_type, index_options=backend.index_options
+    )
+    results = reloaded.search_by_vector("test", vectors[7].tolist(), k=5)
+    assert all(doc.metadata["source"] == "even" for doc, _ in results)
+    assert reloaded.list_collections() == ["test"]
+
+
+def test_sharded_search_matches_single_index(tmp_path):
+    from cortex.retrieval.backends.sharded import ShardedBackend
+    single = VectorBackend.of("faiss", persist_directory=str(tmp_path / "single"))
+    sharded = ShardedBackend(VectorBackend.of("faiss", persist_directory=str(tmp_path / "sharded")), shards=4)
+    vectors = _fill(single)
+    _fill(sharded)
+    assert sharded.list_collections() == ["test"]
+    assert sharded.tag_counts("test") == {"even": 400, "odd": 400}
+    for i in (3, 42, 777):
+        expected = [doc.id for doc, _ in single.search_by_vector("test", vectors[i].tolist(), k=10, tags=["odd"])]
+        actual = [doc.id for doc, _ in sharded.search_by_vector("test", vectors[i].tolist(), k=10, tags=["odd"])]
+        assert actual == expected
+    sharded.delete("test", tag="odd")
+    assert sharded.tag_counts("test") == {"even": 400}
+
+
+def test_other_process_sees_flushed_writes(tmp_path):
+    writer = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    reader = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    vectors = _fill(writer)
+    assert reader.search_by_vector("test", vectors[7].tolist(), k=1)[0][0].id == "7"
+    extra = _vectors(1, seed=1)
+    writer.add_texts("test", texts=["extra"], metadatas=[{"source": "extra"}], ids=["extra"], embeddings=extra.tolist())
+    assert reader.search_by_vector("test", extra[0].tolist(), k=1)[0][0].id != "extra"
+    writer.flush("test")
+    assert reader.search_by_vector("test", extra[0].tolist(), k=1)[0][0].id == "extra"
+
+
+def test_writers_are_serialized(tmp_path):
+    import threading
+    first = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    second = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    vectors = _vectors(2)
+    first.add_texts("test", texts=["first"], ids=["first"], embeddings=vectors[:1].tolist())
+
+    def write_second():
+        second.add_texts("test", texts=["second"], ids=["second"], embeddings=vectors[1:].tolist())
+        second.flush("test")
+
+    thread = threading.Thread(target=write_second)
+    thread.start()
+    thread.join(timeout=0.5)
+    assert thread.is_alive()
+    first.flush("test")
+    thread.join()
+    # The second writer started from the index of the first one instead of overwriting it
+    reloaded = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    assert {doc.id for doc, _ in reloaded.search_by_vector("test", vectors[0].tolist(), k=2)} == {"first", "second"}
+
+
+def test_similarity_score_threshold(tmp_path):
+    from langchain_core.embeddings import Embeddings
+    vectors = _vectors(100)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    class QueryEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [vectors[int(text)].tolist() for text in texts]
+
+        def embed_query(self, text):
+            return vectors[int(text)].tolist()
+
+    backend = VectorBackend.of("faiss", persist_directory=str(tmp_path), embeddings=QueryEmbeddings())
+    backend.add_texts("test", texts=[str(i) for i in range(100)], ids=[str(i) for i in range(100)])
+    results = backend.search("test", "7", top_k=5, search_type="similarity_score_threshold", score_threshold=0.9)
+    assert [doc.id for doc in results] == ["7"]
+    assert len(backend.search("test", "7", top_k=5, search_type="similarity_score_threshold", score_threshold=-10)) == 5
+
+
+def test_store_id_changes_with_the_folder(tmp_path):
+    import shutil
+    store_id = VectorBackend.of("faiss", persist_directory=str(tmp_path / "store")).store_id()
+    assert VectorBackend.of("faiss", persist_directory=str(tmp_path / "store")).store_id() == store_id
+    shutil.rmtree(tmp_path / "store")
+    (tmp_path / "other").mkdir()
+    assert VectorBackend.of("faiss", persist_directory=str(tmp_path / "store")).store_id() != store_id
+
+
+def test_waiting_writer_does_not_block_searches(tmp_path):
+    import os
+    import threading
+    first = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    second = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    vectors = _fill(first)
+    index_stamp = os.stat(tmp_path / "test" / "index.faiss").st_mtime_ns
+    first.delete("test", ids=["1"])
+    # Deletions are persisted by the flush, like the additions
+    assert os.stat(tmp_path / "test" / "index.faiss").st_mtime_ns == index_stamp
+
+    thread = threading.Thread(target=second.delete, args=("test",), kwargs={"ids": ["2"]})
+    thread.start()
+    thread.join(timeout=0.5)
+    assert thread.is_alive()
+    assert second.search_by_vector("test", vectors[7].tolist(), k=1)[0][0].id == "7"
+    first.flush("test")
+    thread.join()
+    second.flush("test")
+    reloaded = VectorBackend.of("faiss", persist_directory=str(tmp_path))
+    assert {"1", "2"}.isdisjoint(doc.id for doc, _ in reloaded.search_by_vector("test", vectors[1].tolist(), k=5))
+
+
+def test_sharded_listing_keeps_names_like_shards(tmp_path):
+    from cortex.retrieval.backends.sharded import ShardedBackend
+    sharded = ShardedBackend(
+        VectorBackend.of("faiss", persist_directory=str(tmp_path)), shards=1, shards_by_collection={"test": 2}
+    )
+    _fill(sharded, count=20)
+    vectors = _vectors(1)
+    sharded.add_texts("notes-shard-1", texts=["note"], ids=["note"], embeddings=vectors.tolist())
+    assert sharded.list_collections() == ["notes-shard-1", "test"]
@@ -0,0 +1,194 @@
+import os
+import threading
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from cortex.config import settings
+from cortex.storage import state
+
+
+TEXT = "The quick brown fox jumps over the lazy dog.\n" * 100
+
+
+class FailingEmbeddings(DeterministicFakeEmbedding):
+    def embed_documents(self, texts):
+        raise RuntimeError("embedding service down")
+
+
+@pytest.fixture
+def files(fake_redis, tmp_path, monkeypatch):
+    from cortex.retrieval import file_index
+    from cortex.routers import files
+    monkeypatch.setattr(settings, "upload_folder", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "temp_index_folder", str(tmp_path / "indexes"))
+    os.makedirs(settings.upload_folder)
+    monkeypatch.setattr(file_index, "get_file_embeddings", lambda: DeterministicFakeEmbedding(size=16))
+    return files
+
+
+def _upload(files, session_id: str, text: str = TEXT) -> str:
+    file_id = files.content_file_id(text)
+    if files.register_upload(session_id, file_id):
+        files.process_file(file_id, text, "notes.txt", session_id)
+    return file_id
+
+
+def test_deduplicated_upload_is_deleted_with_its_last_reference(files):
+    file_id = _upload(files, "first")
+    # The same content uploaded by another session is attached without indexing it again
+    assert not files.register_upload("second", file_id)
+    assert files.session_files.members("second", cached=False) == [file_id]
+    assert files.file_sessions.members(file_id, cached=False) == ["first", "second"]
+
+    files.detach_file("first", file_id)
+    assert files.index_exists(file_id)
+    files.detach_file("second", file_id)
+    assert not files.index_exists(file_id)
+    assert not os.path.exists(os.path.join(settings.upload_folder, file_id))
+
+
+def test_references_expire_with_the_sessions(files):
+    file_id = _upload(files, "first")
+    assert 0 < state.redis_client.ttl(f"files:refs:{file_id}") <= settings.state_ttl_seconds
+    # Once the references are gone, the sweep deletes the file
+    files.file_sessions.delete(file_id)
+    files.sweep_files()
+    assert not files.index_exists(file_id)
+
+
+def test_failed_indexing_drops_the_references(files):
+    file_id = _upload(files, "first", text="")
+    assert files.progress_status.get(file_id, cached=False)["status"].startswith("Error")
+    assert not files.file_sessions.exists(file_id)
+    assert not files.pending_files.exists(file_id)
+
+
+def test_failed_update_keeps_the_previous_version(files, monkeypatch):
+    from cortex.retrieval import file_index
+    file_id = _upload(files, "first")
+    new_text = TEXT + "One more line.\n"
+    new_file_id = files.content_file_id(new_text)
+    assert files.register_upload("first", new_file_id)
+
+    monkeypatch.setattr(file_index, "get_file_embeddings", lambda: FailingEmbeddings(size=16))
+    files.update_file(file_id, new_file_id, new_text, "notes.txt", "first")
+    assert files.progress_status.get(new_file_id, cached=False)["status"].startswith("Error")
+    assert files.session_files.members("first", cached=False) == [file_id]
+    assert files.index_exists(file_id)
+    assert not os.path.exists(files.get_index_folder(new_file_id))
+    assert not os.path.exists(os.path.join(settings.upload_folder, new_file_id))
+
+
+def test_update_moves_the_session_to_the_new_version(files):
+    file_id = _upload(files, "first")
+    new_text = TEXT + "One more line.\n"
+    new_file_id = files.content_file_id(new_text)
+    assert files.register_upload("first", new_file_id)
+
+    files.update_file(file_id, new_file_id, new_text, "notes.txt", "first")
+    assert files.session_files.members("first", cached=False) == [new_file_id]
+    assert files.index_exists(new_file_id)
+    assert not files.index_exists(file_id)
+
+
+def test_upload_of_the_previous_version_waits_for_the_update(files, monkeypatch):
+    from cortex.retrieval import file_index
+    file_id = _upload(files, "first")
+    new_text = TEXT + "One more line.\n"
+    new_file_id = files.content_file_id(new_text)
+    assert files.register_upload("first", new_file_id)
+    embedding = threading.Event()
+    release = threading.Event()
+
+    class SlowEmbeddings(DeterministicFakeEmbedding):
+        def embed_documents(self, texts):
+            embedding.set()
+            release.wait(5)
+            return super().embed_documents(texts)
+
+    monkeypatch.setattr(file_index, "get_file_embeddings", lambda: SlowEmbeddings(size=16))
+    update = threading.Thread(target=files.update_file, args=(file_id, new_file_id, new_text, "notes.txt", "first"))
+    update.start()
+    embedding.wait(5)
+    # The index of the previous version is being moved, it has to be indexed again for the second session
+    registered = []
+    upload = threading.Thread(target=lambda: registered.append(files.register_upload("second", file_id)))
+    upload.start()
+    upload.join(0.2)
+    assert upload.is_alive()
+    release.set()
+    update.join()
+    upload.join()
+    assert registered == [True]
+    files.process_file(file_id, TEXT, "notes.txt", "second")
+    assert files.session_files.members("first", cached=False) == [new_file_id]
+    assert files.session_files.members("second", cached=False) == [file_id]
+    assert files.index_exists(file_id) and files.index_exists(new_file_id)
+
+
+def test_updates_embed_outside_of_the_lock(files, monkeypatch):
+    from cortex.retrieval import file_index
+    first, second = _upload(files, "first"), _upload(files, "second", text="Another text.\n" * 100)
+    release = threading.Event()
+
+    class SlowEmbeddings(DeterministicFakeEmbedding):
+        def embed_documents(self, texts):
+            if "slow" in texts[0]:
+                release.wait(5)
+            return super().embed_documents(texts)
+
+    monkeypatch.setattr(file_index, "get_file_embeddings", lambda: SlowEmbeddings(size=16))
+    slow = threading.Thread(
+        target=file_index.update_file_index, args=(files.get_index_folder(first), [Document("slow chunk")])
+    )
+    slow.start()
+    # Neither the other files nor the same file wait for the embedding of the slow update
+    for file_id in (second, first):
+        stats = file_index.update_file_index(files.get_index_folder(file_id), [Document(f"fast chunk of {file_id}")])
+        assert stats["added"] == 1
+    assert slow.is_alive()
+    release.set()
+    slow.join()
+    assert file_index.update_file_index(files.get_index_folder(first), [Document("slow chunk")]) == {
+        "kept": 1, "added": 0, "removed": 0
+    }
+
+
+@pytest.fixture
+def client(files):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    app = FastAPI()
+    app.include_router(files.router)
+    os.makedirs(os.path.join(settings.upload_folder, "0123456789abcdef"))
+    with open(os.path.join(settings.upload_folder, "0123456789abcdef", "notes.txt"), "w") as f:
+        f.write(TEXT)
+    return TestClient(app)
+
+
+def test_raw_file_range(client):
+    response = client.get("/files/file/0123456789abcdef/raw", headers={"range": "bytes=4-8"})
+    assert response.status_code == 206
+    assert response.text == "quick"
+    assert response.headers["content-range"] == f"bytes 4-8/{len(TEXT)}"
+    response = client.get("/files/file/0123456789abcdef/raw", headers={"range": f"bytes={len(TEXT)}-"})
+    assert response.status_code == 416
+
+
+def test_raw_file_conditional(client):
+    response = client.get("/files/file/0123456789abcdef/raw")
+    assert response.status_code == 200
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = client.get("/files/file/0123456789abcdef/raw", headers={"if-none-match": if_none_match})
+        assert response.status_code == 304
+    assert client.get("/files/file/0123456789abcdef/raw", headers={"if-none-match": '"other"'}).status_code == 200
+
+    assert client.get("/files/file/0123456789abcdef/raw", headers={"if-modified-since": last_modified}).status_code == 304
+    # A date without a zone is GMT too
+    naive = last_modified.replace("GMT", "-0000")
+    assert client.get("/files/file/0123456789abcdef/raw", headers={"if-modified-since": naive}).status_code == 304
+    earlier = "Thu, 01 Jan 1970 00:00:00 GMT"
+    assert client.get("/files/file/0123456789abcdef/raw", headers={"if-modified-since": earlier}).status_code == 200
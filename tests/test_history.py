@@ -0,0 +1,60 @@
+import time
+
+from langchain_core.language_models import FakeListChatModel
+
+from cortex.tools import history
+from cortex.tools.history import HistoryManager, MESSAGE_OVERHEAD_TOKENS
+
+
+def _words(texts):
+    return [len(text.split()) for text in texts]
+
+
+def _conversation(turns: int) -> list:
+    messages = [{"role": "system", "content": "You are helpful."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * 20})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "word " * 20})
+    return messages
+
+
+def _wait_for_summary(messages: list):
+    key = history._prefix_hashes(messages)[-1]
+    for _ in range(100):
+        if not history.pending_summaries.exists(key):
+            return
+        time.sleep(0.05)
+
+
+def test_short_conversation_is_kept(fake_redis):
+    manager = HistoryManager(FakeListChatModel(responses=["summary"]), 1000, 2, length_function=_words)
+    messages = _conversation(3)
+    assert manager.compact(messages) == messages
+
+
+def test_long_conversation_keeps_the_last_turns(fake_redis):
+    llm = FakeListChatModel(responses=["They asked questions 0 to 5."])
+    # Room for the system message and the last 2 turns only
+    budget = 4 + 2 * 2 * (22 + MESSAGE_OVERHEAD_TOKENS) + 10
+    manager = HistoryManager(llm, budget, 2, length_function=_words)
+    messages = _conversation(8)
+
+    compacted = manager.compact(messages)
+    assert compacted[0] == messages[0]
+    assert compacted[-4:] == messages[-4:]
+    assert len(compacted) == 5
+
+    # The older turns are summarized in the background, the next turn sends the summary instead
+    _wait_for_summary(messages[1:-4])
+    compacted = manager.compact(messages)
+    assert compacted[:2] == [
+        messages[0],
+        {"role": "system", "content": "Summary of the earlier conversation:\nThey asked questions 0 to 5."},
+    ]
+    assert compacted[2:] == messages[-4:]
+
+
+def test_last_turns_are_kept_beyond_the_budget(fake_redis):
+    manager = HistoryManager(FakeListChatModel(responses=["summary"]), 10, 1, length_function=_words)
+    messages = _conversation(3)
+    assert manager.compact(messages)[-2:] == messages[-2:]
@@ -0,0 +1,102 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from cortex.config import settings
+from cortex.storage import catalog
+from cortex.retrieval.backends import VectorBackend
+
+
+@pytest.fixture
+def backend(fake_redis, tmp_path, monkeypatch):
+    from cortex.retrieval import embedding, ingest, sync
+    backend = VectorBackend.of(
+        "faiss", persist_directory=str(tmp_path / "store"), embeddings=DeterministicFakeEmbedding(size=16)
+    )
+    for module in (embedding, ingest, sync):
+        monkeypatch.setattr(module, "get_backend", lambda: backend)
+    monkeypatch.setattr(settings, "embeddings_dir", str(tmp_path / "store"))
+    monkeypatch.setattr(settings, "conversion_cache_dir", str(tmp_path / "conversion_cache"))
+    return backend
+
+
+def _write_files(directory, count: int):
+    directory.mkdir(exist_ok=True)
+    for i in range(count):
+        (directory / f"note-{i}.txt").write_text(f"Note number {i}.")
+
+
+def test_ingest_more_files_than_the_queues_hold(backend, tmp_path):
+    from cortex.retrieval.ingest import ingest_directory
+    _write_files(tmp_path / "notes", 300)
+    report = ingest_directory(str(tmp_path / "notes"), "notes", workers=2)
+    assert report["files"] == 300
+    assert report["failures"] == {}
+    assert report["stages"]["embed"]["files"] == 300
+    assert len(backend.tag_counts("notes")) == 300
+    assert len(catalog.get_tag_counts("notes")) == 300
+
+
+class BrokenExecutor(ProcessPoolExecutor):
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+
+def test_ingest_returns_once_the_pools_are_broken(backend, tmp_path, monkeypatch):
+    from cortex.retrieval import ingest
+
+    def broken_converter_pool():
+        raise RuntimeError("no converter")
+
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", BrokenExecutor)
+    monkeypatch.setattr(ingest, "get_converter_pool", broken_converter_pool)
+    _write_files(tmp_path / "notes", 3)
+    (tmp_path / "notes" / "paper.pdf").write_bytes(b"%PDF-1.4")
+
+    reports = []
+    run = threading.Thread(
+        target=lambda: reports.append(ingest.ingest_directory(str(tmp_path / "notes"), "notes", workers=2)),
+        daemon=True,
+    )
+    run.start()
+    run.join(timeout=30)
+    assert not run.is_alive()
+    assert reports[0]["failures"] == {
+        "note-0.txt": "chunk: A child process terminated abruptly",
+        "note-1.txt": "chunk: A child process terminated abruptly",
+        "note-2.txt": "chunk: A child process terminated abruptly",
+        "paper.pdf": "convert: no converter",
+    }
+
+
+def test_sync_ingests_the_changes_only(backend, tmp_path):
+    from cortex.retrieval.sync import manifests, sync_folder, sync_locks
+    notes = tmp_path / "notes"
+    _write_files(notes, 300)
+    result = sync_folder(str(notes), "notes", workers=2)
+    assert (result["added"], result["updated"], result["removed"], result["unchanged"]) == (300, 0, 0, 0)
+    assert not sync_locks.exists("notes")
+    ids = manifests.get_fields("notes", cached=False)["note-0.txt"]["ids"]
+
+    (notes / "note-0.txt").write_text("Note number zero, rewritten.")
+    os.utime(notes / "note-1.txt", (0, 0))
+    (notes / "note-2.txt").unlink()
+    (notes / "new.txt").write_text("A new note.")
+    result = sync_folder(str(notes), "notes", workers=2)
+    assert (result["added"], result["updated"], result["removed"], result["unchanged"]) == (1, 1, 1, 298)
+    assert result["report"]["files"] == 2
+
+    manifest = manifests.get_fields("notes", cached=False)
+    assert manifest["note-0.txt"]["ids"] != ids
+    assert manifest["note-1.txt"]["mtime"] == 0
+    assert "note-2.txt" not in manifest and "new.txt" in manifest
+    tags = backend.tag_counts("notes")
+    assert "note-2.txt" not in tags and tags["new.txt"] == 1 and tags["note-0.txt"] == 1
+    assert catalog.get_tag_counts("notes") == tags
+
+    result = sync_folder(str(notes), "notes", workers=2)
+    assert (result["added"], result["updated"], result["removed"], result["unchanged"]) == (0, 0, 0, 300)
@@ -0,0 +1,53 @@
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+from cortex.retrieval.backends import VectorBackend
+
+
+pytestmark = pytest.mark.skipif(not os.environ.get("PG_DSN"), reason="PG_DSN is not set")
+
+
+@pytest.fixture
+def backend():
+    from sqlalchemy import create_engine, text
+    engine = create_engine(os.environ["PG_DSN"])
+    table = f"test_chunks_{uuid.uuid4().hex[:8]}"
+    yield VectorBackend.of("pgvector", engine=engine, dimensions=16, table=table, ef_search=16)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def _add(backend, collection: str, vectors: np.ndarray):
+    backend.add_texts(
+        collection,
+        texts=[f"{collection} {i}" for i in range(len(vectors))],
+        metadatas=[{"source": "even" if i % 2 == 0 else "odd"} for i in range(len(vectors))],
+        ids=[str(i) for i in range(len(vectors))],
+        embeddings=vectors.tolist(),
+    )
+
+
+def test_small_collection_of_a_large_table(backend):
+    rng = np.random.default_rng(0)
+    _add(backend, "large", rng.normal(size=(5000, 16)).astype("float32"))
+    small = rng.normal(size=(50, 16)).astype("float32")
+    _add(backend, "small", small)
+
+    found = 0
+    for i in range(0, 50, 7):
+        distances = np.linalg.norm(small - small[i], axis=1)
+        expected = {str(row) for row in np.argsort(distances)[:10]}
+        results = backend.search_by_vector("small", small[i].tolist(), k=10)
+        assert len(results) == 10
+        found += len(expected & {doc.id for doc, _ in results})
+        assert all(doc.page_content.startswith("small") for doc, _ in results)
+        assert [distance for _, distance in results] == sorted(distance for _, distance in results)
+
+        results = backend.search_by_vector("small", small[i].tolist(), k=10, tags=["odd"])
+        assert len(results) == 10
+        assert all(doc.metadata["source"] == "odd" for doc, _ in results)
+    # The HNSW search is approximate
+    assert found / (10 * len(range(0, 50, 7))) >= 0.9
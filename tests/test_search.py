@@ -0,0 +1,39 @@
+import json
+
+import httpx
+
+from cortex.retrieval.search import RemoteContextRetriever
+
+
+def test_remote_retriever_calls_the_search_api(monkeypatch):
+    requests, clients = [], []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=["first chunk", "second chunk"])
+
+    client_class = httpx.Client
+
+    def mock_client(**kwargs):
+        clients.append(client_class(transport=httpx.MockTransport(handle), **kwargs))
+        return clients[-1]
+
+    monkeypatch.setattr(httpx, "Client", mock_client)
+    retriever = RemoteContextRetriever("http://search.internal:8000", token="secret")
+    for _ in range(2):
+        chunks = retriever.retrieve("docs", "what is cortex?", top_k=2, search_type="mmr", fetch_k=8)
+        assert chunks == ["first chunk", "second chunk"]
+
+    assert str(requests[0].url) == "http://search.internal:8000/api/v1/search/"
+    assert requests[0].headers["authorization"] == "Bearer secret"
+    assert json.loads(requests[0].content) == {
+        "name": "docs",
+        "tags": [],
+        "query": "what is cortex?",
+        "top_k": 2,
+        "search_type": "mmr",
+        "content_only": True,
+        "opts": {"fetch_k": 8},
+    }
+    # The calls share the pooled client of the retriever
+    assert len(requests) == 2 and len(clients) == 1
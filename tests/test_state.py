@@ -0,0 +1,74 @@
+from cortex.storage import state
+from cortex.storage.state import SharedState
+
+
+def test_set_only_if_absent(fake_redis):
+    locks = SharedState("test:locks")
+    assert locks.set("a", True, only_if_absent=True)
+    assert not locks.set("a", False, only_if_absent=True)
+    assert locks.get("a", cached=False) is True
+
+
+def test_incr_counts_from_zero(fake_redis):
+    counters = SharedState("test:counters")
+    assert counters.incr("hits") == 1
+    assert counters.incr("hits", 2) == 3
+    assert counters.get("hits", cached=False) == 3
+
+
+def test_keys_expire_after_writes_and_touches(fake_redis):
+    values = SharedState("test:values", ttl=60)
+    values.set("a", 1)
+    values.add("b", "x")
+    values.incr("c")
+    for key in ("a", "b", "c"):
+        assert 0 < state.redis_client.ttl(f"test:values:{key}") <= 60
+    state.redis_client.expire("test:values:b", 5)
+    values.touch("b")
+    assert state.redis_client.ttl("test:values:b") > 5
+    SharedState("test:forever").set("a", 1)
+    assert state.redis_client.ttl("test:forever:a") == -1
+
+
+def test_local_cache_is_invalidated_by_writes(fake_redis):
+    values = SharedState("test:values", local_ttl=60)
+    other_worker = SharedState("test:values", local_ttl=60)
+    values.set("a", 1)
+    assert other_worker.get("a") == 1
+    values.set("a", 2)
+    # The other worker reads its local copy until it expires, the writer sees its own write
+    assert other_worker.get("a") == 1
+    assert other_worker.get("a", cached=False) == 2
+    assert values.get("a") == 2
+
+    values.add("set", "x")
+    assert values.members("set") == ["x"]
+    values.add("set", "y")
+    assert values.members("set") == ["x", "y"]
+    assert values.remove("set", "x") == 1
+    assert values.members("set") == ["y"]
+
+
+def test_hash_fields_are_written_one_by_one(fake_redis):
+    values = SharedState("test:hashes", ttl=60)
+    values.set_fields("h", {"a": {"n": 1}, "b": [2]})
+    values.set_fields("h", {"b": [3]})
+    values.delete_fields("h", "a")
+    assert values.get_fields("h") == {"b": [3]}
+    assert values.get_fields("missing") == {}
+    assert 0 < state.redis_client.ttl("test:hashes:h") <= 60
+
+
+def test_get_many_in_one_round_trip(fake_redis, monkeypatch):
+    values = SharedState("test:values", local_ttl=60)
+    values.set("a", 1)
+    values.set("c", {"n": 3})
+    assert values.get("a") == 1
+    reads = []
+    mget = state.redis_client.mget
+    monkeypatch.setattr(state.redis_client, "mget", lambda keys: reads.append(keys) or mget(keys))
+    assert values.get_many(["a", "b", "c", "b"]) == [1, None, {"n": 3}, None]
+    # "a" was in the local cache, the other keys are read together
+    assert reads == [["test:values:b", "test:values:c"]]
+    assert values.get_many(["b", "c"]) == [None, {"n": 3}]
+    assert len(reads) == 1
@@ -0,0 +1,100 @@
+import asyncio
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+
+from cortex.retrieval.summarize import TokenCounter, build_summarize_graph
+
+
+class ConcurrencyModel:
+    """
+    Answers after a short delay, recording the most map and reduce calls running at once.
+    """
+
+    def __init__(self):
+        self.running = {"map": 0, "reduce": 0}
+        self.peak = {"map": 0, "reduce": 0}
+
+    async def ainvoke(self, prompt):
+        step = "reduce" if "set of summaries" in prompt.to_string() else "map"
+        self.running[step] += 1
+        self.peak[step] = max(self.peak[step], self.running[step])
+        await asyncio.sleep(0.01)
+        self.running[step] -= 1
+        # Map summaries are long enough to be collapsed, collapsed ones are short
+        return AIMessage("word " * 10 if step == "map" else "collapsed")
+
+
+def _words(documents):
+    return sum(len(doc.page_content.split()) for doc in documents)
+
+
+def test_collapse_calls_are_bounded():
+    llm = ConcurrencyModel()
+    app = build_summarize_graph(llm, token_max=25, max_concurrency=2, length_function=_words)
+    state = asyncio.run(app.ainvoke({"contents": [f"document {i}" for i in range(12)]}, {"max_concurrency": 3}))
+    assert state["final_summary"] == "collapsed"
+    # The 12 summaries of 10 words are collapsed by pairs, 6 groups for 2 slots
+    assert len(state["collapsed_summaries"]) == 6
+    assert llm.peak == {"map": 3, "reduce": 2}
+
+
+class CountingModel:
+    """
+    Counts the words of the texts, recording the texts it was asked to count.
+    """
+
+    def __init__(self):
+        self.counted = []
+
+    def get_num_tokens(self, text):
+        self.counted.append(text)
+        return len(text.split())
+
+
+class WordEncoding:
+    def __init__(self):
+        self.batches = []
+
+    def encode_batch(self, texts, disallowed_special=()):
+        self.batches.append(texts)
+        return [text.split() for text in texts]
+
+
+class EncodingModel(CountingModel):
+    def __init__(self):
+        super().__init__()
+        self.encoding = WordEncoding()
+
+    def _get_encoding_model(self):
+        return "words", self.encoding
+
+
+def test_token_counts_are_memoized():
+    llm = CountingModel()
+    counter = TokenCounter(llm)
+    documents = [Document("one two"), Document("three"), Document("one two")]
+    assert counter(documents) == 5
+    assert counter(documents + [Document("four five six")]) == 8
+    assert llm.counted == ["one two", "three", "four five six"]
+
+
+def test_least_recently_counted_texts_are_evicted():
+    llm = CountingModel()
+    counter = TokenCounter(llm, maxsize=2)
+    assert counter.count_many(["a", "b c"]) == [1, 2]
+    assert counter.count_many(["a", "d e f"]) == [1, 3]
+    # "b c" was the least recently counted, then "d e f"
+    assert counter.count_many(["b c", "a"]) == [2, 1]
+    assert llm.counted == ["a", "b c", "d e f", "b c"]
+    assert counter.count_many(["a", "d e f"]) == [1, 3]
+    assert llm.counted[4:] == ["d e f"]
+
+
+def test_new_texts_are_encoded_in_one_batch():
+    llm = EncodingModel()
+    counter = TokenCounter(llm)
+    assert counter.count_many(["one two", "three", "one two"]) == [2, 1, 2]
+    assert counter.count_many(["three", "four five"]) == [1, 2]
+    assert llm.encoding.batches == [["one two", "three"], ["four five"]]
+    assert llm.counted == []
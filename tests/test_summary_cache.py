@@ -0,0 +1,90 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+from cortex.config import settings
+from cortex.retrieval import summary_cache
+from cortex.retrieval.summary_cache import normalize_url, summarize_with_cache
+
+
+def test_normalize_url():
+    assert normalize_url(" HTTPS://Example.COM:443/a?b=2&a=1#top ") == "https://example.com/a?a=1&b=2"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/?q=") == "http://example.com:8080/?q="
+
+
+class Site:
+    """
+    Serves a page with an ETag, answering 304 to the requests that have it.
+    """
+
+    def __init__(self, body: str):
+        self.body = body
+        self.requests = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        etag = f'"{len(self.body)}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        return httpx.Response(200, text=self.body, headers={"etag": etag})
+
+
+@pytest.fixture
+def site(fake_redis, monkeypatch):
+    site = Site("First version.")
+    monkeypatch.setattr(summary_cache, "http_client", httpx.Client(transport=httpx.MockTransport(site.handle)))
+    return site
+
+
+def test_unchanged_page_is_revalidated(site):
+    calls = []
+
+    def summarize(response):
+        calls.append(response.text)
+        return f"Summary of {response.text}"
+
+    assert summarize_with_cache("https://example.com/page", "gpt", "prompt", summarize) == "Summary of First version."
+    # Same page under another spelling, revalidated without being downloaded or summarized again
+    assert summarize_with_cache("https://EXAMPLE.com/page#intro", "gpt", "prompt", summarize) == "Summary of First version."
+    assert site.requests[1].headers["if-none-match"] == '"14"'
+    assert calls == ["First version."]
+
+    # The docling conversion of the page has its own summary
+    summarize_with_cache("https://example.com/page", "gpt", "prompt", summarize, enable_docling=True)
+    assert len(calls) == 2
+
+    site.body = "Second, longer version."
+    assert summarize_with_cache("https://example.com/page", "gpt", "prompt", summarize) == "Summary of Second, longer version."
+    assert calls[-1] == "Second, longer version."
+
+
+def test_requests_per_host_are_limited(monkeypatch):
+    running, peak = {}, {}
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        running[host] = running.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), running[host])
+        await asyncio.sleep(0.01)
+        running[host] -= 1
+        return httpx.Response(200, text="page")
+
+    monkeypatch.setattr(settings, "fetch_per_host_limit", 2)
+    # A single idle host is kept, the hosts with requests are kept nonetheless
+    monkeypatch.setattr(summary_cache, "HOST_LIMITS_SIZE", 1)
+    monkeypatch.setattr(summary_cache, "_host_limits", OrderedDict())
+
+    async def fetch_all():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handle)) as client:
+            monkeypatch.setattr(summary_cache, "async_http_client", client)
+            urls = [f"https://{host}.com/{i}" for i in range(8) for host in ("a", "b", "c")]
+            await asyncio.gather(*(summary_cache._afetch(url) for url in urls))
+            # Idle hosts are evicted by the next fetches
+            await summary_cache._afetch("https://d.com/0")
+
+    asyncio.run(fetch_all())
+    assert peak == {"a.com": 2, "b.com": 2, "c.com": 2, "d.com": 1}
+    assert list(summary_cache._host_limits) == ["d.com"]